@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Compare the JSON backends on a synthetic queryJobs results payload.
+
+Usage: PYTHONPATH=. python benchmarks/json_backend.py [rows]
+"""
+from __future__ import print_function
+
+import json
+import sys
+import timeit
+
+from usql import jsonbackend
+
+
+def results_payload(rows):
+    items = []
+    for i in range(rows):
+        items.append(
+            {
+                "rowData": {
+                    "upt_hostname": "host-%d" % (i % 50),
+                    "upt_asset_id": "5f0c-%d" % (i % 50),
+                    "upt_day": 20200101 + i % 7,
+                    "pid": i,
+                    "path": "/usr/local/bin/process-%d" % i,
+                    "cmdline": "process-%d --flag value --other %d" % (i, i * 3),
+                    "upt_time": "2020-01-01 00:00:%02d.000" % (i % 60),
+                },
+                "asset": {"id": "5f0c-%d" % (i % 50), "hostName": "host-%d" % i},
+            }
+        )
+    return json.dumps({"items": items}).encode("utf-8")
+
+
+def main(rows=20000):
+    payload = results_payload(rows)
+    print("payload: %.1f MB, %d rows" % (len(payload) / 1e6, rows))
+
+    def stdlib_str():
+        json.loads(payload.decode("utf-8"))
+
+    baseline = min(timeit.repeat(stdlib_str, number=1, repeat=5))
+    print("%-22s %8.1f ms" % ("json (decode + loads)", baseline * 1000))
+    for name, loads in jsonbackend.BACKENDS.items():
+        best = min(timeit.repeat(lambda: loads(payload), number=1, repeat=5))
+        print("%-22s %8.1f ms  %.2fx" % (name, best * 1000, baseline / best))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
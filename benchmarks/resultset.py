@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Compare building query rows as tuples with the columnar ResultSet.
+
+Usage: PYTHONPATH=. python benchmarks/resultset.py [rows]
+"""
+from __future__ import print_function
+
+import json
+import sys
+import timeit
+import tracemalloc
+
+from usql.resultset import ResultSet
+
+COLUMNS = ["upt_hostname", "upt_asset_id", "upt_day", "pid", "path", "cmdline"]
+
+
+def row_tuples(items):
+    rows = []
+    for item in items:
+        row = []
+        for col in COLUMNS:
+            if col in item["rowData"]:
+                row.append(item["rowData"][col])
+            else:
+                row.append(None)
+        rows.append(tuple(row))
+    return rows
+
+
+def columnar(items):
+    result = ResultSet(COLUMNS)
+    result.extend(items)
+    return result
+
+
+def main(rows=100000):
+    payload = json.dumps(
+        [
+            {
+                "rowData": {
+                    "upt_hostname": "host-%d" % (i % 50),
+                    "upt_asset_id": "5f0c6a4e-%d" % (i % 50),
+                    "upt_day": "2020010%d" % (i % 7),
+                    "pid": "%d" % i,
+                    "path": "/usr/local/bin/process-%d" % i,
+                    "cmdline": "process-%d --flag" % i,
+                }
+            }
+            for i in range(rows)
+        ]
+    )
+    items = json.loads(payload)
+    for build in (row_tuples, columnar):
+        best = min(timeit.repeat(lambda: build(items), number=1, repeat=5))
+        # Measure what stays in memory once the decoded items are gone, as
+        # repeated values are distinct objects when they come from the API.
+        tracemalloc.start()
+        result = build(json.loads(payload))
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del result
+        print("%-10s %8.1f ms %8.1f MB" % (build.__name__, best * 1000, retained / 1e6))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -50,6 +50,7 @@ setup(
     long_description=readme,
     long_description_content_type="text/markdown",
     install_requires=install_requirements,
+    extras_require={"streaming": ["ijson >= 3.1"], "async": ["aiohttp >= 3.7"]},
     # cmdclass={"test": test, "lint": lint},
     entry_points={
         "console_scripts": ["usql = usql.main:cli"],
@@ -1,9 +1,12 @@
 from __future__ import print_function
 
+import json
 import os
 import pytest
+from mock import Mock
 from utils import create_db, db_connection, drop_tables
 import usql.sqlexecute
+from usql.main import UsqlCli
 
 
 @pytest.yield_fixture(scope="function")
@@ -28,6 +31,32 @@ def executor(connection):
     return usql.sqlexecute.SQLExecute(database="_test_db")
 
 
+@pytest.fixture
+def fake_cli(tmpdir):
+    """Return a function that makes a UsqlCli printing csv whose API calls
+    are answered by *request*, a stand-in for Session.request. The other
+    keyword arguments are passed to its SQLExecute."""
+
+    def make(request, database="global", **kwargs):
+        keyfile = tmpdir.join("apikey.json")
+        keyfile.write(
+            json.dumps(
+                {"domain": "example", "customerId": "cid", "key": "k", "secret": "s"}
+            )
+        )
+        usqlrc = os.path.join(os.path.dirname(usql.sqlexecute.__file__), "usqlrc")
+        cli = UsqlCli(usqlrc=usqlrc, keyfile=str(keyfile))
+        cli.formatter.format_name = "csv"
+        session = Mock()
+        session.request.side_effect = request
+        cli.sqlexecute = usql.sqlexecute.SQLExecute(
+            cli.url, "cid", "k", "s", database, True, session=session, **kwargs
+        )
+        return cli
+
+    return make
+
+
 @pytest.fixture
 def exception_formatter():
     return lambda e: str(e)
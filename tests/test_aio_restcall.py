@@ -0,0 +1,140 @@
+import asyncio
+import json
+
+import pytest
+
+from usql.aio_restcall import AsyncClient
+from usql.uptycs_restcall import OperationalError, QueryTimeoutError
+
+
+class FakeResponse(object):
+    def __init__(self, body, status=200):
+        self.status = status
+        self.headers = {}
+        self.body = json.dumps(body).encode("utf-8")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def read(self):
+        return self.body
+
+
+class FakeSession(object):
+    """aiohttp session stand-in serving query jobs that finish on their
+    second status poll and return one row per page of two rows. The job
+    of host "slow" never finishes."""
+
+    def __init__(self):
+        self.requests = []
+        self.polls = {}
+
+    def request(self, method, url, json=None, params=None, headers=None):
+        self.requests.append((method, url.split("/queryJobs")[1]))
+        assert headers["Authorization"].startswith("Bearer ")
+        if method == "POST":
+            if "broken" in json["query"]:
+                return FakeResponse({"id": "broken"})
+            return FakeResponse({"id": json["filters"]["hostName"]})
+        query_id = url.split("/queryJobs/")[1].split("/")[0]
+        if url.endswith("/results"):
+            offset = params["offset"]
+            item = {"rowData": {"pid": offset}, "asset": {"hostName": query_id}}
+            return FakeResponse({"items": [item] if offset < 3 else []})
+        if method == "GET":
+            self.polls[query_id] = self.polls.get(query_id, 0) + 1
+            if query_id == "broken":
+                error = {"message": {"brief": "syntax error"}}
+                return FakeResponse({"status": "ERROR", "error": error})
+            finished = self.polls[query_id] > 1 and query_id != "slow"
+            status = "FINISHED" if finished else "RUNNING"
+            return FakeResponse({"status": status, "columns": [{"name": "pid"}]})
+        return FakeResponse({})
+
+
+def make_client(session, **kwargs):
+    return AsyncClient(
+        "https://example.uptycs.io",
+        "cid",
+        "key",
+        "secret",
+        session=session,
+        poll_initial_interval=0.01,
+        result_page_size=1,
+        **kwargs
+    )
+
+
+def test_many_queries_run_concurrently_on_one_client():
+    session = FakeSession()
+    client = make_client(session)
+
+    async def run():
+        return await asyncio.gather(
+            *[
+                client.query("select pid from processes", "realtime", hostname=host)
+                for host in ("web1", "web2", "web3")
+            ]
+        )
+
+    results = asyncio.run(run())
+
+    for host, (description, rows) in zip(("web1", "web2", "web3"), results):
+        assert [d[0] for d in description] == ["hostName", "pid"]
+        assert rows == [(host, 0), (host, 1), (host, 2)]
+    deleted = sorted(url for method, url in session.requests if method == "DELETE")
+    assert deleted == ["/web1", "/web2", "/web3"]
+
+
+def test_failed_and_cancelled_jobs_are_deleted():
+    session = FakeSession()
+    client = make_client(session)
+
+    with pytest.raises(OperationalError, match="syntax error"):
+        asyncio.run(client.query("select broken"))
+    asyncio.run(client.cancel("web1"))
+
+    assert session.requests[-3:] == [
+        ("DELETE", "/broken"),
+        ("PUT", "/web1"),
+        ("DELETE", "/web1"),
+    ]
+
+
+def test_flaky_requests_are_retried():
+    session = FakeSession()
+    request = session.request
+    failures = [ConnectionResetError("connection reset"), FakeResponse({}, status=503)]
+
+    def flaky(method, url, **kwargs):
+        if method == "GET" and failures:
+            failure = failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return failure
+        return request(method, url, **kwargs)
+
+    session.request = flaky
+    client = make_client(session, retry_initial_interval=0.01)
+
+    description, rows = asyncio.run(
+        client.query("select pid from processes", "realtime", hostname="web1")
+    )
+    assert rows == [("web1", 0), ("web1", 1), ("web1", 2)]
+    assert client.retries == 2
+
+
+def test_job_is_cancelled_when_wait_times_out():
+    session = FakeSession()
+    client = make_client(session)
+
+    with pytest.raises(QueryTimeoutError):
+        asyncio.run(
+            client.query(
+                "select pid from processes", "realtime", timeout=0.05, hostname="slow"
+            )
+        )
+    assert session.requests[-2:] == [("PUT", "/slow"), ("DELETE", "/slow")]
@@ -0,0 +1,45 @@
+from mock import Mock
+
+from usql.backoff import Backoff, CircuitBreaker, retry_after
+
+
+def test_backoff_grows_to_cap():
+    backoff = Backoff(initial=0.05, maximum=1.0, factor=2.0, jitter=0)
+    delays = [backoff.next_delay() for _ in range(8)]
+    assert delays[:3] == [0.05, 0.1, 0.2]
+    assert delays[-1] == 1.0
+
+
+def test_backoff_jitter_stays_in_bounds():
+    backoff = Backoff(initial=1.0, maximum=10.0, factor=1.0, jitter=0.5)
+    for _ in range(100):
+        assert 0.5 <= backoff.next_delay() <= 1.5
+
+
+def test_backoff_honors_hint_below_cap():
+    backoff = Backoff(initial=0.05, maximum=5.0, jitter=0)
+    assert backoff.next_delay(hint=2.0) == 2.0
+    assert backoff.next_delay(hint=60.0) == 5.0
+
+
+def test_retry_after():
+    assert retry_after(Mock(headers={"Retry-After": "3"})) == 3.0
+    assert retry_after(Mock(headers={})) is None
+    assert retry_after(Mock(headers={"Retry-After": "soon"})) is None
+
+
+def test_circuit_breaker_opens_and_probes():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+
+    breaker.opened -= 60
+    # one probe goes through, the others wait for its outcome
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.allow()
+    assert not breaker.is_open
@@ -0,0 +1,104 @@
+import json
+import threading
+
+from mock import Mock
+
+from usql.cleanup import JobCleaner
+
+URL = "https://example.uptycs.io/public/api/customers/cid/queryJobs/"
+
+
+def make_session(codes):
+    """Session stand-in answering DELETEs with the status codes in *codes*,
+    then with 200."""
+    session = Mock()
+    deleted = threading.Event()
+
+    def request(method, url, **kwargs):
+        assert method == "DELETE"
+        if not codes:
+            deleted.set()
+        return Mock(status_code=codes.pop(0) if codes else 200)
+
+    session.request.side_effect = request
+    return session, deleted
+
+
+def test_deletes_are_batched_in_the_background():
+    session, deleted = make_session([])
+    cleaner = JobCleaner(session, dict, batch_delay=0.05)
+
+    cleaner.delete(URL + "a")
+    cleaner.delete(URL + "b")
+    assert not session.request.called
+
+    assert deleted.wait(5)
+    cleaner.close()
+    urls = sorted(c[0][1] for c in session.request.call_args_list)
+    assert urls == [URL + "a", URL + "b"]
+    assert cleaner.pending() == []
+
+
+def test_failed_deletes_are_retried_and_saved_for_the_next_session(tmpdir):
+    path = str(tmpdir.join("pending_deletes"))
+    session, _ = make_session([500, 500])
+    cleaner = JobCleaner(session, dict, path=path, batch_delay=60)
+    cleaner.delete(URL + "a")
+    # the worker is still gathering its first batch
+    cleaner.close(timeout=0)
+    assert json.load(open(path)) == [URL + "a"]
+
+    session, deleted = make_session([500])
+    cleaner = JobCleaner(session, dict, path=path, batch_delay=0, retry_interval=0.01)
+    assert deleted.wait(5)
+    cleaner.close()
+    assert session.request.call_count == 2
+    assert not tmpdir.join("pending_deletes").exists()
+
+
+def test_queued_deletes_are_saved_before_they_are_sent(tmpdir):
+    path = tmpdir.join("pending_deletes")
+    session, _ = make_session([])
+    cleaner = JobCleaner(session, dict, path=str(path), batch_delay=60)
+    # saved meanwhile by another session
+    path.write(json.dumps([URL + "b"]))
+
+    cleaner.delete(URL + "a")
+    # a session killed now leaves both to the next one
+    assert json.load(path.open()) == [URL + "a", URL + "b"]
+
+    cleaner.close()
+    assert json.load(path.open()) == [URL + "b"]
+
+
+def test_close_stops_sending_deletes_at_its_timeout(tmpdir):
+    import time
+
+    path = str(tmpdir.join("pending_deletes"))
+    failed = []
+    all_failed = threading.Event()
+    timeouts = []
+
+    def request(method, url, timeout=None, **kwargs):
+        if len(failed) < 4:
+            failed.append(url)
+            if len(failed) == 4:
+                all_failed.set()
+            return Mock(status_code=500)
+        # the API has become unreachable: every DELETE hangs until its timeout
+        timeouts.append(timeout)
+        time.sleep(min(timeout, 0.2))
+        return Mock(status_code=504)
+
+    session = Mock()
+    session.request.side_effect = request
+    cleaner = JobCleaner(session, dict, path=path, batch_delay=0, retry_interval=60)
+    for job in "abcd":
+        cleaner.delete(URL + job)
+    assert all_failed.wait(5)
+
+    start = time.time()
+    cleaner.close(timeout=0.3)
+    assert time.time() - start < 0.6
+    assert all(timeout <= 0.3 for timeout in timeouts)
+    assert len(json.load(open(path))) == 4
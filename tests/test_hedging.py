@@ -0,0 +1,70 @@
+import threading
+
+from mock import Mock
+
+from usql.hedging import Hedger
+
+
+def learned_hedger(latency=0.01, **kwargs):
+    hedger = Hedger(min_samples=5, **kwargs)
+    hedger.latencies[None].extend([latency] * 100)
+    return hedger
+
+
+def test_nothing_is_hedged_before_latencies_are_known():
+    hedger = Hedger(min_samples=5)
+    send = Mock(return_value="response")
+    assert hedger.delay() is None
+    assert hedger.run(send) == "response"
+    assert send.call_count == 1
+    assert len(hedger.latencies[None]) == 1
+
+
+def test_latencies_are_kept_per_kind_of_request():
+    hedger = Hedger(min_samples=5)
+    hedger.latencies["results"].extend([2.0] * 100)
+    hedger.latencies["status"].extend([0.01] * 100)
+    assert hedger.delay("results") == 2.0
+    assert hedger.delay("status") == 0.01
+    assert hedger.delay("other") is None
+
+    hedger.run(Mock(return_value="response"), "status")
+    assert len(hedger.latencies["status"]) == 101
+    assert len(hedger.latencies["results"]) == 100
+
+
+def test_slow_request_is_hedged_and_loser_closed():
+    hedger = learned_hedger(max_ratio=1)
+    release = threading.Event()
+    slow, fast = Mock(), Mock()
+    responses = [slow, fast]
+
+    def send():
+        response = responses.pop(0)
+        if response is slow:
+            assert release.wait(5)
+        return response
+
+    assert hedger.run(send) is fast
+    assert hedger.hedged == 1
+    release.set()
+    hedger.executor().shutdown(wait=True)
+    slow.close.assert_called_once_with()
+    assert not fast.close.called
+
+
+def test_hedging_rate_is_capped():
+    hedger = learned_hedger(max_ratio=0.5)
+    calls = []
+
+    def send():
+        calls.append(1)
+        threading.Event().wait(0.05)
+        return Mock()
+
+    for _ in range(4):
+        hedger.run(send)
+    hedger.executor().shutdown(wait=True)
+    # every request is slow, but only half of them may be hedged
+    assert hedger.hedged == 2
+    assert len(calls) == 6
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+from mock import Mock
+
+from usql.jobs import JobManager
+from usql.sqlexecute import SQLExecute
+from usql.uptycs_restcall import OperationalError
+
+
+class FakeCursor(object):
+    """Connection snapshot that blocks its query until *release* is set."""
+
+    def __init__(self, release):
+        self.release = release
+        self.progress = Mock()
+        self.active_jobs = None
+        self.description = None
+        self.rowcount = -1
+        self.rows = []
+
+    def clone(self):
+        return FakeCursor(self.release)
+
+    def execute(self, sql):
+        assert self.release.wait(5)
+        if sql == "select broken":
+            raise OperationalError("broken")
+        self.description = [("pid",)]
+        self.rows = [(1,), (2,)]
+
+    def fetchall(self):
+        return self.rows
+
+
+def make_executor(release):
+    executor = SQLExecute(
+        "https://example.uptycs.io", "cid", "key", "secret", None, True
+    )
+    executor.conn = FakeCursor(release)
+    return executor
+
+
+def test_jobs_run_in_the_background_until_brought_to_the_foreground():
+    release = threading.Event()
+    executor = make_executor(release)
+    jobs = JobManager(2)
+
+    first = jobs.submit(executor, "select pid from processes")
+    second = jobs.submit(executor, "select broken")
+    assert first.cursor is not executor.conn
+    assert first.cursor.progress is None
+    assert [row[:2] for row in jobs.rows()] == [(1, "running"), (2, "running")]
+    assert jobs.notices() == []
+
+    release.set()
+    assert jobs.foreground(1) == (None, [(1,), (2,)], ["pid"], "2 rows in set")
+    second.future.result()
+    assert [row[:2] for row in jobs.rows()] == [(2, "failed")]
+    assert jobs.notices() == ["[2] failed  select broken"]
+    assert jobs.notices() == []
+
+    with pytest.raises(OperationalError):
+        jobs.foreground()
+    with pytest.raises(KeyError):
+        jobs.foreground()
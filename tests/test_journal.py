@@ -0,0 +1,25 @@
+from usql.journal import JobJournal
+
+
+def test_journal_keeps_jobs_until_deleted(tmpdir):
+    path = str(tmpdir.join("jobs"))
+    journal = JobJournal(path, max_lines=3)
+    query = {"type": "timemachine", "query": "select 1", "filters": {"from": "x"}}
+    journal.record("a", query)
+    journal.record("b", dict(query, type="global"))
+    journal.delete("a")
+    tmpdir.join("jobs").write("{cut short", mode="a")
+
+    # another session reads what this one wrote
+    entries = JobJournal(path).entries()
+    assert [e["id"] for e in entries] == ["b"]
+    assert entries[0]["database"] == "global"
+    assert entries[0]["sql"] == "select 1"
+    assert JobJournal(path).get("a") is None
+
+    # the next session does not lose its first job to the cut short line,
+    # and deleted jobs are dropped once the file grows past max_lines
+    journal = JobJournal(path, max_lines=3)
+    journal.record("c", query)
+    assert len(tmpdir.join("jobs").readlines()) == 2
+    assert [e["id"] for e in journal.entries()] == ["b", "c"]
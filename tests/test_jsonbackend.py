@@ -0,0 +1,26 @@
+import json
+
+import pytest
+
+from usql import jsonbackend
+
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    yield
+    jsonbackend.set_backend("auto")
+
+
+def test_loads_parses_bytes():
+    payload = json.dumps({"items": [{"rowData": {"a": "é"}}]}).encode("utf-8")
+    for loads in jsonbackend.BACKENDS.values():
+        assert loads(payload) == {"items": [{"rowData": {"a": "é"}}]}
+
+
+def test_set_backend():
+    assert jsonbackend.set_backend("json") == "json"
+    assert jsonbackend.loads is json.loads
+
+
+def test_set_unknown_backend_falls_back_to_auto():
+    assert jsonbackend.set_backend("nope") == next(iter(jsonbackend.BACKENDS))
@@ -8,11 +8,11 @@ from click.testing import CliRunner
 
 from usql.main import cli, UsqlCli
 from usql.packages.special.main import COMMANDS as SPECIAL_COMMANDS
-from utils import dbtest, run
+from utils import FakeResponse, dbtest, fake_realtime_job, run
 
 test_dir = os.path.abspath(os.path.dirname(__file__))
 project_dir = os.path.dirname(test_dir)
-default_config_file = os.path.join(project_dir, "tests", "usqlrc")
+default_config_file = os.path.join(project_dir, "usql", "usqlrc")
 
 CLI_ARGS = ["--usqlrc", default_config_file, "_test_db"]
 
@@ -238,3 +238,65 @@ def test_reserved_space_is_integer():
     lc = UsqlCli()
     assert isinstance(lc.get_reserved_space(), int)
     click.get_terminal_size = old_func
+
+
+def test_realtime_rows_are_output_while_hosts_respond(fake_cli, monkeypatch):
+    from mock import Mock, patch
+
+    job = fake_realtime_job(
+        ["RUNNING", "RUNNING", "RUNNING", "FINISHED"], [("a", 1), ("b", 2), ("c", 3)]
+    )
+    # the lines printed by the time of every status request
+    printed = []
+
+    def request(method, url, **kwargs):
+        if method == "GET" and not url.endswith("/results"):
+            printed.append(list(lines))
+        return job(method, url, **kwargs)
+
+    m = fake_cli(request, "realtime", progress=Mock())
+    lines = []
+    monkeypatch.setattr(click, "echo", lambda line, **kwargs: lines.append(line))
+
+    with patch("usql.uptycs_restcall.time.sleep"):
+        m.output_results(m.sqlexecute.run("select pid from processes"))
+    m.sqlexecute.close()
+
+    # the rows of the first hosts are out while the last one is running
+    assert ['"hostName","pid"', '"a","1"', '"b","2"'] in printed
+    assert lines == ['"hostName","pid"', '"a","1"', '"b","2"', '"c","3"']
+    assert m.sqlexecute.active_jobs == set()
+    assert m.sqlexecute.session.request.call_args[0][0] == "DELETE"
+
+
+def test_failed_result_download_resumes_without_repeating_rows(fake_cli, monkeypatch):
+    import requests
+
+    pages = [[1], requests.exceptions.ConnectionError("connection reset"), [2], []]
+
+    def request(method, url, params=None, **kwargs):
+        if method == "POST":
+            return FakeResponse({"id": "qid"})
+        if url.endswith("/results"):
+            page = pages.pop(0)
+            if isinstance(page, Exception):
+                raise page
+            return FakeResponse({"items": [{"rowData": {"a": a}} for a in page]})
+        if method == "GET":
+            status = {"status": "FINISHED", "columns": [{"name": "a"}], "rowCount": 2}
+            return FakeResponse(status)
+        return FakeResponse({})
+
+    m = fake_cli(
+        request,
+        conn_options={"result_page_size": 1, "fetch_retries": 0, "max_retries": 0},
+    )
+    lines = []
+    monkeypatch.setattr(click, "echo", lambda line, **kwargs: lines.append(line))
+
+    m.output_results(m.sqlexecute.run("select a from t"))
+    m.sqlexecute.close()
+
+    assert lines == ['"a"', '"1"', '"2"']
+    assert pages == []
+    assert m.sqlexecute.session.request.call_args[0][0] == "DELETE"
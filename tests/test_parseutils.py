@@ -4,6 +4,7 @@ from usql.packages.parseutils import (
     query_starts_with,
     queries_start_with,
     is_destructive,
+    split_statements,
 )
 
 
@@ -129,3 +130,18 @@ def test_queries_start_with():
 def test_is_destructive():
     sql = "use test;\n" "show databases;\n" "drop database foo;"
     assert is_destructive(sql) is True
+
+
+def test_split_statements_while_reading():
+    lines = iter(["select 1; select 2;\n", "select 'a;\n", "b';\n", "select 3"])
+    statements = split_statements(lines)
+    assert next(statements) == "select 1;"
+    assert next(statements) == "select 2;"
+    # the rest of the input has not been read yet
+    assert next(lines) == "select 'a;\n"
+    assert list(statements) == ["b';", "select 3"]
+
+
+def test_split_statements_keeps_open_strings_and_comments():
+    lines = ["select 'a;\n", "b'; select 1 /* c;\n", "*/;\n"]
+    assert list(split_statements(lines)) == ["select 'a;\nb';", "select 1 /* c;\n*/;"]
@@ -0,0 +1,75 @@
+from mock import patch
+
+from usql.resultcache import ResultCache, normalize_sql
+from usql.resultset import ResultSet
+
+DESCRIPTION = (("a", None, None, None, None, None, None),)
+
+
+def make_result(*values):
+    result = ResultSet(["a"])
+    result.columns[0].extend(values)
+    return result
+
+
+def test_key_ignores_formatting():
+    cache = ResultCache({"global": 60}, 1000)
+    first = cache.key({"type": "global", "query": "select a\n  from t;"})
+    second = cache.key({"type": "global", "query": "SELECT a FROM t -- again"})
+    other = cache.key({"type": "realtime", "query": "select a from t"})
+    assert normalize_sql("select  a from t;") == "SELECT a FROM t"
+    assert first == second
+    assert first != other
+
+
+def test_entries_expire_per_database():
+    cache = ResultCache({"global": 60, "realtime": 0}, 1000)
+    assert cache.enabled("global")
+    assert not cache.enabled("realtime")
+
+    cache.put("k", DESCRIPTION, make_result(1, 2))
+    assert list(cache.get("global", "k").result) == [(1,), (2,)]
+    with patch("usql.resultcache.time.time", return_value=10 ** 12):
+        assert cache.get("global", "k") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_results_are_evicted():
+    cache = ResultCache({"global": 60}, 40)
+    cache.put("old", DESCRIPTION, make_result(1, 2))
+    cache.put("new", DESCRIPTION, make_result(3, 4))
+    cache.get("global", "old")
+    cache.put("newest", DESCRIPTION, make_result(5, 6))
+
+    assert cache.get("global", "new") is None
+    assert cache.get("global", "old") is not None
+    assert cache.size == 32
+
+    cache.put("huge", DESCRIPTION, make_result(*range(10)))
+    assert cache.get("global", "huge") is None
+
+
+def test_collect_caches_complete_results_only():
+    cache = ResultCache({"global": 60}, 1000)
+    pages = [make_result(1), make_result(2)]
+
+    partial = cache.collect("k", DESCRIPTION, iter(pages))
+    next(partial)
+    assert cache.get("global", "k") is None
+
+    assert list(cache.collect("k", DESCRIPTION, iter(pages))) == pages
+    assert list(cache.get("global", "k").result) == [(1,), (2,)]
+
+
+def test_results_persist_on_disk(tmpdir):
+    directory = str(tmpdir.join("cache"))
+    cache = ResultCache({"global": 60}, 1000, directory, 10000)
+    cache.put("k", DESCRIPTION, make_result("x", None))
+
+    restored = ResultCache({"global": 60}, 1000, directory, 10000)
+    entry = restored.get("global", "k")
+    assert entry.description == DESCRIPTION
+    assert list(entry.result) == [("x",), (None,)]
+
+    restored.clear()
+    assert ResultCache({"global": 60}, 1000, directory).get("global", "k") is None
@@ -0,0 +1,60 @@
+from usql.resultset import ResultSet
+
+
+ITEMS = [
+    {"rowData": {"a": 1, "b": "x"}, "asset": {"hostName": "h1"}},
+    {"rowData": {"a": 2}, "asset": {"hostName": "h2"}},
+]
+
+
+def test_extend_builds_columns():
+    result = ResultSet(["a", "b"])
+    assert result.extend(iter(ITEMS)) == 2
+    assert result.columns == [[1, 2], ["x", None]]
+    assert list(result) == [(1, "x"), (2, None)]
+    assert len(result) == 2
+    assert result[1] == (2, None)
+
+
+def test_hostname_column_leads():
+    result = ResultSet(["a"], hostname=True)
+    result.extend(ITEMS)
+    assert list(result) == [("h1", 1), ("h2", 2)]
+
+
+def test_concat():
+    first, second = ResultSet(["a"]), ResultSet(["a"])
+    first.extend(ITEMS[:1])
+    second.extend(ITEMS[1:])
+    first.concat(second)
+    assert list(first) == [(1,), (2,)]
+
+
+def test_empty():
+    result = ResultSet(["a"])
+    assert not result
+    assert list(result) == []
+
+
+def test_repetitive_columns_are_interned():
+    items = [
+        {"rowData": {"host": "".join(["host", str(i % 2)]), "pid": str(i)}}
+        for i in range(600)
+    ]
+    result = ResultSet(["host", "pid"])
+    result.extend(items)
+
+    hosts = result.columns[0]
+    assert hosts[0] is hosts[2]
+    assert result.pools[0] == {"host0": "host0", "host1": "host1"}
+    assert result.pools[1] is False
+    assert list(result)[3] == ("host1", "3")
+
+
+def test_pools_are_shared_between_pages():
+    items = [{"rowData": {"host": "".join(["h", "1"])}} for _ in range(300)]
+    first = ResultSet(["host"])
+    first.extend(items)
+    second = ResultSet(["host"], pools=first.pools)
+    second.extend(items[:10])
+    assert second.columns[0][0] is first.columns[0][0]
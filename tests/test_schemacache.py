@@ -0,0 +1,76 @@
+import json
+
+from mock import Mock
+
+from usql.schemacache import Schema, SchemaCache
+
+DOCUMENT = {
+    "tables": [
+        {
+            "name": "processes",
+            "description": "All running processes",
+            "columns": [
+                {"name": "pid", "type": "BIGINT", "description": "Process id"},
+                {"name": "path", "type": "TEXT"},
+            ],
+        },
+        {"name": "users", "description": "Local users", "columns": []},
+    ]
+}
+
+
+def test_schema_indexes_tables():
+    schema = Schema(DOCUMENT)
+    assert schema.table_rows == (("processes",), ("users",))
+    assert schema.tables["users"] == ("users", b"Local users")
+    assert schema.columns["processes"] == (
+        ("pid", "BIGINT", b"Process id"),
+        ("path", "TEXT", None),
+    )
+    assert schema.column_rows == (("processes", "pid"), ("processes", "path"))
+
+
+def test_cache_fetches_once_until_invalidated():
+    cache = SchemaCache()
+    fetch = Mock(return_value=(json.dumps(DOCUMENT).encode("utf-8"), {}))
+
+    first = cache.get("global", fetch)
+    assert cache.get("global", fetch) is first
+    assert fetch.call_count == 1
+
+    cache.invalidate()
+    cache.get("global", fetch)
+    assert fetch.call_count == 2
+
+
+def test_schema_is_persisted_and_revalidated(tmpdir):
+    content = json.dumps(DOCUMENT).encode("utf-8")
+    fetch = Mock(return_value=(content, {"etag": "v1"}))
+    SchemaCache(str(tmpdir), "tenant").get("global", fetch)
+
+    # A new session loads the schema from disk without a download...
+    cache = SchemaCache(str(tmpdir), "tenant")
+    fetch.reset_mock()
+    schema = cache.get("global", fetch)
+    assert not fetch.called
+    assert schema.tables["users"] == ("users", b"Local users")
+    assert cache.is_stale("global")
+
+    # ...and revalidates it with the saved validators.
+    fetch.return_value = (None, {"etag": "v1"})
+    assert cache.revalidate("global", fetch) is False
+    fetch.assert_called_once_with({"etag": "v1"})
+    assert not cache.is_stale("global")
+
+
+def test_revalidate_replaces_changed_schema(tmpdir):
+    content = json.dumps(DOCUMENT).encode("utf-8")
+    cache = SchemaCache(str(tmpdir), "tenant")
+    cache.get("global", Mock(return_value=(content, {})))
+
+    # same document without validators: the content hash says unchanged
+    assert cache.revalidate("global", Mock(return_value=(content, {}))) is False
+
+    changed = json.dumps({"tables": DOCUMENT["tables"][:1]}).encode("utf-8")
+    assert cache.revalidate("global", Mock(return_value=(changed, {}))) is True
+    assert list(cache.get("global", Mock()).tables) == ["processes"]
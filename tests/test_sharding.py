@@ -0,0 +1,67 @@
+import pytest
+
+from usql.sharding import bucket_windows, merge_aggregates, plan, split_window
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "select * from process_events where pid > 1",
+        "select path, upper(cmdline) from process_events",
+    ],
+)
+def test_row_queries_are_concatenated(sql):
+    assert plan(sql).merges is None
+
+
+def test_simple_aggregates_are_merged():
+    sql = "select count(*) as c, sum(size), min(upt_time) m, max(pid) from t"
+    assert plan(sql).merges == ["sum", "sum", "min", "max"]
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "select avg(pid) from t",
+        "select count(distinct pid) from t",
+        "select pid, count(*) from t group by pid",
+        "select pid from t order by pid",
+        "select pid from t limit 10",
+        "select pid from (select pid from t)",
+        "select t.pid from t join u on t.pid = u.pid",
+        "select count(*) + 1 from t",
+        "select pid from t union select pid from u",
+        "set time_shards = 4",
+    ],
+)
+def test_unsafe_queries_run_as_one_job(sql):
+    assert plan(sql) is None
+
+
+def test_split_window():
+    assert split_window("2020-01-01t00:00:00z", "2020-01-02T00:00:00.000Z", 3) == [
+        ("2020-01-01T00:00:00Z", "2020-01-01T07:59:59.999999Z"),
+        ("2020-01-01T08:00:00Z", "2020-01-01T15:59:59.999999Z"),
+        ("2020-01-01T16:00:00Z", "2020-01-02T00:00:00Z"),
+    ]
+    assert split_window("yesterday", "2020-01-02", 3) is None
+    assert split_window("2020-01-02", "2020-01-01", 3) is None
+
+
+def test_bucket_windows_line_up_with_fixed_buckets():
+    assert bucket_windows("2020-01-01T00:30:00Z", "2020-01-01T02:10:00Z", 3600) == [
+        ("2020-01-01T00:30:00Z", "2020-01-01T00:59:59.999999Z"),
+        ("2020-01-01T01:00:00Z", "2020-01-01T01:59:59.999999Z"),
+        ("2020-01-01T02:00:00Z", "2020-01-01T02:10:00Z"),
+    ]
+    assert bucket_windows("2020-01-01T00:30:00Z", "2020-01-01T02:00:00Z", 3600) == [
+        ("2020-01-01T00:30:00Z", "2020-01-01T00:59:59.999999Z"),
+        ("2020-01-01T01:00:00Z", "2020-01-01T01:59:59.999999Z"),
+        ("2020-01-01T02:00:00Z", "2020-01-01T02:00:00Z"),
+    ]
+    assert bucket_windows("2020-01-01", "2020-02-01", 60) is None
+
+
+def test_merge_aggregates():
+    rows = [(3, 10, 5, None), (0, None, 2, None), (4, 1, 9, None)]
+    assert merge_aggregates(["sum", "sum", "min", "max"], rows) == (7, 11, 2, None)
@@ -290,3 +290,166 @@ def test_time_null(executor):
     run(executor, """insert into time_null values(null)""")
     results = run(executor, """select * from time_null""")
     assert_result_equal(results, headers=["a"], rows=[(None,)])
+
+
+class FakeCursor(object):
+    """Connection stand-in that records the statements it runs."""
+
+    def __init__(self, log, started=None):
+        self.log = log
+        self.started = started
+        self.status = True
+        self.description = None
+        self.rowcount = -1
+
+    def clone(self):
+        return FakeCursor(self.log, self.started)
+
+    def execute(self, sql):
+        self.log.append(sql)
+        if sql == "select 1":
+            # only finishes if "select 2" runs at the same time
+            assert self.started.wait(5)
+        elif sql == "select 2":
+            self.started.set()
+        self.description = [(sql,)]
+        self.rowcount = 0
+
+
+def test_run_overlaps_queries_and_keeps_order():
+    import threading
+    from usql.sqlexecute import SQLExecute
+
+    log = []
+    executor = SQLExecute(
+        "https://example.uptycs.io",
+        "cid",
+        "key",
+        "secret",
+        None,
+        True,
+        max_concurrent_queries=2,
+    )
+    executor.conn = FakeCursor(log, threading.Event())
+
+    results = list(executor.run("select 1; select 2; set x = 1; select 3"))
+
+    assert [r[2] for r in results[:2]] == [["select 1"], ["select 2"]]
+    assert results[2][3] is not None
+    assert log.index("set x = 1") == 2
+    assert [r[2] for r in results[3:]] == [["select 3"]]
+
+
+def test_cancel_active_cancels_tracked_jobs():
+    from mock import Mock
+    from usql.sqlexecute import SQLExecute
+
+    executor = SQLExecute(
+        "https://example.uptycs.io", "cid", "key", "secret", None, True
+    )
+    executor.conn = Mock()
+    executor.active_jobs.add("https://example.uptycs.io/queryJobs/qid")
+
+    assert executor.cancel_active() == 1
+    executor.conn.cancel_query.assert_called_once_with("qid")
+
+
+def test_results_of_abandoned_queries_are_discarded():
+    import threading
+    from mock import Mock
+    from usql.sqlexecute import SQLExecute
+
+    executor = SQLExecute(
+        "https://example.uptycs.io",
+        "cid",
+        "key",
+        "secret",
+        None,
+        True,
+        max_concurrent_queries=2,
+    )
+    started = threading.Event()
+    release = threading.Event()
+    clones = []
+
+    def execute_query(cur, sql):
+        if sql == "select 1":
+            assert started.wait(5)
+            raise OperationalError("select 1 failed")
+        clone = Mock()
+        clones.append(clone)
+        started.set()
+        assert release.wait(5)
+        return (None, clone, ["a"], "1 row in set")
+
+    executor.conn = Mock()
+    executor.execute_query = execute_query
+    with pytest.raises(OperationalError):
+        list(executor.run("select 1; select 2"))
+    release.set()
+    executor.executor().shutdown(wait=True)
+
+    clones[0].release_result.assert_called_once_with()
+
+
+def test_status_marks_cached_results():
+    from mock import Mock
+    from usql.sqlexecute import SQLExecute
+
+    executor = SQLExecute(
+        "https://example.uptycs.io", "cid", "key", "secret", None, True
+    )
+    cursor = Mock(description=[("a",)], rowcount=2, retries=0, warnings=[])
+    cursor.progressive = False
+
+    cursor.from_cache = True
+    assert executor.get_result(cursor)[3] == "2 rows in set (cached)"
+    cursor.from_cache = False
+    assert executor.get_result(cursor)[3] == "2 rows in set"
+
+
+def test_cancelled_query_frees_its_worker_for_the_next_one():
+    import threading
+    import time
+    from mock import Mock
+    from usql.sqlexecute import SQLExecute
+    from utils import FakeResponse
+
+    polled = threading.Event()
+    status = {"status": "RUNNING"}
+
+    def request(method, url, **kwargs):
+        payload = {}
+        if method == "POST":
+            payload = {"id": "qid"}
+        elif method == "GET":
+            polled.set()
+            payload = status
+        return FakeResponse(payload)
+
+    session = Mock()
+    session.request.side_effect = request
+    executor = SQLExecute(
+        "https://example.uptycs.io",
+        "cid",
+        "key",
+        "secret",
+        "global",
+        True,
+        session=session,
+        conn_options={"poll_initial_interval": 30, "poll_jitter": 0},
+    )
+    # the query abandoned with Ctrl-C keeps the only worker thread
+    future = executor.executor().submit(
+        executor.execute_query, executor.conn, "select 1"
+    )
+    assert polled.wait(5)
+    start = time.time()
+    executor.cancel_active()
+    assert "cancelled" in str(future.exception(timeout=5))
+    assert time.time() - start < 5
+
+    status = {"status": "FINISHED", "columns": []}
+    results = list(executor.run("select 2"))
+    assert len(results) == 1
+    assert not executor.cancelled.is_set()
@@ -0,0 +1,742 @@
+import pytest
+from mock import Mock, patch
+from utils import FakeResponse, fake_realtime_job
+
+from usql.resultcache import ResultCache
+from usql.resultset import ResultSet
+from usql.backoff import CircuitBreaker
+from usql.uptycs_restcall import (
+    CircuitOpenError,
+    OperationalError,
+    QueryTimeoutError,
+    ResultFetchError,
+    connection,
+    create_session,
+)
+
+
+def make_connection(database="global", **kwargs):
+    return connection(
+        url="https://example.uptycs.io",
+        customerid="cid",
+        key="key",
+        secret="secret",
+        database=database,
+        **kwargs
+    )
+
+
+def test_create_session_pool_size():
+    session = create_session(pool_size=4)
+    adapter = session.get_adapter("https://example.uptycs.io")
+    assert adapter._pool_maxsize == 4
+
+
+def test_requests_use_shared_session():
+    session = Mock()
+    conn = make_connection(session=session)
+    conn.query_id_url = conn.query_job_url + "/qid"
+    session.request.return_value.status_code = 200
+
+    conn.delete_query()
+
+    session.request.assert_called_once_with(
+        "DELETE", conn.query_id_url, headers=conn.header, verify=True
+    )
+
+
+def test_close_keeps_shared_session_open():
+    session = Mock()
+    conn = make_connection(session=session)
+    conn.close()
+    assert not session.close.called
+
+    owned = make_connection()
+    owned.session = Mock()
+    owned.close()
+    assert owned.session.close.called
+
+
+def test_query_id_status_backs_off_between_polls():
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"status": "RUNNING"}),
+        FakeResponse({"status": "RUNNING"}, headers={"Retry-After": "2"}),
+        FakeResponse({"status": "FINISHED"}),
+    ]
+    conn = make_connection(session=session, poll_jitter=0)
+    conn.query_id = "qid"
+
+    with patch.object(conn, "pause") as pause:
+        status = conn.query_id_status()
+
+    assert status["status"] == "FINISHED"
+    assert [c[0][0] for c in pause.call_args_list] == [0.05, 2.0]
+
+
+def test_execute_streams_result_pages():
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse(
+            {"status": "FINISHED", "rowCount": 3, "columns": [{"name": "a"}]}
+        ),
+        FakeResponse({"items": [{"rowData": {"a": 1}}, {"rowData": {"a": 2}}]}),
+        FakeResponse({"items": [{"rowData": {}}]}),
+        FakeResponse({}),
+    ]
+    conn = make_connection(session=session, result_page_size=2)
+
+    conn.execute("select a from t")
+
+    assert conn.rowcount == 3
+    assert [d[0] for d in conn.description] == ["a"]
+    assert list(conn) == [(1,), (2,), (None,)]
+    calls = session.request.call_args_list
+    assert calls[2][1]["params"] == {"limit": 2, "offset": 0}
+    assert calls[3][1]["params"] == {"limit": 2, "offset": 2}
+    assert calls[4][0] == ("DELETE", conn.query_job_url + "/qid")
+
+
+def test_empty_result_deletes_the_job_at_once():
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse(
+            {"status": "FINISHED", "rowCount": 0, "columns": [{"name": "a"}]}
+        ),
+        FakeResponse({}),
+    ]
+    conn = make_connection(session=session)
+
+    conn.execute("select a from t")
+
+    assert conn.rowcount == 0
+    assert not conn
+    assert session.request.call_args[0] == ("DELETE", conn.query_job_url + "/qid")
+    assert conn.active_jobs == set()
+
+
+def test_unread_result_is_deleted_when_the_cursor_moves_on():
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse(
+            {"status": "FINISHED", "rowCount": 5, "columns": [{"name": "a"}]}
+        ),
+        FakeResponse({}),
+        FakeResponse({}),
+    ]
+    conn = make_connection(session=session)
+
+    conn.execute("select a from t")
+    # the rows are never read
+    conn.execute("unset all")
+    assert session.request.call_args[0] == ("DELETE", conn.query_job_url + "/qid")
+    conn.close()
+    assert session.request.call_count == 3
+    assert conn.active_jobs == set()
+
+
+def test_result_items_streaming_decoder():
+    pytest.importorskip("ijson")
+    items = [{"rowData": {"a": 1.5}}, {"rowData": {"a": "x"}}]
+    response = FakeResponse({"items": items, "summaries": []})
+    conn = make_connection(session=Mock())
+
+    assert list(conn.result_items(response)) == items
+
+
+def test_result_items_falls_back_to_json():
+    items = [{"rowData": {"a": 1.5}}, {"rowData": {"a": "x"}}]
+    response = FakeResponse({"items": items, "summaries": []})
+    conn = make_connection(session=Mock())
+
+    with patch("usql.uptycs_restcall.ijson", None):
+        assert list(conn.result_items(response, first_page=True)) == items
+    assert conn._json_result == {"summaries": []}
+
+
+def test_fetchall_gathers_pages_into_result_set():
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse({"status": "FINISHED", "columns": [{"name": "a"}]}),
+        FakeResponse({"items": [{"rowData": {"a": 1}}]}),
+        FakeResponse({"items": []}),
+        FakeResponse({}),
+    ]
+    conn = make_connection(session=session, result_page_size=1)
+
+    conn.execute("select a from t")
+    rows = conn.fetchall()
+
+    assert isinstance(rows, ResultSet)
+    assert list(rows) == [(1,)]
+
+
+def test_schema_commands_share_one_download():
+    session = Mock()
+    session.request.return_value = FakeResponse(
+        {
+            "tables": [
+                {
+                    "name": "processes",
+                    "description": "procs",
+                    "columns": [{"name": "pid", "type": "BIGINT"}],
+                }
+            ]
+        }
+    )
+    conn = make_connection(session=session)
+
+    assert conn.execute("show tables") == (("processes",),)
+    assert conn.execute("show column names") == (("processes", "pid"),)
+    assert conn.execute("describe", ["processes"]) == [("pid", "BIGINT", None)]
+    assert session.request.call_count == 1
+
+
+def test_fetch_schema_is_conditional():
+    session = Mock()
+    session.request.return_value = FakeResponse({}, status_code=304)
+    conn = make_connection(session=session)
+
+    assert conn.fetch_schema({"etag": '"v1"'}) == (None, {"etag": '"v1"'})
+    headers = session.request.call_args[1]["headers"]
+    assert headers["If-None-Match"] == '"v1"'
+    assert headers["Authorization"] == conn.header["Authorization"]
+
+
+def test_execute_reuses_cached_results():
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse({"status": "FINISHED", "columns": [{"name": "a"}]}),
+        FakeResponse({"items": [{"rowData": {"a": 1}}]}),
+        FakeResponse({}),
+    ]
+    cache = ResultCache({"global": 60}, 1000)
+    conn = make_connection(session=session, result_cache=cache)
+
+    conn.execute("select a from t")
+    assert list(conn) == [(1,)]
+    assert not conn.from_cache
+    conn.execute("SELECT a FROM t;")
+    assert conn.rowcount == 1
+    assert list(conn) == [(1,)]
+    assert conn.from_cache
+    assert session.request.call_count == 4
+
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse({"status": "FINISHED", "columns": [{"name": "a"}]}),
+        FakeResponse({"items": [{"rowData": {"a": 2}}]}),
+        FakeResponse({}),
+    ]
+    conn.execute("select a from t", use_cache=False)
+    assert list(conn) == [(2,)]
+    assert not conn.from_cache
+
+
+def test_failed_result_download_keeps_the_job_for_refetch():
+    import requests
+
+    lost = requests.exceptions.ConnectionError("connection reset")
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse({"status": "FINISHED", "columns": [{"name": "a"}]}),
+        lost,
+        FakeResponse({"items": [{"rowData": {"a": 1}}]}, status_code=503),
+        lost,
+        # fetchall resumes the download once before giving up
+        lost,
+        lost,
+        lost,
+    ]
+    conn = make_connection(
+        session=session,
+        fetch_retries=2,
+        max_retries=0,
+        poll_initial_interval=0.01,
+        breaker=CircuitBreaker(threshold=10),
+    )
+
+    conn.execute("select a from t")
+    with pytest.raises(ResultFetchError) as error:
+        conn.fetchall()
+    assert error.value.cursor is conn
+    assert error.value.offset == 0
+    assert "qid" in str(error.value)
+    methods = [c[0][0] for c in session.request.call_args_list]
+    assert "DELETE" not in methods
+
+    session.request.side_effect = [
+        lost,
+        FakeResponse({"items": [{"rowData": {"a": 1}}]}),
+        FakeResponse({}),
+    ]
+    conn.refetch()
+    assert list(conn) == [(1,)]
+    job = conn.query_job_url + "/qid"
+    assert [c[0][:2] for c in session.request.call_args_list[-3:]] == [
+        ("GET", job + "/results"),
+        ("GET", job + "/results"),
+        ("DELETE", job),
+    ]
+
+
+def test_failed_result_download_resumes_after_the_rows_read():
+    import requests
+
+    lost = requests.exceptions.ConnectionError("connection reset")
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse({"status": "FINISHED", "columns": [{"name": "a"}]}),
+        FakeResponse({"items": [{"rowData": {"a": 1}}]}),
+        lost,
+        FakeResponse({"items": [{"rowData": {"a": 2}}]}),
+        FakeResponse({"items": []}),
+        FakeResponse({}),
+    ]
+    conn = make_connection(
+        session=session, fetch_retries=0, max_retries=0, result_page_size=1
+    )
+
+    conn.execute("select a from t")
+    assert list(conn.fetchall()) == [(1,), (2,)]
+    offsets = [
+        c[1]["params"]["offset"]
+        for c in session.request.call_args_list
+        if c[0][1].endswith("/results")
+    ]
+    assert offsets == [0, 1, 1, 2]
+    assert session.request.call_args[0][0] == "DELETE"
+
+
+def test_jobs_are_journaled_and_can_be_attached_to(tmpdir):
+    from usql.journal import JobJournal
+
+    journal = JobJournal(str(tmpdir.join("jobs")))
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse({"status": "FINISHED", "columns": [{"name": "a"}]}),
+        FakeResponse({"items": [{"rowData": {"a": 1}}]}),
+        FakeResponse({}),
+    ]
+    conn = make_connection(session=session, journal=journal)
+    conn.execute("select a from t")
+    # the session ends before the rows are read
+    assert [e["sql"] for e in journal.entries()] == ["select a from t"]
+
+    conn = make_connection(session=session, journal=journal)
+    session.request.side_effect = [
+        FakeResponse({"status": "FINISHED", "columns": [{"name": "a"}]}),
+        FakeResponse({"items": [{"rowData": {"a": 1}}]}),
+        FakeResponse({}),
+    ]
+    conn.attach("qid")
+    assert [d[0] for d in conn.description] == ["a"]
+    assert list(conn.fetchall()) == [(1,)]
+    job = conn.query_job_url + "/qid"
+    assert session.request.call_args_list[-1][0] == ("DELETE", job)
+    assert journal.entries() == []
+
+
+def test_attach_waits_for_the_job_regardless_of_query_timeout():
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"status": "RUNNING"}),
+        FakeResponse({"status": "RUNNING"}),
+        FakeResponse({"status": "FINISHED", "columns": [{"name": "a"}]}),
+        FakeResponse({"items": [{"rowData": {"a": 1}}]}),
+        FakeResponse({}),
+    ]
+    conn = make_connection(
+        session=session, query_timeout=0.001, poll_initial_interval=0.01
+    )
+
+    conn.attach("qid")
+    assert list(conn.fetchall()) == [(1,)]
+    methods = [c[0][0] for c in session.request.call_args_list]
+    assert methods == ["GET", "GET", "GET", "GET", "DELETE"]
+
+
+def test_transient_failures_are_retried_and_counted():
+    import requests
+
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({}, status_code=429, headers={"Retry-After": "0"}),
+        FakeResponse({"id": "qid"}),
+        requests.exceptions.ConnectionError("connection reset"),
+        FakeResponse({}, status_code=504),
+        FakeResponse({"status": "FINISHED", "columns": []}),
+        FakeResponse({}),
+    ]
+    conn = make_connection(session=session, retry_initial_interval=0.01)
+
+    conn.execute("select a from t")
+    assert conn.retries == 3
+    assert session.request.call_count == 6
+
+    # a POST the gateway may have passed on is not sent twice
+    session.request.side_effect = [FakeResponse({}, status_code=502)]
+    with pytest.raises(OperationalError):
+        conn.execute("select a from t")
+    assert conn.retries == 0
+
+
+def test_slow_responses_are_retried_without_a_deadline():
+    import requests
+
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        requests.exceptions.ReadTimeout("read timed out"),
+        requests.exceptions.ConnectTimeout("connect timed out"),
+        FakeResponse({"status": "FINISHED", "columns": []}),
+        FakeResponse({}),
+    ]
+    conn = make_connection(session=session, retry_initial_interval=0.01)
+
+    conn.execute("select a from t")
+    assert conn.retries == 2
+    assert session.request.call_count == 5
+
+    # a POST that may have reached the API is not sent twice
+    session.request.side_effect = [requests.exceptions.ReadTimeout("read timed out")]
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        conn.execute("select a from t")
+    assert session.request.call_count == 6
+
+
+def test_circuit_breaker_fails_fast():
+    session = Mock()
+    session.request.return_value = FakeResponse({}, status_code=503)
+    conn = make_connection(
+        session=session,
+        max_retries=1,
+        retry_initial_interval=0.01,
+        breaker=CircuitBreaker(threshold=2, reset_timeout=60),
+    )
+
+    with pytest.raises(OperationalError):
+        conn.execute("select a from t")
+    assert session.request.call_count == 2
+    with pytest.raises(CircuitOpenError):
+        conn.execute("select a from t")
+    assert session.request.call_count == 2
+
+
+def test_only_query_job_gets_are_hedged():
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        FakeResponse({"status": "FINISHED", "columns": []}),
+        FakeResponse({}),
+    ]
+    hedger = Mock()
+    hedger.run.side_effect = lambda send, kind: send()
+    conn = make_connection(session=session, hedger=hedger)
+
+    conn.execute("select a from t")
+    assert hedger.run.call_count == 1
+    assert hedger.run.call_args[0][1] == "status"
+    assert session.request.call_args_list[1][0] == ("GET", conn.query_job_url + "/qid")
+
+
+def test_execute_sharded_merges_aggregates():
+    conn = make_connection(database="timemachine", session=Mock(), time_shards=2)
+    conn.from_timestamp = "2020-01-01T00:00:00Z"
+    conn.to_timestamp = "2020-01-02T00:00:00Z"
+    description = (("c", None, None, None, None, None, None),)
+
+    def run_shard(shard, sql, use_cache=True):
+        count = 1 if shard.from_timestamp.startswith("2020-01-01T00") else 2
+        return description, [(count,)]
+
+    with patch.object(connection, "run_shard", run_shard):
+        conn.execute("select count(*) as c from process_events")
+
+    assert conn.description == description
+    assert list(conn) == [(3,)]
+
+    with patch.object(connection, "run_query") as run_query:
+        run_query.side_effect = RuntimeError("single job")
+        with pytest.raises(RuntimeError):
+            conn.execute("select avg(pid) from process_events")
+
+
+def fake_query_api(posted):
+    """Session.request stand-in running every query job with one row that
+    holds the job's time window."""
+
+    def request(method, url, json=None, **kwargs):
+        if method == "POST":
+            posted.append(json["filters"]["from"])
+            return FakeResponse({"id": json["filters"]["from"]})
+        if url.endswith("/results"):
+            window = url.split("/")[-2]
+            items = [{"rowData": {"from": window}}]
+            if kwargs["params"]["offset"]:
+                items = []
+            return FakeResponse({"items": items})
+        if method == "GET":
+            return FakeResponse({"status": "FINISHED", "columns": [{"name": "from"}]})
+        return FakeResponse({})
+
+    return request
+
+
+def test_bucketed_query_reuses_past_buckets():
+    posted = []
+    session = Mock()
+    session.request.side_effect = fake_query_api(posted)
+    conn = make_connection(
+        database="timemachine",
+        session=session,
+        result_cache=ResultCache({"timemachine": 60}, 10000),
+        time_bucket=3600,
+    )
+    conn.from_timestamp = "2020-01-01T00:00:00Z"
+    conn.to_timestamp = "2020-01-01T02:00:00Z"
+
+    conn.execute("select * from process_events")
+    assert [row[0] for row in conn] == sorted(posted)
+    # two buckets and the boundary the window ends on
+    assert len(posted) == 3
+
+    conn.to_timestamp = "2020-01-01T03:00:00Z"
+    conn.execute("select * from process_events")
+    assert len(list(conn)) == 4
+    assert posted[3:] == ["2020-01-01T02:00:00Z", "2020-01-01T03:00:00Z"]
+
+    # a bucket that has not ended yet is run every time
+    conn.to_timestamp = "2999-01-01T00:10:00Z"
+    conn.from_timestamp = "2998-12-31T23:30:00Z"
+    conn.execute("select * from process_events")
+    conn.execute("select * from process_events")
+    assert len(posted) == 9
+
+
+def test_cache_bypass_reruns_every_bucket():
+    posted = []
+    session = Mock()
+    session.request.side_effect = fake_query_api(posted)
+    cache = ResultCache({"timemachine": 60}, 10000)
+    conn = make_connection(
+        database="timemachine", session=session, result_cache=cache, time_bucket=3600
+    )
+    conn.from_timestamp = "2020-01-01T00:00:00Z"
+    conn.to_timestamp = "2020-01-01T01:30:00Z"
+
+    conn.execute("select * from process_events")
+    assert len(conn.fetchall()) == 2
+    conn.execute("select * from process_events", use_cache=False)
+    assert len(conn.fetchall()) == 2
+    assert len(posted) == 4
+
+    # the cached buckets were left as they were
+    conn.execute("select * from process_events")
+    assert len(conn.fetchall()) == 2
+    assert len(posted) == 4
+    assert [len(entry.result) for entry in cache._entries.values()] == [1, 1]
+
+
+def test_open_bucket_is_judged_in_utc():
+    from datetime import datetime
+
+    posted = []
+    session = Mock()
+    session.request.side_effect = fake_query_api(posted)
+    conn = make_connection(
+        database="timemachine",
+        session=session,
+        result_cache=ResultCache({"timemachine": 60}, 10000),
+        time_bucket=3600,
+    )
+    conn.from_timestamp = "2020-01-01T00:00:00Z"
+    conn.to_timestamp = "2020-01-01T01:30:00Z"
+
+    with patch("usql.uptycs_restcall.datetime") as clock:
+        # east of UTC, where the local clock is ahead
+        clock.utcnow.return_value = datetime(2020, 1, 1, 1, 15)
+        clock.now.return_value = datetime(2020, 1, 1, 3, 15)
+        conn.execute("select * from process_events")
+        conn.execute("select * from process_events")
+
+    # the bucket still open was run again, the past one reused
+    assert sorted(posted) == [
+        "2020-01-01T00:00:00Z",
+        "2020-01-01T01:00:00Z",
+        "2020-01-01T01:00:00Z",
+    ]
+
+
+def test_realtime_query_fans_out_over_hostnames(tmpdir):
+    def request(method, url, json=None, **kwargs):
+        if method == "POST":
+            return FakeResponse({"id": json["filters"]["hostName"]})
+        host = url.split("/queryJobs/")[1].split("/")[0]
+        if url.endswith("/results"):
+            items = [{"rowData": {"pid": 1}, "asset": {"hostName": host}}]
+            return FakeResponse({"items": [] if kwargs["params"]["offset"] else items})
+        if method == "GET":
+            status = "RUNNING" if host == "slow" else "FINISHED"
+            return FakeResponse({"status": status, "columns": [{"name": "pid"}]})
+        return FakeResponse({})
+
+    session = Mock()
+    session.request.side_effect = request
+    conn = make_connection(
+        database="realtime",
+        session=session,
+        host_timeout=0.1,
+        poll_initial_interval=0.01,
+    )
+    hosts = tmpdir.join("hosts")
+    hosts.write("# fleet\nweb1\nslow\n")
+    conn.execute("set hostnames = '%s'" % hosts)
+    assert conn.hostnames == ["web1", "slow"]
+    conn.execute("set hostnames = (web1, 'Web2', slow)")
+    assert conn.hostnames == ["web1", "Web2", "slow"]
+
+    conn.execute("select pid from processes")
+
+    assert [d[0] for d in conn.description] == ["hostName", "pid"]
+    assert list(conn) == [("web1", 1), ("Web2", 1)]
+    assert conn.warnings == ["slow: Query timed out."]
+    # the job of the host that did not answer in time was cancelled
+    slow = [c[0][0] for c in session.request.call_args_list if "/slow" in c[0][1]]
+    assert slow[-2:] == ["PUT", "DELETE"]
+    assert conn.active_jobs == set()
+
+    conn.execute("unset hostnames")
+    assert conn.hostnames is None
+
+
+def test_query_timeout_cancels_the_job():
+    session = Mock()
+    session.request.side_effect = lambda method, url, **kwargs: FakeResponse(
+        {"id": "slow", "status": "RUNNING"}
+    )
+    conn = make_connection(session=session, poll_initial_interval=0.01)
+
+    conn.execute("set query_timeout = 0.05")
+    assert conn.query_timeout == 0.05
+    with pytest.raises(QueryTimeoutError):
+        conn.execute("select * from processes")
+
+    methods = [c[0][0] for c in session.request.call_args_list]
+    assert methods[-2:] == ["PUT", "DELETE"]
+    assert session.request.call_args_list[-2][1]["json"] == {"status": "CANCELLED"}
+    # requests never wait past the deadline
+    assert 0 < session.request.call_args_list[1][1]["timeout"] <= 0.05
+    assert conn.active_jobs == set()
+
+    conn.execute("unset query_timeout")
+    assert conn.query_timeout == 0
+
+
+def test_query_timeout_cancels_the_job_when_a_request_runs_out_of_time():
+    import time
+
+    import requests
+
+    def request(method, url, timeout=None, **kwargs):
+        # every response takes 5ms
+        if timeout is not None and timeout < 0.005:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout()
+        time.sleep(0.005)
+        return FakeResponse({"id": "qid", "status": "RUNNING"})
+
+    session = Mock()
+    session.request.side_effect = request
+    conn = make_connection(
+        session=session, query_timeout=0.05, poll_initial_interval=0.01
+    )
+
+    with pytest.raises(QueryTimeoutError):
+        conn.execute("select * from processes")
+
+    methods = [c[0][0] for c in session.request.call_args_list]
+    assert methods[-2:] == ["PUT", "DELETE"]
+    assert conn.active_jobs == set()
+
+
+def test_lost_connection_is_retried_before_the_deadline():
+    import requests
+
+    session = Mock()
+    session.request.side_effect = [
+        FakeResponse({"id": "qid"}),
+        requests.exceptions.ConnectionError("connection reset"),
+        FakeResponse({"status": "FINISHED", "columns": []}),
+        FakeResponse({}),
+    ]
+    conn = make_connection(
+        session=session,
+        query_timeout=30,
+        http_timeout=60,
+        retry_initial_interval=0.01,
+    )
+
+    conn.execute("select a from t")
+    assert conn.retries == 1
+    methods = [c[0][0] for c in session.request.call_args_list]
+    assert methods == ["POST", "GET", "GET", "DELETE"]
+
+
+def test_realtime_rows_arrive_while_hosts_respond():
+    session = Mock()
+    session.request.side_effect = fake_realtime_job(
+        ["RUNNING", "RUNNING", "RUNNING", "FINISHED"], [("a", 1), ("b", 2), ("c", 3)]
+    )
+    progress = Mock()
+    conn = make_connection(database="realtime", session=session, progress=progress)
+
+    with patch("usql.uptycs_restcall.time.sleep"):
+        conn.execute("select pid from processes")
+        assert conn.progressive
+        assert list(conn) == [("a", 1), ("b", 2), ("c", 3)]
+
+    assert progress.call_args_list[0][0] == (2, 3, 2, False)
+    assert progress.call_args[0] == (3, 3, 3, True)
+    assert session.request.call_args[0][0] == "DELETE"
+
+
+def test_ctrl_c_keeps_realtime_rows_that_arrived():
+    session = Mock()
+    session.request.side_effect = fake_realtime_job(
+        ["RUNNING"], [("a", 1), ("b", 2), ("c", 3), ("d", 4)]
+    )
+    conn = make_connection(database="realtime", session=session, progress=Mock())
+
+    with patch("usql.uptycs_restcall.time.sleep") as sleep:
+        sleep.side_effect = [None, KeyboardInterrupt]
+        conn.execute("select pid from processes")
+        assert list(conn) == [("a", 1), ("b", 2), ("c", 3)]
+
+    methods = [c[0][0] for c in session.request.call_args_list]
+    assert methods[-2:] == ["PUT", "DELETE"]
+
+
+def test_cancel_query_cancels_the_given_job():
+    session = Mock()
+    session.request.return_value = FakeResponse({})
+    jobs = set()
+    conn = make_connection(session=session, active_jobs=jobs)
+    conn.query_id_url = conn.query_job_url + "/last"
+    jobs.add(conn.query_job_url + "/qid")
+
+    conn.execute("kill qid")
+
+    calls = session.request.call_args_list
+    assert calls[0][0] == ("PUT", conn.query_job_url + "/qid")
+    assert calls[0][1]["json"] == {"status": "CANCELLED"}
+    assert calls[1][0] == ("DELETE", conn.query_job_url + "/qid")
+    assert not jobs
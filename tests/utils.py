@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import io
+import json
 import os
 import time
 import signal
@@ -26,6 +28,47 @@ try:
 except Exception as ex:
     CAN_CONNECT_TO_DB = False
 
+class FakeResponse(object):
+    """requests.Response stand-in for a queryJobs API answer of *payload*."""
+
+    def __init__(self, payload, status_code=200, headers=None):
+        self.content = json.dumps(payload).encode("utf-8")
+        self.raw = io.BytesIO(self.content)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+def fake_realtime_job(statuses, rows):
+    """Session.request stand-in for a realtime job whose *statuses* are
+    reported one after another and whose result grows by one of *rows* on
+    every status request."""
+    arrived = []
+
+    def request(method, url, params=None, **kwargs):
+        if method == "POST":
+            return FakeResponse({"id": "qid"})
+        if url.endswith("/results"):
+            items = [
+                {"rowData": {"pid": pid}, "asset": {"hostName": host}}
+                for host, pid in arrived[params["offset"] :]
+            ]
+            summaries = [{"status": "FINISHED"}] * len(arrived) + [
+                {"status": "RUNNING"}
+            ] * (len(rows) - len(arrived))
+            return FakeResponse({"items": items, "summaries": summaries})
+        if method == "GET":
+            if rows[len(arrived) :]:
+                arrived.append(rows[len(arrived)])
+            status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+            return FakeResponse({"status": status, "columns": [{"name": "pid"}]})
+        return FakeResponse({})
+
+    return request
+
+
 dbtest = pytest.mark.skipif(
     not CAN_CONNECT_TO_DB, reason="Error creating sqlite connection"
 )
@@ -0,0 +1,328 @@
+"""asyncio client for the Uptycs query API.
+
+:class:`connection` keeps the result of one query at a time on the object,
+which suits the REPL. AsyncClient keeps no results: every query job is
+addressed by its id, so one client (and its connection pool) can drive any
+number of concurrent jobs from one event loop::
+
+    async with AsyncClient(url, customer_id, key, secret) as client:
+        query_id = await client.submit("select * from processes", "realtime")
+        async for row in client.iter_rows(query_id):
+            ...
+
+Requests are retried and guarded by a circuit breaker the same way as
+those of :class:`connection`, and :meth:`AsyncClient.wait` takes a
+timeout. Unlike :class:`connection`, every results page is decoded whole
+rather than streamed, and jobs are deleted inline rather than by a
+background JobCleaner.
+
+Needs aiohttp.
+"""
+import asyncio
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from . import jsonbackend
+from .backoff import Backoff, CircuitBreaker, retry_after
+from .resultset import ResultSet
+from .uptycs_restcall import (
+    IDEMPOTENT_METHODS,
+    JOB_DONE,
+    REJECTED_STATUSES,
+    RETRY_STATUSES,
+    CircuitOpenError,
+    OperationalError,
+    QueryTimeoutError,
+    auth_header,
+    build_query_object,
+    column_description,
+    job_error_message,
+)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+_logger = logging.getLogger(__name__)
+
+# Failures of a request that are worth retrying when it is idempotent: the
+# connection broke or the answer did not come in time.
+TRANSPORT_ERRORS = (OSError, asyncio.TimeoutError)
+if aiohttp is not None:
+    TRANSPORT_ERRORS += (aiohttp.ClientError,)
+
+# what AsyncClient keeps of an HTTP response once its body has been read
+Response = namedtuple("Response", ["status", "headers", "content"])
+
+
+class AsyncClient(object):
+    """Submit, poll, read and cancel query jobs without blocking.
+
+    All requests go through one aiohttp session holding at most *pool_size*
+    connections. *session* can be any object with aiohttp's
+    ``request(method, url, **kwargs)`` async context manager. Failed
+    requests are retried *max_retries* times with backoff; *breaker* can be
+    the CircuitBreaker of a session's connections.
+    """
+
+    def __init__(
+        self,
+        url,
+        customerid,
+        key,
+        secret,
+        verify_ssl=True,
+        session=None,
+        pool_size=100,
+        poll_initial_interval=0.05,
+        poll_max_interval=20.0,
+        poll_backoff_factor=1.5,
+        poll_jitter=0.2,
+        result_page_size=10000,
+        http_timeout=None,
+        max_retries=3,
+        retry_initial_interval=0.5,
+        breaker=None,
+    ):
+        self.query_job_url = "%s/public/api/customers/%s/queryJobs" % (url, customerid)
+        self.key = key
+        self.secret = secret
+        self.verify_ssl = verify_ssl
+        self.pool_size = pool_size
+        self.poll_initial_interval = poll_initial_interval
+        self.poll_max_interval = poll_max_interval
+        self.poll_backoff_factor = poll_backoff_factor
+        self.poll_jitter = poll_jitter
+        self.result_page_size = result_page_size
+        self.http_timeout = http_timeout
+        self.max_retries = max_retries
+        self.retry_initial_interval = retry_initial_interval
+        # number of requests retried by this client
+        self.retries = 0
+        self.breaker = breaker or CircuitBreaker()
+        self._owns_session = session is None
+        self.session = session
+        # database of every job submitted and not deleted yet
+        self._databases = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _session(self):
+        if self.session is None:
+            if aiohttp is None:
+                raise OperationalError("AsyncClient needs aiohttp installed.")
+            timeout = aiohttp.ClientTimeout(total=self.http_timeout)
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, ssl=None if self.verify_ssl else False
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def _request(self, method, url, **kwargs):
+        """Send a request and return its Response, body read in full.
+
+        Overloaded, unreachable or slow upstreams are retried with backoff,
+        honoring Retry-After, like the requests of :class:`connection`.
+        """
+        backoff = None
+        attempts = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    "The Uptycs API keeps failing, not sending requests for "
+                    "%d seconds." % self.breaker.reset_timeout
+                )
+            hint = None
+            try:
+                response = await self._send(method, url, **kwargs)
+            except TRANSPORT_ERRORS:
+                self.breaker.failure()
+                if method not in IDEMPOTENT_METHODS or attempts >= self.max_retries:
+                    raise
+            else:
+                if response.status not in RETRY_STATUSES:
+                    self.breaker.success()
+                    return response
+                self.breaker.failure()
+                retryable = (
+                    method in IDEMPOTENT_METHODS or response.status in REJECTED_STATUSES
+                )
+                if not retryable or attempts >= self.max_retries:
+                    return response
+                hint = retry_after(response)
+
+            attempts += 1
+            self.retries += 1
+            if backoff is None:
+                backoff = Backoff(
+                    initial=self.retry_initial_interval,
+                    maximum=self.poll_max_interval,
+                    factor=2.0,
+                    jitter=self.poll_jitter,
+                )
+            delay = backoff.next_delay(hint=hint)
+            _logger.debug("Retrying %s %s in %.2fs.", method, url, delay)
+            await asyncio.sleep(delay)
+
+    async def _send(self, method, url, **kwargs):
+        headers = auth_header(self.key, self.secret)
+        async with self._session().request(
+            method, url, headers=headers, **kwargs
+        ) as response:
+            content = await response.read()
+            return Response(response.status, response.headers, content)
+
+    async def _json(self, method, url, error, **kwargs):
+        response = await self._request(method, url, **kwargs)
+        if response.status != 200:
+            raise OperationalError(error)
+        return response, jsonbackend.loads(response.content)
+
+    def job_url(self, query_id):
+        return self.query_job_url + "/" + str(query_id)
+
+    async def submit(
+        self,
+        sql,
+        database="global",
+        hostname=None,
+        assets_tag=None,
+        from_timestamp=None,
+        to_timestamp=None,
+    ):
+        """Start a query job running *sql* and return its id.
+
+        Timemachine queries default to the last day.
+        """
+        if database == "timemachine":
+            now = datetime.now()
+            if not from_timestamp:
+                from_timestamp = (now - timedelta(days=1)).isoformat() + "Z"
+            if not to_timestamp:
+                to_timestamp = now.isoformat() + "Z"
+        query_object = build_query_object(
+            database, sql, hostname, assets_tag, from_timestamp, to_timestamp
+        )
+        _, job = await self._json(
+            "POST",
+            self.query_job_url,
+            "ERROR: failed to submit query",
+            json=query_object,
+        )
+        self._databases[job["id"]] = database
+        return job["id"]
+
+    async def wait(self, query_id, timeout=None):
+        """Poll query job *query_id* until it is done and return its status.
+
+        A failed job is deleted and its error raised as OperationalError. A
+        job still running after *timeout* seconds is cancelled and
+        QueryTimeoutError raised.
+        """
+        backoff = Backoff(
+            initial=self.poll_initial_interval,
+            maximum=self.poll_max_interval,
+            factor=self.poll_backoff_factor,
+            jitter=self.poll_jitter,
+        )
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            response, status = await self._json(
+                "GET", self.job_url(query_id), "ERROR: failed to get query status"
+            )
+            if status["status"] in JOB_DONE:
+                break
+            delay = backoff.next_delay(hint=retry_after(response))
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    await self.cancel(query_id)
+                    raise QueryTimeoutError("Query timed out.")
+                delay = min(delay, remaining)
+            await asyncio.sleep(delay)
+        if status["status"] == "ERROR":
+            await self.delete(query_id)
+            raise OperationalError(job_error_message(status))
+        return status
+
+    def description(self, query_id, status):
+        """Return the DB-API description of the result of a finished job."""
+        columns = [column["name"] for column in status.get("columns") or ()]
+        return column_description(columns, realtime=self._realtime(query_id))
+
+    def _realtime(self, query_id):
+        return self._databases.get(query_id) == "realtime"
+
+    async def iter_rows(self, query_id, status=None):
+        """Yield the result rows of query job *query_id* as tuples, one
+        results page at a time, and delete the job afterwards.
+
+        *status* is the job's status as returned by :meth:`wait`, which is
+        called when it is not given.
+        """
+        if status is None:
+            status = await self.wait(query_id)
+        try:
+            columns = [column["name"] for column in status.get("columns") or ()]
+            realtime = self._realtime(query_id)
+            page_size = self.result_page_size
+            offset = 0
+            pools = None
+            while columns:
+                params = None
+                if page_size:
+                    params = {"limit": page_size, "offset": offset}
+                _, result = await self._json(
+                    "GET",
+                    self.job_url(query_id) + "/results",
+                    "ERROR: failed to get query results",
+                    params=params,
+                )
+                page = ResultSet(columns, hostname=realtime, pools=pools)
+                pools = page.pools
+                count = page.extend(result.get("items") or ())
+                for row in page:
+                    yield row
+                offset += count
+                if not page_size or count < page_size:
+                    break
+        finally:
+            await self.delete(query_id)
+
+    async def query(self, sql, database="global", timeout=None, **filters):
+        """Run *sql* and return its description and a list of its rows.
+
+        The job is cancelled if it has not finished after *timeout* seconds.
+        """
+        query_id = await self.submit(sql, database, **filters)
+        status = await self.wait(query_id, timeout)
+        description = self.description(query_id, status)
+        rows = [row async for row in self.iter_rows(query_id, status)]
+        return description, rows
+
+    async def cancel(self, query_id):
+        """Cancel and delete the query job *query_id*."""
+        response = await self._request(
+            "PUT", self.job_url(query_id), json={"status": "CANCELLED"}
+        )
+        if response.status != 200:
+            _logger.info("failed to cancel the query")
+        await self.delete(query_id)
+
+    async def delete(self, query_id):
+        self._databases.pop(query_id, None)
+        response = await self._request("DELETE", self.job_url(query_id))
+        if response.status != 200:
+            _logger.info("failed to delete query")
@@ -0,0 +1,89 @@
+import random
+import threading
+import time
+
+
+class Backoff(object):
+    """Exponential backoff with jitter and an upper bound.
+
+    The first delay is *initial* seconds and every following delay grows by
+    *factor* until it reaches *maximum*. Each delay is randomized by
+    +/- *jitter* (a fraction of the delay) so that many clients polling the
+    same API do not fall into lock step.
+    """
+
+    def __init__(self, initial=0.05, maximum=20.0, factor=1.5, jitter=0.2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.reset()
+
+    def reset(self):
+        self._next = self.initial
+
+    def next_delay(self, hint=None):
+        """Return the next delay in seconds.
+
+        *hint* is a delay suggested by the server (for example through a
+        Retry-After header); it is honored but still capped at *maximum*.
+        """
+        delay = self._next
+        self._next = min(self._next * self.factor, self.maximum)
+        if hint is not None:
+            delay = max(delay, hint)
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return min(delay, self.maximum)
+
+
+def retry_after(response):
+    """Return the Retry-After header of *response* in seconds, or None."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker(object):
+    """Fail fast while an upstream keeps failing.
+
+    After *threshold* consecutive failures the breaker opens and
+    :meth:`allow` refuses requests for *reset_timeout* seconds. Then one
+    request is let through to probe the upstream: its success closes the
+    breaker, its failure keeps it open for another *reset_timeout*.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened is not None
+
+    def allow(self):
+        """May a request be sent now?"""
+        with self._lock:
+            if self.opened is None or not self.threshold:
+                return True
+            if time.time() - self.opened >= self.reset_timeout:
+                # let this request probe the upstream, hold the others back
+                self.opened = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold and self.failures >= self.threshold:
+                self.opened = time.time()
@@ -0,0 +1,214 @@
+"""Delete finished query jobs in the background."""
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from .config import ensure_dir_exists
+
+_logger = logging.getLogger(__name__)
+
+
+class JobCleaner(object):
+    """Queue of query job URLs to DELETE off the query's critical path.
+
+    A worker thread waits *batch_delay* seconds after the first URL arrives
+    so the jobs of concurrent queries are deleted together, then sends the
+    DELETEs over the shared session. A failed DELETE is retried with
+    backoff starting at *retry_interval* seconds, up to *max_attempts*
+    times. With *path*, the queued URLs are saved there whenever they
+    change, so the next session deletes the ones this one did not get to,
+    even if it was killed.
+    """
+
+    def __init__(
+        self,
+        session,
+        headers,
+        verify_ssl=True,
+        path=None,
+        batch_delay=0.5,
+        max_attempts=5,
+        retry_interval=1.0,
+        http_timeout=30,
+    ):
+        self.session = session
+        # callable returning the headers that authenticate a request
+        self.headers = headers
+        self.verify_ssl = verify_ssl
+        self.path = path
+        self.batch_delay = batch_delay
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self.http_timeout = http_timeout
+        # url -> [attempts, time.time() of the next attempt]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._file_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        # time.time() by which close() has to be done sending DELETEs
+        self._deadline = None
+        for url in self._load():
+            self._pending[url] = [0, 0]
+        if self._pending:
+            # jobs a previous session did not get to delete
+            self._start()
+
+    def delete(self, url):
+        """Queue the query job at *url* for deletion."""
+        with self._wakeup:
+            self._pending.setdefault(url, [0, 0])
+            self._start()
+            self._wakeup.notify()
+        self._persist()
+
+    def pending(self):
+        with self._lock:
+            return sorted(self._pending)
+
+    def _start(self):
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(
+                target=self._run, name="usql-cleanup", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._pending and not self._closed:
+                    self._wakeup.wait()
+                if self._closed and not self._pending:
+                    return
+                # gather the jobs of the queries finishing around now
+                batch_end = time.time() + self.batch_delay
+                while not self._closed and time.time() < batch_end:
+                    self._wakeup.wait(batch_end - time.time())
+                deadline = self._deadline
+            self.run_batch(deadline)
+            with self._wakeup:
+                if self._closed:
+                    return
+                retry_at = min(
+                    (due for _, due in self._pending.values()), default=None
+                )
+                if retry_at is not None:
+                    self._wakeup.wait(max(retry_at - time.time(), 0))
+
+    def run_batch(self, deadline=None):
+        """Send the DELETEs that are due and return how many succeeded.
+
+        No DELETE is sent, or waited for, past *deadline*; the jobs left
+        stay queued.
+        """
+        now = time.time()
+        with self._lock:
+            batch = [url for url, (_, due) in self._pending.items() if due <= now]
+        deleted = 0
+        done = []
+        for url in batch:
+            timeout = self.http_timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                timeout = min(timeout, remaining) if timeout else remaining
+            if self._send(url, timeout):
+                deleted += 1
+                done.append(url)
+                with self._lock:
+                    self._pending.pop(url, None)
+                continue
+            with self._lock:
+                entry = self._pending.get(url)
+                if entry is None:
+                    continue
+                entry[0] += 1
+                if entry[0] >= self.max_attempts:
+                    _logger.info("Giving up deleting query job %s.", url)
+                    done.append(url)
+                    del self._pending[url]
+                else:
+                    delay = min(self.retry_interval * 2 ** (entry[0] - 1), 60.0)
+                    entry[1] = time.time() + delay
+        if done:
+            self._persist(done)
+        return deleted
+
+    def _send(self, url, timeout):
+        try:
+            response = self.session.request(
+                "DELETE",
+                url,
+                headers=self.headers(),
+                verify=self.verify_ssl,
+                timeout=timeout,
+            )
+        except requests.exceptions.RequestException as e:
+            _logger.debug("Unable to delete query job %s: %r", url, e)
+            return False
+        # a job that is gone already needs no deleting
+        if response.status_code in (requests.codes.ok, requests.codes.not_found):
+            return True
+        _logger.debug("Deleting %s failed: %s", url, response.status_code)
+        return False
+
+    def close(self, timeout=5.0):
+        """Delete the queued jobs, waiting at most *timeout* seconds; the
+        ones left stay saved for the next session."""
+        deadline = time.time() + timeout
+        with self._wakeup:
+            self._closed = True
+            self._deadline = deadline
+            self._wakeup.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        if thread is None or not thread.is_alive():
+            # one more try for the retries that were not due yet
+            with self._lock:
+                for entry in self._pending.values():
+                    entry[1] = 0
+            while self.pending() and time.time() < deadline:
+                if not self.run_batch(deadline):
+                    break
+        self._persist()
+
+    def _load(self):
+        if not self.path:
+            return []
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return []
+
+    def _persist(self, done=()):
+        """Save the queued URLs to path. URLs saved there by other sessions
+        are kept, except the *done* ones that this cleaner has dealt with."""
+        if not self.path:
+            return
+        with self._file_lock:
+            urls = set(self._load()).difference(done)
+            urls.update(self.pending())
+            self._save(sorted(urls))
+
+    def _save(self, urls):
+        if not self.path:
+            return
+        try:
+            if not urls:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            ensure_dir_exists(self.path)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(urls, f)
+            os.replace(self.path + ".tmp", self.path)
+        except (IOError, OSError) as e:
+            _logger.error("Unable to save pending deletes to %r: %r", self.path, e)
@@ -54,6 +54,29 @@ class CompletionRefresher(object):
                     )
                 ]
 
+    def revalidate(self, executor, callbacks, completer_options=None):
+        """Check the schema of the executor's database against the server in
+        a background thread, and refresh the completions only if it changed.
+
+        Used after completions were built from a schema loaded from disk.
+        """
+        thread = threading.Thread(
+            target=self._bg_revalidate,
+            args=(executor, callbacks, completer_options),
+            name="schema_revalidation",
+        )
+        thread.setDaemon(True)
+        thread.start()
+
+    def _bg_revalidate(self, executor, callbacks, completer_options):
+        if not executor.revalidate_schema():
+            return
+        # Let the refresh that triggered the revalidation finish first.
+        completer_thread = self._completer_thread
+        if completer_thread and completer_thread is not threading.current_thread():
+            completer_thread.join()
+        self.refresh(executor, callbacks, completer_options)
+
     def is_refreshing(self):
         return self._completer_thread and self._completer_thread.is_alive()
 
@@ -67,7 +90,15 @@ class CompletionRefresher(object):
         else:
             # Create a new sqlexecute method to popoulate the completions.
             executor = SQLExecute(
-                e.url, e.customer_id, e.key, e.secret, e.dbname, e.verify_ssl
+                e.url,
+                e.customer_id,
+                e.key,
+                e.secret,
+                e.dbname,
+                e.verify_ssl,
+                session=e.session,
+                conn_options=e.conn_options,
+                schema_cache=e.schema_cache,
             )
 
         # If callbacks is a single function then push it into a list.
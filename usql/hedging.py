@@ -0,0 +1,101 @@
+"""Hedged requests: cut the tail latency of small idempotent API calls."""
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+_logger = logging.getLogger(__name__)
+
+
+class Hedger(object):
+    """Send a duplicate of a request that is slower than usual and take
+    whichever answer arrives first.
+
+    "Slower than usual" is the *quantile* of the latencies of the last
+    *window* requests of the same kind; nothing is hedged before
+    *min_samples* of them have been seen. Kinds keep apart requests whose
+    latencies differ a lot, such as status polls and result downloads. At
+    most *max_ratio* of all requests get a duplicate, so hedging adds a
+    bounded share of load to the API.
+    """
+
+    def __init__(
+        self, max_ratio=0.05, quantile=0.95, window=500, min_samples=20, max_workers=64
+    ):
+        self.max_ratio = max_ratio
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        # latencies of the last requests, per kind of request
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+        self.requests = 0
+        self.hedged = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def delay(self, kind=None):
+        """Return how long to wait for an answer to a request of *kind*
+        before hedging, or None while too few latencies have been seen."""
+        with self._lock:
+            latencies = self.latencies.get(kind, ())
+            if len(latencies) < max(self.min_samples, 1):
+                return None
+            latencies = sorted(latencies)
+        return latencies[int(self.quantile * (len(latencies) - 1))]
+
+    def run(self, send, kind=None):
+        """Call *send* and return its response, calling it a second time if
+        the first call is slower than usual for requests of *kind* and the
+        hedging budget allows it."""
+        delay = self.delay(kind)
+        with self._lock:
+            self.requests += 1
+        if delay is None:
+            return self._timed(send, kind)
+
+        primary = self.executor().submit(self._timed, send, kind)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._may_hedge():
+            return primary.result()
+
+        _logger.debug("No answer after %.3fs, hedging the request.", delay)
+        futures = [primary, self.executor().submit(self._timed, send, kind)]
+        for future in as_completed(futures):
+            if future.exception() is None:
+                winner = future
+                break
+        else:
+            raise primary.exception()
+        for future in futures:
+            if future is not winner:
+                future.add_done_callback(_close_response)
+        return winner.result()
+
+    def _timed(self, send, kind):
+        start = time.time()
+        response = send()
+        with self._lock:
+            self.latencies[kind].append(time.time() - start)
+        return response
+
+    def _may_hedge(self):
+        with self._lock:
+            if self.hedged + 1 > self.max_ratio * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="usql-hedge"
+                )
+            return self._executor
+
+
+def _close_response(future):
+    """Release the connection of the answer that lost the race."""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
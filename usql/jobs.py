@@ -0,0 +1,153 @@
+"""Queries that run in the background while the prompt stays usable."""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    """A query run in the background on its own snapshot of a connection."""
+
+    def __init__(self, number, sql, cursor):
+        self.number = number
+        self.sql = sql
+        self.cursor = cursor
+        self.started = time.time()
+        self.finished = None
+        self.future = None
+        # (title, rows, headers, status) once the query has finished
+        self.result = None
+        self.error = None
+        self.notified = False
+
+    @property
+    def state(self):
+        if self.finished is None:
+            return "running"
+        if self.error is not None:
+            return "failed"
+        return "done"
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rowcount(self):
+        if self.result is None or self.result[1] is None:
+            return None
+        return len(self.result[1])
+
+
+class JobManager(object):
+    """Run queries in the background, *max_workers* at a time.
+
+    Every job gets a clone of the connection as it was when the job was
+    submitted, so later set/use statements at the prompt do not affect it.
+    Its rows are read in full on the worker thread and kept until they are
+    shown with :meth:`foreground`.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.jobs = {}
+        self._next_number = 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, sqlexecute, sql):
+        """Start running *sql* on a snapshot of sqlexecute's connection and
+        return its Job."""
+        cursor = sqlexecute.conn.clone()
+        # Nobody watches a background query, so there is nothing to show
+        # progress on, and its jobs are not cancelled by Ctrl-C at the prompt.
+        cursor.progress = None
+        cursor.active_jobs = set()
+        with self._lock:
+            job = Job(self._next_number, sql, cursor)
+            self._next_number += 1
+            self.jobs[job.number] = job
+        job.future = self.executor().submit(self._run, sqlexecute, job)
+        return job
+
+    def _run(self, sqlexecute, job):
+        try:
+            title, rows, headers, status = sqlexecute.execute_query(
+                job.cursor, job.sql
+            )
+            if rows is not None:
+                rows = list(rows)
+            job.result = (title, rows, headers, status)
+        except Exception as e:
+            _logger.debug("Background job %d failed: %r", job.number, e)
+            job.error = e
+        finally:
+            job.finished = time.time()
+
+    def get(self, number=None):
+        """Return the job *number*, by default the latest one, or None."""
+        with self._lock:
+            if number is None:
+                return self.jobs[max(self.jobs)] if self.jobs else None
+            return self.jobs.get(number)
+
+    def foreground(self, number=None):
+        """Wait for job *number* (by default the latest one), forget it and
+        return its (title, rows, headers, status) result.
+
+        Raise KeyError if there is no such job and the exception the query
+        failed with if it did.
+        """
+        job = self.get(number)
+        if job is None:
+            raise KeyError(number)
+        job.future.result()
+        with self._lock:
+            self.jobs.pop(job.number, None)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def rows(self):
+        """Return one (job, state, elapsed, rows, query) row per job."""
+        with self._lock:
+            jobs = sorted(self.jobs.values(), key=lambda j: j.number)
+        return [
+            (job.number, job.state, "%0.1fs" % job.elapsed, job.rowcount, job.sql)
+            for job in jobs
+        ]
+
+    def notices(self):
+        """Return a message for every job that finished since the last call."""
+        messages = []
+        with self._lock:
+            jobs = sorted(self.jobs.values(), key=lambda j: j.number)
+        for job in jobs:
+            if job.finished is not None and not job.notified:
+                job.notified = True
+                messages.append("[%d] %s  %s" % (job.number, job.state, job.sql))
+        return messages
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="usql-job"
+            )
+        return self._executor
+
+    def shutdown(self):
+        """Cancel the query jobs of the jobs that are still running."""
+        with self._lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            if job.future is not None and job.future.cancel():
+                continue
+            for query_id_url in list(job.cursor.active_jobs):
+                try:
+                    job.cursor.cancel_query(query_id_url.rsplit("/", 1)[-1])
+                except Exception as e:
+                    _logger.debug("Unable to cancel %s: %r", query_id_url, e)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,106 @@
+"""On-disk record of the query jobs submitted by usql sessions."""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .config import ensure_dir_exists
+
+_logger = logging.getLogger(__name__)
+
+
+class JobJournal(object):
+    """Query jobs submitted and not yet deleted, kept in *path*.
+
+    Every submitted job is appended as one JSON line with its SQL, database,
+    filters and submit time, and every deleted one as a line marking it
+    deleted, so the journal survives a crash of the session that wrote it.
+    The file is rewritten without the deleted jobs once it has more than
+    *max_lines* lines.
+    """
+
+    def __init__(self, path, max_lines=1000):
+        self.path = path
+        self.max_lines = max_lines
+        # lines in the file, counted on the first write
+        self._lines = None
+        self._lock = threading.Lock()
+
+    def record(self, query_id, query_object):
+        """Note that the job *query_id* was submitted with *query_object*."""
+        entry = {
+            "id": query_id,
+            "sql": query_object.get("query"),
+            "database": query_object.get("type"),
+            "filters": query_object.get("filters"),
+            "submitted": time.time(),
+        }
+        self._append(entry)
+
+    def delete(self, query_id):
+        """Note that the job *query_id* was deleted."""
+        self._append({"id": query_id, "deleted": time.time()})
+
+    def get(self, query_id):
+        """Return the journal entry of the live job *query_id*, or None."""
+        return self._read()[0].get(query_id)
+
+    def entries(self):
+        """Return the entries of the jobs not deleted yet, oldest first."""
+        return list(self._read()[0].values())
+
+    def _read(self):
+        """Return the live entries by id and the number of lines read."""
+        entries = OrderedDict()
+        lines = 0
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    lines += 1
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash
+                        continue
+                    if "deleted" in entry:
+                        entries.pop(entry["id"], None)
+                    else:
+                        entries[entry["id"]] = entry
+        except (IOError, OSError):
+            pass
+        return entries, lines
+
+    def _append(self, entry):
+        with self._lock:
+            try:
+                line = json.dumps(entry) + "\n"
+                if self._lines is None:
+                    self._lines = self._read()[1]
+                    if self._lines and not self._ends_with_newline():
+                        # start after the line a crashed session cut short
+                        line = "\n" + line
+                ensure_dir_exists(self.path)
+                with open(self.path, "a") as f:
+                    f.write(line)
+                self._lines += 1
+                if self._lines > self.max_lines:
+                    entries = self._read()[0]
+                    self._rewrite(entries.values())
+                    self._lines = len(entries)
+            except (IOError, OSError) as e:
+                _logger.error("Unable to write job journal %r: %r", self.path, e)
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _rewrite(self, entries):
+        with open(self.path + ".tmp", "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(self.path + ".tmp", self.path)
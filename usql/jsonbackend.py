@@ -0,0 +1,51 @@
+"""JSON decoders used for Uptycs API responses.
+
+Responses are parsed straight from the raw bytes. The fastest installed
+decoder is used by default and a specific one can be picked with the
+json_backend option in usqlrc.
+"""
+import json
+import logging
+from collections import OrderedDict
+
+_logger = logging.getLogger(__name__)
+
+# Available decoders, fastest first.
+BACKENDS = OrderedDict()
+
+try:
+    import orjson
+
+    BACKENDS["orjson"] = orjson.loads
+except ImportError:
+    pass
+
+try:
+    import ujson
+
+    BACKENDS["ujson"] = ujson.loads
+except ImportError:
+    pass
+
+BACKENDS["json"] = json.loads
+
+backend = next(iter(BACKENDS))
+loads = BACKENDS[backend]
+
+
+def set_backend(name="auto"):
+    """Select the decoder called by :func:`loads`.
+
+    "auto" picks the fastest installed decoder. An unknown or missing
+    decoder falls back to "auto" with a warning.
+    """
+    global backend, loads
+    if name != "auto" and name not in BACKENDS:
+        _logger.warning("JSON backend %r is not available, using auto.", name)
+        name = "auto"
+    if name == "auto":
+        name = next(iter(BACKENDS))
+    backend = name
+    loads = BACKENDS[name]
+    _logger.debug("Using JSON backend %r.", name)
+    return name
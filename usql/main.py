@@ -3,6 +3,7 @@ from __future__ import print_function
 
 import os
 import sys
+import atexit
 import traceback
 import logging
 import threading
@@ -11,7 +12,7 @@ from time import time
 from datetime import datetime
 from io import open
 from collections import namedtuple
-from .uptycs_restcall import OperationalError
+from .uptycs_restcall import OperationalError, ResultFetchError
 
 from cli_helpers.tabular_output import TabularOutputFormatter
 from cli_helpers.tabular_output import preprocessors
@@ -33,17 +34,23 @@ from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 
 from .packages.special.main import NO_QUERY
 from .packages.prompt_utils import confirm, confirm_destructive_query
+from .packages.parseutils import is_destructive, split_statements
 from .packages import special
 from .sqlcompleter import SQLCompleter
 from .clitoolbar import create_toolbar_tokens_func
 from .clistyle import style_factory, style_factory_output
 from .sqlexecute import SQLExecute
+from .resultcache import ResultCache
+from .jobs import JobManager
+from .backoff import CircuitBreaker
+from .hedging import Hedger
 from .clibuffer import cli_is_multiline
 from .completion_refresher import CompletionRefresher
 from .config import config_location, ensure_dir_exists, get_config
 from .key_bindings import cli_bindings
 from .encodingutils import utf8tounicode, text_type
 from .lexer import UsqlCliLexer
+from . import jsonbackend
 from .__init__ import __version__
 from .packages.filepaths import dir_path_exists
 
@@ -56,6 +63,9 @@ Query = namedtuple("Query", ["query", "successful", "mutating"])
 
 PACKAGE_ROOT = os.path.abspath(os.path.dirname(__file__))
 
+# Output formats that print one line per row after a header line.
+DELIMITED_FORMATS = ("csv", "csv-tab", "tsv")
+
 
 class UsqlCli(object):
 
@@ -73,6 +83,7 @@ class UsqlCli(object):
         keyfile=None,
         suffix=None,
         verify_ssl=True,
+        query_timeout=None,
     ):
         self.apifile_data = json.load(open(keyfile))
         self.customer_name = self.apifile_data["domain"]
@@ -104,6 +115,39 @@ class UsqlCli(object):
         c_dest_warning = c["main"].as_bool("destructive_warning")
         self.destructive_warning = c_dest_warning if warn is None else warn
         self.login_path_as_host = c["main"].as_bool("login_path_as_host")
+        self.http_pool_size = c["main"].as_int("http_pool_size")
+        self.max_concurrent_queries = c["main"].as_int("max_concurrent_queries")
+        self.realtime_progress = c["main"].as_bool("realtime_progress")
+        self.schema_dir = None
+        if c["main"].as_bool("schema_cache"):
+            self.schema_dir = config_location() + "schema"
+        self.conn_options = {
+            "poll_initial_interval": c["main"].as_float("poll_initial_interval"),
+            "poll_max_interval": c["main"].as_float("poll_max_interval"),
+            "poll_backoff_factor": c["main"].as_float("poll_backoff_factor"),
+            "poll_jitter": c["main"].as_float("poll_jitter"),
+            "result_page_size": c["main"].as_int("result_page_size"),
+            "time_shards": c["main"].as_int("time_shards"),
+            "shard_concurrency": c["main"].as_int("shard_concurrency"),
+            "time_bucket": c["main"].as_int("time_bucket"),
+            "host_concurrency": c["main"].as_int("host_concurrency"),
+            "host_timeout": c["main"].as_float("host_timeout"),
+            "query_timeout": c["main"].as_float("query_timeout"),
+            "http_timeout": c["main"].as_float("http_timeout") or None,
+            "fetch_retries": c["main"].as_int("fetch_retries"),
+            "max_retries": c["main"].as_int("max_retries"),
+        }
+        if query_timeout is not None:
+            self.conn_options["query_timeout"] = query_timeout
+        self.result_cache = self.create_result_cache(c["result_cache"])
+        self.jobs = JobManager(c["main"].as_int("background_jobs"))
+        self.circuit_breaker = CircuitBreaker(
+            c["main"].as_int("circuit_breaker_threshold"),
+            c["main"].as_float("circuit_breaker_reset"),
+        )
+        self.hedger = None
+        if c["main"].as_bool("hedge_requests"):
+            self.hedger = Hedger(c["main"].as_float("hedge_max_ratio"))
 
         # read from cli argument or user config file
         self.auto_vertical_output = auto_vertical_output or c["main"].as_bool(
@@ -126,6 +170,7 @@ class UsqlCli(object):
 
         self.logger = logging.getLogger(__name__)
         self.initialize_logging()
+        jsonbackend.set_backend(c["main"]["json_backend"])
 
         prompt_cnf = self.read_my_cnf_files(["prompt"])["prompt"]
         self.prompt_format = (
@@ -157,7 +202,7 @@ class UsqlCli(object):
             aliases=("use", "\\u"),
         )
         special.register_special_command(
-            self.refresh_completions,
+            self.rehash,
             "rehash",
             "\\#",
             "Refresh auto-completions.",
@@ -187,6 +232,28 @@ class UsqlCli(object):
             aliases=("\\R",),
             case_sensitive=True,
         )
+        special.register_special_command(
+            self.background_query,
+            "\\bg",
+            "\\bg query",
+            "Run a query in the background.",
+            case_sensitive=True,
+        )
+        special.register_special_command(
+            self.list_jobs,
+            "\\jobs",
+            "\\jobs",
+            "List background queries.",
+            arg_type=NO_QUERY,
+            case_sensitive=True,
+        )
+        special.register_special_command(
+            self.foreground_job,
+            "\\fg",
+            "\\fg [n]",
+            "Show the result of background query n (default: the latest).",
+            case_sensitive=True,
+        )
 
     def change_table_format(self, arg, **_):
         try:
@@ -220,16 +287,65 @@ class UsqlCli(object):
             message = "Missing required argument, filename."
             return [(None, None, None, message)]
         try:
-            with open(os.path.expanduser(arg), encoding="utf-8") as f:
-                query = f.read()
+            f = open(os.path.expanduser(arg), encoding="utf-8")
         except IOError as e:
             return [(None, None, None, str(e))]
 
-        if self.destructive_warning and confirm_destructive_query(query) is False:
-            message = "Wise choice. Command execution stopped."
+        return self.run_script(f)
+
+    def run_script(self, lines):
+        """Run the statements read from *lines* and yield their results.
+
+        Statements are split off and submitted as soon as they have been
+        read, so the first results show up while the rest of the script is
+        still being read and the next queries run while earlier results are
+        being downloaded.
+        """
+        stopped = []
+
+        def statements():
+            confirmed = not self.destructive_warning
+            for sql in split_statements(lines):
+                if not confirmed and is_destructive(sql):
+                    confirmed = confirm_destructive_query(sql)
+                    if confirmed is False:
+                        stopped.append(sql)
+                        return
+                yield sql
+
+        try:
+            for result in self.sqlexecute.run_statements(statements()):
+                yield result
+        finally:
+            if hasattr(lines, "close"):
+                lines.close()
+        if stopped:
+            yield (None, None, None, "Wise choice. Command execution stopped.")
+
+    def background_query(self, arg, **_):
+        if not arg:
+            return [(None, None, None, "Missing required argument, query.")]
+        sql = arg.strip().rstrip(";")
+        if self.sqlexecute.is_barrier(sql):
+            message = "Only queries can run in the background."
             return [(None, None, None, message)]
+        self.sqlexecute.check_connected(sql)
+        job = self.jobs.submit(self.sqlexecute, sql)
+        return [(None, None, None, "[%d] %s" % (job.number, sql))]
+
+    def list_jobs(self):
+        headers = ["job", "state", "elapsed", "rows", "query"]
+        return [(None, self.jobs.rows(), headers, "")]
 
-        return self.sqlexecute.run(query)
+    def foreground_job(self, arg, **_):
+        try:
+            number = int(arg) if arg else None
+        except ValueError:
+            return [(None, None, None, "Job number must be an integer.")]
+        try:
+            return [self.jobs.foreground(number)]
+        except KeyError:
+            return [(None, None, None, "No such job.")]
 
     def change_prompt_format(self, arg, **_):
         """
@@ -330,7 +446,21 @@ class UsqlCli(object):
                 self.secret,
                 database,
                 self.verify_ssl,
+                pool_size=self.http_pool_size,
+                conn_options=self.conn_options,
+                schema_dir=self.schema_dir,
+                result_cache=self.result_cache,
+                max_concurrent_queries=self.max_concurrent_queries,
+                progress=self.show_realtime_progress
+                if self.realtime_progress and sys.stderr.isatty()
+                else None,
+                pending_deletes_file=config_location() + "pending_deletes",
+                journal_file=config_location() + "jobs",
+                breaker=self.circuit_breaker,
+                hedger=self.hedger,
             )
+            # delete the last finished query jobs however usql exits
+            atexit.register(self.sqlexecute.close)
 
         try:
             _connect()
@@ -421,6 +551,8 @@ class UsqlCli(object):
 
         def one_iteration(text=None):
             if text is None:
+                for notice in self.jobs.notices():
+                    self.echo(notice)
                 try:
                     text = self.prompt_app.prompt()
                 except KeyboardInterrupt:
@@ -481,6 +613,7 @@ class UsqlCli(object):
                         )
                         if not confirm("Do you want to continue?"):
                             self.echo("Aborted!", err=True, fg="red")
+                            sqlexecute.discard(cur)
                             break
 
                     if self.auto_vertical_output:
@@ -497,7 +630,11 @@ class UsqlCli(object):
                         if result_count > 0:
                             self.echo("")
                         try:
-                            self.output(formatted, status)
+                            self.output(
+                                formatted,
+                                status,
+                                stream=getattr(cur, "progressive", False),
+                            )
                         except KeyboardInterrupt:
                             pass
                         self.echo("Time: %0.03fs" % t)
@@ -511,20 +648,15 @@ class UsqlCli(object):
             except EOFError as e:
                 raise e
             except KeyboardInterrupt:
-                # get last connection id
-                connection_id_to_kill = sqlexecute.connection_id
-                logger.debug("connection id to kill: %r", connection_id_to_kill)
+                # Cancel the query jobs of this input on the server; their
+                # worker threads stop polling once they see the cancel.
                 try:
-                    for title, cur, headers, status in sqlexecute.run(
-                        "kill %s" % connection_id_to_kill
-                    ):
-                        if status:
-                            logger.debug(
-                                "cancelled query, connection id: %r, sql: %r",
-                                connection_id_to_kill,
-                                text,
-                            )
-                            self.echo("cancelled query", err=True, fg="red")
+                    cancelled = sqlexecute.cancel_active()
+                    if cancelled:
+                        logger.debug(
+                            "cancelled %d query jobs, sql: %r", cancelled, text
+                        )
+                        self.echo("cancelled query", err=True, fg="red")
                 except Exception as e:
                     self.echo(
                         "Encountered error while cancelling query: {}".format(e),
@@ -619,6 +751,7 @@ class UsqlCli(object):
                 iterations += 1
         except EOFError:
             special.close_tee()
+            self.jobs.shutdown()
             if not self.less_chatty:
                 self.echo("Goodbye!")
 
@@ -627,6 +760,14 @@ class UsqlCli(object):
         if self.logfile:
             click.echo(utf8tounicode(output), file=self.logfile)
 
+    def show_realtime_progress(self, responded, hosts, rows, done):
+        """Show how many hosts of a running realtime query have responded,
+        on one line of stderr that is updated in place."""
+        message = "{0} of {1} hosts responded, {2} row{3}".format(
+            responded, hosts, rows, "" if rows == 1 else "s"
+        )
+        click.echo("\r" + message + "\x1b[K", nl=done, err=True)
+
     def echo(self, s, **kwargs):
         """Print a message to stdout.
 
@@ -651,10 +792,11 @@ class UsqlCli(object):
 
         return margin
 
-    def output(self, output, status=None):
+    def output(self, output, status=None, stream=False):
         """Output text to stdout or a pager command.
 
-        The status text is not outputted to pager or files.
+        The status text is not outputted to pager or files. With *stream*
+        every line is printed as soon as it is there, without a pager.
 
         The message will be logged in the audit log, if enabled. The
         message will be written to the tee file, if enabled. The
@@ -669,6 +811,8 @@ class UsqlCli(object):
             fits = True
             buf = []
             output_via_pager = self.explicit_pager and special.is_pager_enabled()
+            if stream:
+                fits = output_via_pager = False
             for i, line in enumerate(output, 1):
                 self.log_output(line)
                 special.write_tee(line)
@@ -725,22 +869,61 @@ class UsqlCli(object):
         self.completion_refresher.refresh(
             self.sqlexecute,
             self._on_completions_refreshed,
-            {
-                "supported_formats": self.formatter.supported_formats,
-                "keyword_casing": self.completer.keyword_casing,
-            },
+            self.completer_options(),
         )
 
         return [
             (None, None, None, "Auto-completion refresh started in the background.")
         ]
 
+    def rehash(self):
+        """Drop the cached schemas and refresh the auto-completions."""
+        self.sqlexecute.schema_cache.invalidate()
+        return self.refresh_completions()
+
+    @staticmethod
+    def create_result_cache(config):
+        """Build the ResultCache described by the [result_cache] section of
+        usqlrc, or return None if it is disabled for every database."""
+        ttls = {
+            database: config.as_float(database + "_ttl")
+            for database in ("global", "realtime", "timemachine")
+        }
+        if not any(ttl > 0 for ttl in ttls.values()):
+            return None
+        directory = None
+        if config.as_bool("disk"):
+            directory = config_location() + "cache"
+        return ResultCache(
+            ttls,
+            config.as_int("max_size"),
+            directory=directory,
+            disk_max_size=config.as_int("disk_max_size"),
+            bucket_ttl=config.as_float("bucket_ttl"),
+        )
+
+    def completer_options(self):
+        return {
+            "supported_formats": self.formatter.supported_formats,
+            "keyword_casing": self.completer.keyword_casing,
+        }
+
     def _on_completions_refreshed(self, new_completer):
         """Swap the completer object in cli with the newly created completer.
         """
         with self._completer_lock:
             self.completer = new_completer
 
+        # Completions built from a schema cached on disk are usable right
+        # away; check the schema with the server now and only refresh again
+        # if it changed.
+        if self.sqlexecute.schema_is_stale():
+            self.completion_refresher.revalidate(
+                self.sqlexecute,
+                self._on_completions_refreshed,
+                self.completer_options(),
+            )
+
         if self.prompt_app:
             # After refreshing, redraw the CLI to clear the statusbar
             # "Refreshing completions..." indicator
@@ -771,7 +954,10 @@ class UsqlCli(object):
 
     def run_query(self, query, new_line=True):
         """Runs *query*."""
-        results = self.sqlexecute.run(query)
+        self.output_results(self.sqlexecute.run(query), query, new_line)
+
+    def output_results(self, results, query=None, new_line=True):
+        """Print the results of a query run without the interactive prompt."""
         for result in results:
             title, cur, headers, status = result
             self.formatter.query = query
@@ -779,6 +965,36 @@ class UsqlCli(object):
             for line in output:
                 click.echo(line, nl=new_line)
 
+    def resume_rows(self, cur):
+        """Yield the rows of *cur*. If downloading its result fails, the
+        download is resumed once after the rows already yielded, so nothing
+        is shown twice."""
+        try:
+            for row in cur:
+                yield row
+        except ResultFetchError as e:
+            if e.cursor is not cur:
+                raise
+            self.echo(
+                "Fetching the rest of the results again...", err=True, fg="yellow"
+            )
+            e.cursor.refetch(e.offset)
+            for row in e.cursor:
+                yield row
+
+    def format_batches(self, cur, headers, expanded=False, max_width=None):
+        """Format the rows of the running realtime query *cur* batch by
+        batch, as the hosts respond. Table formats need all of their rows up
+        front, so every batch is a table of its own; delimited formats print
+        their header only once."""
+        delimited = not expanded and self.formatter.format_name in DELIMITED_FORMATS
+        for number, page in enumerate(cur.pages()):
+            formatted = self.format_output(None, page, headers, expanded, max_width)
+            if number and delimited:
+                next(formatted, None)
+            for line in formatted:
+                yield line
+
     def format_output(self, title, cur, headers, expanded=False, max_width=None):
         expanded = expanded or self.formatter.format_name == "vertical"
         output = []
@@ -794,6 +1010,11 @@ class UsqlCli(object):
         if title:  # Only print the title if it's not None.
             output = itertools.chain(output, [title])
 
+        if cur and getattr(cur, "progressive", False):
+            return itertools.chain(
+                output, self.format_batches(cur, headers, expanded, max_width)
+            )
+
         if cur:
             column_types = None
             if hasattr(cur, "description"):
@@ -805,6 +1026,9 @@ class UsqlCli(object):
 
                 column_types = [get_col_type(col) for col in cur.description]
 
+            if hasattr(cur, "refetch"):
+                cur = self.resume_rows(cur)
+
             if max_width is not None:
                 cur = list(cur)
 
@@ -896,6 +1120,11 @@ class UsqlCli(object):
 )
 @click.option("--enable-ssl/--disable-ssl", default=True,
                 help="verify ssl certificate")
+@click.option(
+    "--query-timeout",
+    type=float,
+    help="Cancel queries running longer than this many seconds (0 for no limit).",
+)
 @click.argument("database", default="", nargs=1)
 def cli(
     database,
@@ -912,6 +1141,7 @@ def cli(
     keyfile,
     domainsuffix,
     enable_ssl,
+    query_timeout,
 ):
     """A Uptycs terminal client with auto-completion and syntax highlighting.
 
@@ -959,6 +1189,7 @@ def cli(
         keyfile=keyfile,
         suffix=domainsuffix,
         verify_ssl=verify_ssl,
+        query_timeout=query_timeout,
     )
 
     # Choose which ever one has a valid value.
@@ -978,6 +1209,9 @@ def cli(
 
             usql.run_query(execute)
             exit(0)
+        except KeyboardInterrupt:
+            usql.sqlexecute.cancel_active()
+            exit(1)
         except Exception as e:
             click.secho(str(e), err=True, fg="red")
             exit(1)
@@ -986,15 +1220,12 @@ def cli(
         usql.run_cli()
     else:
         stdin = click.get_text_stream("stdin")
-        stdin_text = stdin.read()
 
         try:
             sys.stdin = open("/dev/tty")
         except (FileNotFoundError, OSError):
             usql.logger.warning("Unable to open TTY as stdin.")
 
-        if usql.destructive_warning and confirm_destructive_query(stdin_text) is False:
-            exit(0)
         try:
             new_line = True
 
@@ -1003,8 +1234,12 @@ def cli(
             elif not table:
                 usql.formatter.format_name = "tsv"
 
-            usql.run_query(stdin_text, new_line=new_line)
+            # statements run as they are read from the pipe
+            usql.output_results(usql.run_script(stdin), new_line=new_line)
             exit(0)
+        except KeyboardInterrupt:
+            usql.sqlexecute.cancel_active()
+            exit(1)
         except Exception as e:
             click.secho(str(e), err=True, fg="red")
             exit(1)
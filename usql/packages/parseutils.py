@@ -2,7 +2,7 @@ from __future__ import print_function
 import re
 import sqlparse
 from sqlparse.sql import IdentifierList, Identifier, Function
-from sqlparse.tokens import Keyword, DML, Punctuation
+from sqlparse.tokens import Keyword, DML, Punctuation, Error
 
 cleanup_regex = {
     # This matches only alphanumerics and underscores.
@@ -222,6 +222,40 @@ def is_destructive(queries):
     return queries_start_with(queries, keywords)
 
 
+def split_statements(lines):
+    """Split the SQL read from the iterable *lines* into statements and yield
+    each one as soon as its terminating semicolon has been read.
+
+    Only the text after the last complete statement is kept and parsed
+    again, so a long script is split while it is being read.
+    """
+    buffered = ""
+    for line in lines:
+        buffered += line
+        if not line.rstrip().endswith(";"):
+            continue
+        statements = [s for s in sqlparse.split(buffered) if s]
+        # a semicolon inside a string or comment that is still open does
+        # not end the last statement
+        remainder = ""
+        if statements and not _is_terminated(statements[-1]):
+            remainder = buffered[buffered.rfind(statements.pop()) :]
+        buffered = remainder
+        for statement in statements:
+            yield statement
+    for statement in sqlparse.split(buffered):
+        if statement:
+            yield statement
+
+
+def _is_terminated(statement):
+    if not statement.endswith(";") or statement.rfind("/*") > statement.rfind("*/"):
+        return False
+    return not any(
+        token.ttype is Error for token in sqlparse.parse(statement)[0].flatten()
+    )
+
+
 if __name__ == "__main__":
     sql = "select * from (select t. from tabl t"
     print(extract_tables(sql))
@@ -3,6 +3,7 @@ import logging
 import os
 import platform
 import shlex
+import time
 from usql.uptycs_restcall import ProgrammingError
 
 from usql import __version__
@@ -144,3 +145,73 @@ def status(cur, **_):
     footer.append("--------------")
     return [(None, None, "", "\n".join(footer))]
     return [(None, None, None, "")]
+
+
+@special_command(
+    "\\cache",
+    "\\cache [stats|clear|bypass query]",
+    "Show result cache statistics, clear it or run a query without it.",
+    arg_type=PARSED_QUERY,
+    case_sensitive=True,
+)
+def result_cache(cur, arg=None, **_):
+    cache = cur.result_cache
+    action, _, query = (arg or "stats").strip().partition(" ")
+    if action == "bypass":
+        if not query.strip():
+            raise TypeError("You must provide a query.")
+        cur.execute(query.strip(), use_cache=False)
+        if not cur.description:
+            return [(None, None, None, "Query OK")]
+        headers = [x[0] for x in cur.description]
+        rows = cur.fetchall()
+        status = "{0} row{1} in set".format(len(rows), "" if len(rows) == 1 else "s")
+        return [(None, rows, headers, status)]
+    if cache is None:
+        return [(None, None, None, "The result cache is disabled.")]
+    if action == "clear":
+        cache.clear()
+        return [(None, None, None, "Result cache cleared.")]
+    if action == "stats":
+        return [(None, cache.stats(), ["Name", "Value"], "")]
+    raise ValueError(
+        "Unknown \\cache action %r, expected stats, clear or bypass." % action
+    )
+
+
+@special_command(
+    "\\attach",
+    "\\attach [id]",
+    "List query jobs of earlier sessions or fetch the result of job id.",
+    arg_type=PARSED_QUERY,
+    case_sensitive=True,
+)
+def attach_job(cur, arg=None, **_):
+    journal = cur.journal
+    if not arg:
+        if journal is None:
+            return [(None, None, None, "The job journal is disabled.")]
+        rows = [
+            (
+                entry["id"],
+                entry["database"],
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["submitted"])),
+                entry["sql"],
+            )
+            for entry in journal.entries()
+        ]
+        return [(None, rows, ["id", "database", "submitted", "query"], "")]
+
+    query_id = arg.strip()
+    entry = journal.get(query_id) if journal is not None else None
+    if entry is not None and entry["database"] != cur.database:
+        # fetch the job's rows the way the database it ran on returns them
+        cur = cur.clone()
+        cur.database = entry["database"]
+    cur.attach(query_id)
+    if not cur.description:
+        return [(None, None, None, "Query OK")]
+    headers = [x[0] for x in cur.description]
+    rows = cur.fetchall()
+    status = "{0} row{1} in set".format(len(rows), "" if len(rows) == 1 else "s")
+    return [(None, rows, headers, status)]
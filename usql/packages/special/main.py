@@ -39,6 +39,13 @@ def parse_special_command(sql):
     return (command, verbose, arg.strip())
 
 
+@export
+def is_special_command(sql):
+    """Would :func:`execute` handle *sql* as a special command?"""
+    command, _, _ = parse_special_command(sql)
+    return command in COMMANDS or command.lower() in COMMANDS
+
+
 @export
 def special_command(
     command,
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+import sqlparse
+
+from . import jsonbackend
+from .config import ensure_dir_exists
+from .resultset import ResultSet
+
+_logger = logging.getLogger(__name__)
+
+CachedResult = namedtuple("CachedResult", ["description", "result", "stored", "size"])
+
+
+def normalize_sql(sql):
+    """Normalize *sql* so that formatting differences share a cache entry."""
+    sql = sqlparse.format(sql, strip_comments=True, keyword_case="upper")
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+def estimate_size(result):
+    """Rough number of bytes a ResultSet holds, for cache accounting."""
+    size = 0
+    for column in result.columns:
+        size += 8 * len(column)
+        for value in column:
+            if value.__class__ is str:
+                size += len(value)
+    return size
+
+
+class ResultCache(object):
+    """Results of queryJobs queries, kept for reuse by identical queries.
+
+    Entries are keyed on the normalized SQL and the filters sent with the
+    query job (database type, hostname, assets tag, time window). Every
+    database has its own time to live, 0 disables caching for it. The
+    memory tier is evicted least recently used first once it holds more
+    than *max_size* bytes. When *directory* is given, results are also
+    written there zlib compressed, up to *disk_max_size* bytes, so they
+    survive the session.
+    """
+
+    def __init__(
+        self, ttls, max_size, directory=None, disk_max_size=0, bucket_ttl=86400
+    ):
+        self.ttls = ttls
+        # time to live of the results of a timemachine bucket that has ended
+        self.bucket_ttl = bucket_ttl
+        self.max_size = max_size
+        self.directory = directory
+        self.disk_max_size = disk_max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enabled(self, database):
+        return self.ttls.get(database, 0) > 0
+
+    def key(self, query_object):
+        """Return the cache key of a queryJobs request body."""
+        request = dict(query_object, query=normalize_sql(query_object["query"]))
+        return hashlib.sha1(
+            json.dumps(request, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, database, key, ttl=None):
+        """Return the CachedResult stored under *key*, or None if there is
+        none younger than *ttl* seconds (by default the database's)."""
+        if ttl is None:
+            ttl = self.ttls.get(database, 0)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            else:
+                entry = self._load(key)
+                if entry is not None:
+                    self._insert(key, entry)
+            if entry is not None and time.time() - entry.stored > ttl:
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, key, description, result):
+        entry = CachedResult(description, result, time.time(), estimate_size(result))
+        if entry.size > self.max_size:
+            _logger.debug("Result too large to cache: %d bytes.", entry.size)
+            return
+        with self._lock:
+            self._discard(key)
+            self._insert(key, entry)
+            self._save(key, entry)
+
+    def collect(self, key, description, pages):
+        """Pass ResultSet *pages* through and cache the complete result once
+        the last page has been read.
+
+        Nothing is cached if the pages are not read to the end or the result
+        grows larger than the cache.
+        """
+        merged = None
+        size = 0
+        for page in pages:
+            if size <= self.max_size:
+                if merged is None:
+                    merged = ResultSet(page.names, page.hostname, page.pools)
+                merged.concat(page)
+                size += estimate_size(page)
+            yield page
+        if merged is not None and size <= self.max_size:
+            self.put(key, description, merged)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            for path in self._disk_files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        """Return (name, value) rows describing the cache."""
+        with self._lock:
+            disk_files = self._disk_files()
+            disk_size = sum(os.path.getsize(path) for path in disk_files)
+            return [
+                ("hits", self.hits),
+                ("misses", self.misses),
+                ("memory entries", len(self._entries)),
+                ("memory bytes", self.size),
+                ("memory limit", self.max_size),
+                ("disk entries", len(disk_files)),
+                ("disk bytes", disk_size),
+                ("disk limit", self.disk_max_size if self.directory else 0),
+            ] + [
+                ("ttl %s" % database, ttl)
+                for database, ttl in sorted(self.ttls.items())
+            ]
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_size and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+        if self.directory:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".z")
+
+    def _disk_files(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".z")
+        ]
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = jsonbackend.loads(zlib.decompress(f.read()))
+            # reading counts as a use for the disk LRU
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, zlib.error):
+            return None
+        result = ResultSet(data["names"], data["hostname"])
+        result.columns = data["columns"]
+        description = tuple(tuple(col) for col in data["description"])
+        return CachedResult(description, result, data["stored"], data["size"])
+
+    def _save(self, key, entry):
+        if not self.directory or entry.size > self.disk_max_size:
+            return
+        data = {
+            "description": entry.description,
+            "names": entry.result.names,
+            "hostname": entry.result.hostname,
+            "columns": entry.result.columns,
+            "stored": entry.stored,
+            "size": entry.size,
+        }
+        path = self._path(key)
+        try:
+            ensure_dir_exists(path)
+            with open(path + ".tmp", "wb") as f:
+                f.write(zlib.compress(json.dumps(data).encode("utf-8")))
+            os.replace(path + ".tmp", path)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            _logger.error("Unable to save cached result to %r: %r", path, e)
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = sorted(self._disk_files(), key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in files)
+        while files and total > self.disk_max_size:
+            path = files.pop(0)
+            total -= os.path.getsize(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
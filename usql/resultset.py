@@ -0,0 +1,90 @@
+# Number of values looked at before deciding whether a column repeats
+# enough to be worth interning, and the share of distinct values in that
+# sample below which it is.
+SAMPLE_SIZE = 256
+DISTINCT_RATIO = 0.5
+# Interning stops for a column once it has seen this many distinct values.
+MAX_POOL_SIZE = 65536
+
+
+class ResultSet(object):
+    """Rows of a query result stored column by column.
+
+    Every column is kept in its own list, which needs about half the
+    memory of a list of row tuples and is filled in a single pass over the
+    queryJobs result items. Iterating over a ResultSet yields row tuples.
+
+    Columns that repeat a small set of strings (hostName, upt_asset_id,
+    upt_day, ...) are detected by sampling and interned: every occurrence
+    of a value then refers to one shared object instead of a fresh copy
+    from the JSON decoder. *pools* carries that state between the pages
+    of one result.
+    """
+
+    def __init__(self, names, hostname=False, pools=None):
+        # realtime results lead with the hostName of the reporting asset
+        self.names = list(names)
+        self.hostname = hostname
+        self.columns = [[] for _ in range(len(self.names) + hostname)]
+        # per column: None until sampled, False if not interned, else the
+        # dict of canonical values
+        self.pools = pools if pools is not None else [None] * len(self.columns)
+
+    def extend(self, items):
+        """Append queryJobs result *items* and return how many were added."""
+        columns = self.columns[1:] if self.hostname else self.columns
+        getters = list(zip([column.append for column in columns], self.names))
+        add_hostname = self.columns[0].append if self.hostname else None
+        start = len(self)
+        count = 0
+        for item in items:
+            get = item["rowData"].get
+            for append, name in getters:
+                append(get(name))
+            if add_hostname:
+                add_hostname(item["asset"]["hostName"])
+            count += 1
+        self.intern(start)
+        return count
+
+    def intern(self, start=0):
+        """Deduplicate the strings of repetitive columns from row *start* on."""
+        for index, column in enumerate(self.columns):
+            pool = self.pools[index]
+            start_at = start
+            if pool is None:
+                if len(column) < SAMPLE_SIZE:
+                    continue
+                pool = self.pools[index] = self._sample(column)
+                start_at = 0
+            if pool is False:
+                continue
+            setdefault = pool.setdefault
+            column[start_at:] = [
+                setdefault(value, value) if value.__class__ is str else value
+                for value in column[start_at:]
+            ]
+            if len(pool) > MAX_POOL_SIZE:
+                # the column turned out not to be repetitive after all
+                self.pools[index] = False
+
+    @staticmethod
+    def _sample(column):
+        sample = [value for value in column[:SAMPLE_SIZE] if value.__class__ is str]
+        if not sample or len(set(sample)) > DISTINCT_RATIO * len(sample):
+            return False
+        return {}
+
+    def concat(self, other):
+        """Append all rows of the ResultSet *other* to this one."""
+        for column, values in zip(self.columns, other.columns):
+            column.extend(values)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+    def __getitem__(self, index):
+        return tuple(column[index] for column in self.columns)
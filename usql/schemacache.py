@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from . import jsonbackend
+from .config import ensure_dir_exists
+
+_logger = logging.getLogger(__name__)
+
+
+def wrap_text(text):
+    wrapped_text = "\n".join(
+        line.strip() for line in re.findall(r".{1,70}(?:\s+|$)", text)
+    )
+    return wrapped_text.encode("ascii", "ignore")
+
+
+class Schema(object):
+    """The schema document of one database, indexed by table name.
+
+    Descriptions are wrapped once when the document is loaded so that the
+    schema commands only have to look rows up.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        # table name -> (name, wrapped description)
+        self.tables = OrderedDict()
+        # table name -> tuple of (column name, type, wrapped description)
+        self.columns = OrderedDict()
+        for table in document["tables"]:
+            name = table["name"]
+            self.tables[name] = (name, wrap_text(table["description"]))
+            self.columns[name] = tuple(
+                (
+                    col["name"],
+                    col["type"],
+                    wrap_text(col["description"]) if "description" in col else None,
+                )
+                for col in table["columns"]
+            )
+        self.table_rows = tuple((name,) for name in self.tables)
+        self.column_rows = tuple(
+            (table, col[0]) for table, cols in self.columns.items() for col in cols
+        )
+        # sha256 of the raw document and the HTTP validators (ETag,
+        # Last-Modified) it was served with
+        self.digest = None
+        self.validators = None
+
+
+class SchemaCache(object):
+    """Schema documents of the Uptycs databases, downloaded once and shared
+    by every connection of a session until they are invalidated.
+
+    When *directory* is given every document is also saved there, per
+    *tenant* and database, together with its HTTP validators and a content
+    hash. A later session loads it from disk instead of waiting for the
+    download and marks it stale until :meth:`revalidate` has checked it
+    against the server.
+
+    *fetch* callables take the validators of the cached copy (or None) and
+    return ``(content, validators)``, with *content* None when the server
+    reports the document as not modified.
+    """
+
+    def __init__(self, directory=None, tenant=None):
+        self.directory = directory
+        self.tenant = tenant
+        self._schemas = {}
+        self._stale = set()
+        self._lock = threading.Lock()
+
+    def get(self, database, fetch):
+        """Return the Schema of *database*, loading it from disk or calling
+        *fetch* to download it if it is not cached yet."""
+        with self._lock:
+            schema = self._schemas.get(database)
+            if schema is None:
+                schema = self._load(database)
+                if schema is not None:
+                    self._stale.add(database)
+                else:
+                    _logger.debug("Downloading schema for %r.", database)
+                    content, validators = fetch(None)
+                    schema = self._store(database, content, validators)
+            return schema
+
+    def is_stale(self, database):
+        """Is the cached schema of *database* a copy from disk that has not
+        been revalidated yet?"""
+        return database in self._stale
+
+    def revalidate(self, database, fetch):
+        """Check the cached schema of *database* against the server.
+
+        Return True if the schema changed and was replaced.
+        """
+        with self._lock:
+            schema = self._schemas.get(database)
+            self._stale.discard(database)
+        validators = schema.validators if schema is not None else None
+        try:
+            content, validators = fetch(validators)
+        except Exception as e:
+            _logger.error("Schema revalidation for %r failed: %r", database, e)
+            return False
+        if content is None:
+            _logger.debug("Schema for %r not modified.", database)
+            return False
+        with self._lock:
+            if schema is not None and schema.digest == _digest(content):
+                if validators != schema.validators:
+                    schema.validators = validators
+                    self._save(database, schema)
+                return False
+            _logger.debug("Schema for %r changed.", database)
+            self._store(database, content, validators)
+            return True
+
+    def invalidate(self, database=None):
+        """Forget the schema of *database*, or of all databases."""
+        with self._lock:
+            if database is None:
+                self._schemas.clear()
+                self._stale.clear()
+            else:
+                self._schemas.pop(database, None)
+                self._stale.discard(database)
+
+    def _store(self, database, content, validators):
+        schema = Schema(jsonbackend.loads(content))
+        schema.digest = _digest(content)
+        schema.validators = validators
+        self._schemas[database] = schema
+        self._save(database, schema, content)
+        return schema
+
+    def _path(self, database):
+        name = "%s_%s" % (self.tenant, database) if self.tenant else database
+        return os.path.join(self.directory, name)
+
+    def _load(self, database):
+        if not self.directory:
+            return None
+        path = self._path(database)
+        try:
+            with open(path + ".json", "rb") as f:
+                content = f.read()
+            with open(path + ".meta", "rb") as f:
+                meta = json.loads(f.read().decode("utf-8"))
+            schema = Schema(jsonbackend.loads(content))
+        except (IOError, OSError, ValueError, KeyError) as e:
+            _logger.debug("No usable schema cache at %r: %r", path, e)
+            return None
+        schema.digest = meta.get("digest")
+        schema.validators = meta.get("validators")
+        self._schemas[database] = schema
+        _logger.debug("Loaded schema for %r from %r.", database, path)
+        return schema
+
+    def _save(self, database, schema, content=None):
+        """Write the metadata of *schema*, and its document *content* when
+        given, to the cache directory."""
+        if not self.directory:
+            return
+        path = self._path(database)
+        meta = {"digest": schema.digest, "validators": schema.validators}
+        files = [(".meta", json.dumps(meta).encode("utf-8"))]
+        if content is not None:
+            files.insert(0, (".json", content))
+        try:
+            ensure_dir_exists(path)
+            for suffix, data in files:
+                with open(path + suffix + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + suffix + ".tmp", path + suffix)
+        except (IOError, OSError) as e:
+            _logger.error("Unable to save the schema cache to %r: %r", path, e)
+
+
+def _digest(content):
+    return hashlib.sha256(content).hexdigest()
@@ -0,0 +1,255 @@
+"""Split timemachine queries over sub-windows of their time window.
+
+A query can be sharded when running it on consecutive sub-windows and
+combining the results gives the same answer as one job over the whole
+window: plain row queries, whose results are concatenated, and queries
+that only compute COUNT, SUM, MIN and MAX, whose partial aggregates are
+merged. Anything else (DISTINCT, GROUP BY, ORDER BY, LIMIT, joins,
+subqueries, other aggregates, ...) runs as a single job.
+
+Sub-windows never share a timestamp: each one but the last ends a
+microsecond before the next one starts. A row timestamped exactly on a
+boundary is then counted once, whether or not the API's from/to filter
+includes its upper end, and no row falls in the gap since upt_time has
+no sub-millisecond part.
+"""
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import sqlparse
+from sqlparse.sql import Function, Identifier, IdentifierList
+from sqlparse.tokens import DML, Keyword
+
+_logger = logging.getLogger(__name__)
+
+# Keywords whose result over a window is not the combination of the results
+# over its parts.
+UNSHARDABLE_KEYWORDS = frozenset(
+    (
+        "DISTINCT",
+        "GROUP BY",
+        "HAVING",
+        "ORDER BY",
+        "LIMIT",
+        "OFFSET",
+        "FETCH",
+        "UNION",
+        "UNION ALL",
+        "INTERSECT",
+        "EXCEPT",
+        "WITH",
+        "OVER",
+        "PARTITION BY",
+    )
+)
+
+# Aggregate functions, by the way their partial results merge. Aggregates
+# not listed here make a query unshardable.
+MERGEABLE_AGGREGATES = {"count": "sum", "sum": "sum", "min": "min", "max": "max"}
+AGGREGATES = frozenset(
+    (
+        "approx_distinct",
+        "approx_percentile",
+        "arbitrary",
+        "array_agg",
+        "avg",
+        "bool_and",
+        "bool_or",
+        "count",
+        "count_if",
+        "every",
+        "group_concat",
+        "histogram",
+        "map_agg",
+        "max",
+        "max_by",
+        "min",
+        "min_by",
+        "stddev",
+        "sum",
+        "variance",
+    )
+)
+
+TIMESTAMP_FORMATS = (
+    "%Y-%m-%dt%H:%M:%S.%fz",
+    "%Y-%m-%dt%H:%M:%Sz",
+    "%Y-%m-%dt%H:%M:%S.%f",
+    "%Y-%m-%dt%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d",
+)
+
+EPOCH = datetime(1970, 1, 1)
+# space left between a sub-window and the next
+WINDOW_GAP = timedelta(microseconds=1)
+# Windows needing more buckets than this run without them.
+MAX_BUCKETS = 1000
+
+# How the results of the shards of a query are combined: concatenated
+# rows when *merges* is None, otherwise one merge function name per
+# column.
+ShardPlan = namedtuple("ShardPlan", ["merges"])
+
+
+def plan(sql):
+    """Return the ShardPlan of *sql*, or None if it must run as one job."""
+    statements = [s for s in sqlparse.parse(sql) if str(s).strip()]
+    if len(statements) != 1 or statements[0].get_type() != "SELECT":
+        return None
+    statement = statements[0]
+    tokens = list(statement.flatten())
+    if sum(1 for t in tokens if t.ttype is DML) != 1:
+        # subqueries
+        return None
+    for token in tokens:
+        if token.ttype in Keyword and (
+            token.normalized in UNSHARDABLE_KEYWORDS
+            or token.normalized.endswith("JOIN")
+        ):
+            return None
+
+    items = _select_items(statement)
+    if not items:
+        return None
+    functions = [name for item in items for name in _function_names(item)]
+    if not any(name in AGGREGATES for name in functions):
+        return ShardPlan(None)
+    merges = [_mergeable_aggregate(item) for item in items]
+    if None in merges:
+        return None
+    return ShardPlan(merges)
+
+
+def split_window(from_timestamp, to_timestamp, count):
+    """Split the window between two timestamps into *count* consecutive
+    sub-windows of equal length and return their (from, to) timestamps.
+
+    Return None if the timestamps cannot be parsed.
+    """
+    start = parse_timestamp(from_timestamp)
+    end = parse_timestamp(to_timestamp)
+    if start is None or end is None or end <= start:
+        return None
+    step = (end - start) / count
+    bounds = [start + step * i for i in range(count)] + [end]
+    return _windows(bounds)
+
+
+def bucket_windows(from_timestamp, to_timestamp, seconds):
+    """Split the window between two timestamps at the multiples of *seconds*
+    since the epoch and return the (from, to) timestamps of the pieces.
+
+    The pieces line up with the same fixed buckets whatever the window, so
+    the results of a bucket can be reused when the window moves. Return
+    None if the timestamps cannot be parsed or the window spans more than
+    MAX_BUCKETS buckets.
+    """
+    start = parse_timestamp(from_timestamp)
+    end = parse_timestamp(to_timestamp)
+    if start is None or end is None or end <= start:
+        return None
+    size = timedelta(seconds=seconds)
+    boundary = EPOCH + size * ((start - EPOCH) // size + 1)
+    bounds = [start]
+    while boundary < end:
+        bounds.append(boundary)
+        boundary += size
+        if len(bounds) > MAX_BUCKETS:
+            return None
+    bounds.append(end)
+    if (end - EPOCH) % size:
+        return _windows(bounds)
+    # A whole last bucket gets the same timestamps as when more buckets
+    # follow it, so that it is reused from the cache once they do; the
+    # boundary it ends on is queried on its own.
+    last = format_timestamp(end)
+    return _windows(bounds, closed=False) + [(last, last)]
+
+
+def _windows(bounds, closed=True):
+    """Return the (from, to) timestamps of the windows between consecutive
+    *bounds*, each ending WINDOW_GAP before the next one starts. With
+    *closed* the last one ends at the last bound itself."""
+    windows = []
+    for i in range(len(bounds) - 1):
+        end = bounds[i + 1]
+        if not closed or i < len(bounds) - 2:
+            end -= WINDOW_GAP
+        windows.append((format_timestamp(bounds[i]), format_timestamp(end)))
+    return windows
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    value = value.lower()
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    _logger.debug("Unable to parse timestamp %r.", value)
+    return None
+
+
+def format_timestamp(value):
+    return value.isoformat() + "Z"
+
+
+def merge_aggregates(merges, rows):
+    """Merge the single aggregate row of every shard into one row."""
+    merged = []
+    for index, merge in enumerate(merges):
+        values = [row[index] for row in rows if row[index] is not None]
+        if not values:
+            # SUM, MIN and MAX of no rows; COUNT is never NULL
+            merged.append(None)
+        elif merge == "sum":
+            merged.append(sum(values))
+        elif merge == "min":
+            merged.append(min(values))
+        else:
+            merged.append(max(values))
+    return tuple(merged)
+
+
+def _select_items(statement):
+    seen_select = False
+    for token in statement.tokens:
+        if token.is_whitespace:
+            continue
+        if not seen_select:
+            seen_select = token.ttype is DML
+            continue
+        if isinstance(token, IdentifierList):
+            return list(token.get_identifiers())
+        return [token]
+    return []
+
+
+def _function_names(token):
+    if isinstance(token, Function):
+        yield token.get_name().lower()
+    for child in getattr(token, "tokens", ()):
+        for name in _function_names(child):
+            yield name
+
+
+def _mergeable_aggregate(item):
+    """Return how the aggregate column *item* merges, or None if it is not
+    a plain COUNT/SUM/MIN/MAX call (with an optional alias)."""
+    function = item
+    if isinstance(item, Identifier) and isinstance(item.tokens[0], Function):
+        function = item.tokens[0]
+    if not isinstance(function, Function):
+        return None
+    name = function.get_name().lower()
+    if name not in MERGEABLE_AGGREGATES:
+        return None
+    for nested in function.get_parameters():
+        if any(n in AGGREGATES for n in _function_names(nested)):
+            return None
+    return MERGEABLE_AGGREGATES[name]
@@ -1,7 +1,15 @@
 import logging
+import threading
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 from .uptycs_restcall import connection as uptycs_conn
+from .uptycs_restcall import auth_header, create_session
+from .cleanup import JobCleaner
+from .journal import JobJournal
+from .backoff import CircuitBreaker
+from .schemacache import SchemaCache
 from .uptycs_restcall import OperationalError, DatabaseError
 
 import sqlparse
@@ -26,13 +34,75 @@ class SQLExecute(object):
      show column names
     """
 
-    def __init__(self, url, customer_id, key, secret, database, verify_ssl):
+    # Statements that change the connection's parameters and so must not
+    # overlap with queries before or after them.
+    barrier_statements = ("set", "unset", "use", "kill")
+
+    def __init__(
+        self,
+        url,
+        customer_id,
+        key,
+        secret,
+        database,
+        verify_ssl,
+        session=None,
+        pool_size=10,
+        conn_options=None,
+        schema_cache=None,
+        schema_dir=None,
+        result_cache=None,
+        max_concurrent_queries=1,
+        progress=None,
+        pending_deletes_file=None,
+        journal_file=None,
+        breaker=None,
+        hedger=None,
+    ):
         self.url = url
         self.customer_id = customer_id
         self.key = key
         self.secret = secret
         self.dbname = database
         self.verify_ssl = verify_ssl
+        # The HTTP session is shared by every connection this executor makes
+        # (and by the completion refresher) so keep-alive connections survive
+        # database switches.
+        self.session = session or create_session(pool_size, verify_ssl)
+        # Extra keyword arguments (polling schedule etc.) for each connection.
+        self.conn_options = conn_options or {}
+        # Schema documents are downloaded once per database and shared the
+        # same way, until they are invalidated with rehash. With schema_dir
+        # they are also kept on disk between sessions.
+        self.schema_cache = schema_cache or SchemaCache(schema_dir, customer_id)
+        # Query results are reused across connections too; None disables it.
+        self.result_cache = result_cache
+        # Consecutive queries of multi-statement input run this many at a
+        # time; 1 runs every statement in turn.
+        self.max_concurrent_queries = max_concurrent_queries
+        # callback that shows how a running realtime query is progressing
+        self.progress = progress
+        # query jobs submitted by any connection of this executor that have
+        # not been deleted yet
+        self.active_jobs = set()
+        # Finished query jobs are deleted in the background; the ones left
+        # when the session ends are saved to pending_deletes_file.
+        self.cleaner = JobCleaner(
+            self.session,
+            lambda: auth_header(self.key, self.secret),
+            verify_ssl,
+            path=pending_deletes_file,
+        )
+        # stops every connection of the session from hammering a failing API
+        self.breaker = breaker or CircuitBreaker()
+        # optional Hedger shared by the connections, for their slow GETs
+        self.hedger = hedger
+        # submitted query jobs are recorded in journal_file for \attach
+        self.journal = JobJournal(journal_file) if journal_file else None
+        # set by cancel_active to wake the worker threads of abandoned
+        # queries, cleared when the next statements run
+        self.cancelled = threading.Event()
+        self._executor = None
         self._server_type = None
         self.connection_id = None
         self.conn = None
@@ -52,6 +122,17 @@ class SQLExecute(object):
             secret=self.secret,
             database=db,
             verify_ssl=self.verify_ssl,
+            session=self.session,
+            schema_cache=self.schema_cache,
+            result_cache=self.result_cache,
+            progress=self.progress,
+            active_jobs=self.active_jobs,
+            cleaner=self.cleaner,
+            journal=self.journal,
+            breaker=self.breaker,
+            hedger=self.hedger,
+            cancelled=self.cancelled,
+            **self.conn_options
         )
         if self.conn:
             self.conn.close()
@@ -81,53 +162,175 @@ class SQLExecute(object):
         else:
             components = sqlparse.split(statement)
 
-        for sql in components:
-            # Remove spaces, eol and semi-colons.
-            sql = sql.rstrip(";")
-
-            # \G is treated specially since we have to set the expanded output.
-            if sql.endswith("\\G"):
-                special.set_expanded_output(True)
-                sql = sql[:-2].strip()
-
-            if not self.conn.status and not (
-                sql.startswith(".open")
-                or sql.lower().startswith("use")
-                or sql.startswith("\\u")
-                or sql.startswith("\\?")
-                or sql.startswith("\\q")
-                or sql.startswith("help")
-                or sql.startswith("exit")
-                or sql.startswith("quit")
-            ):
-                _logger.debug(
-                    "Not connected to database. Will not run statement: %s.", sql
-                )
-                raise OperationalError("Not connected to database.")
-                # yield ('Not connected to database', None, None, None)
-                # return
-
-            cur = self.conn if self.conn.status else None
-            try:  # Special command
-                _logger.debug("Trying a dbspecial command. sql: %r", sql)
-                for result in special.execute(cur, sql):
-                    yield result
-            except special.CommandNotFound:  # Regular SQL
-                _logger.debug("Regular sql statement. sql: %r", sql)
-                cur.execute(sql)
-                yield self.get_result(cur)
+        for result in self.run_statements(components):
+            yield result
+
+    def run_statements(self, statements):
+        """Execute the split *statements* and yield their results in order.
+
+        Up to max_concurrent_queries consecutive queries are submitted
+        concurrently, each on a clone of the connection, while the results
+        of the earlier ones are being consumed. Special commands and
+        statements that change the connection (set, unset, use, kill) are
+        barriers: they run only after every query before them has
+        finished and before any query after them is submitted.
+        """
+        self.cancelled.clear()
+        # (future, expanded) of the queries in flight, in statement order
+        pending = deque()
+        try:
+            for sql in statements:
+                # Remove spaces, eol and semi-colons.
+                sql = sql.rstrip(";")
+
+                # \G is treated specially since we have to set the expanded
+                # output, once the results before it have been shown.
+                expanded = sql.endswith("\\G")
+                if expanded:
+                    sql = sql[:-2].strip()
+
+                if self.max_concurrent_queries <= 1 or self.is_barrier(sql):
+                    while pending:
+                        yield self._pending_result(pending)
+                    if expanded:
+                        special.set_expanded_output(True)
+                    for result in self.run_statement(sql):
+                        yield result
+                    continue
+
+                self.check_connected(sql)
+                while len(pending) >= self.max_concurrent_queries or (
+                    pending and pending[0][0].done()
+                ):
+                    yield self._pending_result(pending)
+                future = self.executor().submit(self.run_on_clone, sql)
+                pending.append((future, expanded))
+
+            while pending:
+                yield self._pending_result(pending)
+        finally:
+            # an error or an abandoned generator leaves the later queries
+            # unread; do not start the ones still waiting for a worker and
+            # drop the results of the others once they are there
+            for future, _ in pending:
+                if not future.cancel():
+                    future.add_done_callback(self._discard_future)
+
+    def _pending_result(self, pending):
+        future, expanded = pending.popleft()
+        result = future.result()
+        if expanded:
+            special.set_expanded_output(True)
+        return result
+
+    def _discard_future(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.discard(future.result()[1])
+
+    def discard(self, cursor):
+        """Delete the query job of a result that is not going to be read."""
+        release_result = getattr(cursor, "release_result", None)
+        if release_result is not None:
+            release_result()
+
+    def is_barrier(self, sql):
+        """Must *sql* run on its own, in order with the other statements?"""
+        first_word = sql.split(None, 1)[0].lower() if sql.strip() else ""
+        return first_word in self.barrier_statements or special.is_special_command(
+            sql
+        )
+
+    def check_connected(self, sql):
+        if not self.conn.status and not (
+            sql.startswith(".open")
+            or sql.lower().startswith("use")
+            or sql.startswith("\\u")
+            or sql.startswith("\\?")
+            or sql.startswith("\\q")
+            or sql.startswith("help")
+            or sql.startswith("exit")
+            or sql.startswith("quit")
+        ):
+            _logger.debug(
+                "Not connected to database. Will not run statement: %s.", sql
+            )
+            raise OperationalError("Not connected to database.")
+            # yield ('Not connected to database', None, None, None)
+            # return
+
+    def run_statement(self, sql):
+        """Execute a single statement on the connection itself."""
+        self.check_connected(sql)
+
+        cur = self.conn if self.conn.status else None
+        try:  # Special command
+            _logger.debug("Trying a dbspecial command. sql: %r", sql)
+            for result in special.execute(cur, sql):
+                yield result
+        except special.CommandNotFound:  # Regular SQL
+            _logger.debug("Regular sql statement. sql: %r", sql)
+            # The job is submitted and polled on a worker thread, so Ctrl-C
+            # interrupts the wait at once and cancel_active can cancel it
+            # and wake the worker up for the next query.
+            yield self.executor().submit(self.execute_query, cur, sql).result()
+
+    def run_on_clone(self, sql):
+        """Execute the query *sql* on a clone of the connection. Runs on the
+        worker threads of :meth:`run_statements`."""
+        _logger.debug("Concurrent sql statement. sql: %r", sql)
+        return self.execute_query(self.conn.clone(), sql)
+
+    def execute_query(self, cur, sql):
+        cur.execute(sql)
+        return self.get_result(cur)
+
+    def cancel_active(self):
+        """Cancel every query job that is still running or not yet deleted
+        and return how many there were. The threads waiting on them stop
+        waiting."""
+        self.cancelled.set()
+        jobs = list(self.active_jobs)
+        for query_id_url in jobs:
+            _logger.debug("Cancelling query job %s.", query_id_url)
+            self.conn.cancel_query(query_id_url.rsplit("/", 1)[-1])
+        return len(jobs)
+
+    def close(self, timeout=5.0):
+        """Finish deleting the query jobs of the session, waiting at most
+        *timeout* seconds."""
+        self.cleaner.close(timeout)
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrent_queries,
+                thread_name_prefix="usql-query",
+            )
+        return self._executor
 
     def get_result(self, cursor):
         """Get the current result's data from the cursor."""
         title = headers = None
+        warnings = getattr(cursor, "warnings", None)
+        retries = getattr(cursor, "retries", 0)
+        from_cache = getattr(cursor, "from_cache", False)
 
         # cursor.description is not None for queries that return result sets,
         # e.g. SELECT.
         if cursor.description is not None:
             headers = [x[0] for x in cursor.description]
             status = "{0} row{1} in set"
-            cursor = list(cursor)
-            rowcount = len(cursor)
+            if getattr(cursor, "progressive", False):
+                # The rows of a running realtime query arrive while they are
+                # shown; its progress line reports how many there are.
+                return (title, cursor, headers, None)
+            if cursor.rowcount == -1:
+                cursor = cursor.fetchall()
+                rowcount = len(cursor)
+            else:
+                # The row count is known up front, so hand the cursor over
+                # as is and let the rows stream in while they are rendered.
+                rowcount = cursor.rowcount
         else:
             _logger.debug("No rows in result.")
             status = "Query OK, {0} row{1} affected"
@@ -135,6 +338,14 @@ class SQLExecute(object):
             cursor = None
 
         status = status.format(rowcount, "" if rowcount == 1 else "s")
+        if from_cache:
+            status += " (cached)"
+        if retries:
+            status += " ({0} request{1} retried)".format(
+                retries, "" if retries == 1 else "s"
+            )
+        if warnings:
+            status = "\n".join([status] + ["Warning: %s" % w for w in warnings])
 
         return (title, cursor, headers, status)
 
@@ -176,6 +387,16 @@ class SQLExecute(object):
                 for row in cur:
                     yield (row[0].split(None, 1)[-1],)
 
+    def schema_is_stale(self):
+        """Is the schema of the current database an unchecked copy from
+        disk?"""
+        return self.schema_cache.is_stale(self.dbname)
+
+    def revalidate_schema(self):
+        """Check the schema of the current database against the server and
+        return True if it changed."""
+        return self.conn.revalidate_schema()
+
     def server_type(self):
         self._server_type = ("Uptycs", "29015")
         return self._server_type
@@ -1,16 +1,55 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import json
 import jwt
 import datetime
+import http.client
 import requests
-import re
+import urllib3
+import copy
+import os
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+
+from . import jsonbackend, sharding
+from .backoff import Backoff, CircuitBreaker, retry_after
+from .resultset import ResultSet
+from .schemacache import SchemaCache, wrap_text
+
+try:
+    # optional incremental JSON parser for large result pages
+    import ijson
+except ImportError:
+    ijson = None
 
 _logger = logging.getLogger(__name__)
 
+# Query job states after which a job does not change any more, and the
+# states of the hosts of a realtime job that have not responded yet.
+JOB_DONE = ("FINISHED", "ERROR", "CANCELLED")
+JOB_PENDING = ("QUEUED", "PENDING", "RUNNING")
+
+# Responses to retry: the API or a gateway in front of it is overloaded or
+# briefly unavailable. Only idempotent requests are retried after any of
+# them; a rejected POST is retried after 429 and 503, which mean the job
+# was not created.
+RETRY_STATUSES = (429, 502, 503, 504)
+REJECTED_STATUSES = (429, 503)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+# Failures of a results download that are worth retrying: the job and its
+# result are still there, only the transfer broke.
+FETCH_ERRORS = (
+    requests.exceptions.RequestException,
+    urllib3.exceptions.HTTPError,
+    http.client.HTTPException,
+)
+
 __all__ = [
     "Error",
     "Warning",
@@ -18,6 +57,9 @@ __all__ = [
     "DatabaseError",
     "InternalError",
     "OperationalError",
+    "QueryTimeoutError",
+    "CircuitOpenError",
+    "ResultFetchError",
     "ProgrammingError",
     "DataError",
     "NotSupportedError",
@@ -48,6 +90,32 @@ class OperationalError(DatabaseError):
     pass
 
 
+class QueryTimeoutError(OperationalError):
+    """A query did not finish within its deadline and was cancelled."""
+
+    pass
+
+
+class CircuitOpenError(OperationalError):
+    """Requests are not sent because the API failed too often in a row."""
+
+    pass
+
+
+class ResultFetchError(OperationalError):
+    """The result of a finished query job could not be downloaded.
+
+    The job is kept on the server; ``cursor.refetch(offset)`` downloads the
+    rest of its result, from the *offset* rows already read on, without
+    rerunning the query.
+    """
+
+    def __init__(self, message, cursor=None, offset=0):
+        super(ResultFetchError, self).__init__(message)
+        self.cursor = cursor
+        self.offset = offset
+
+
 class ProgrammingError(DatabaseError):
     pass
 
@@ -64,6 +132,78 @@ class NotSupportedError(DatabaseError):
     pass
 
 
+def create_session(pool_size=10, verify_ssl=True):
+    """Create a keep-alive HTTP session backed by a connection pool.
+
+    Connections (and the TLS sessions negotiated on them) are reused for
+    every request made through the session, so only the first call to a
+    host pays for the TCP and TLS handshakes.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.verify = verify_ssl
+    return session
+
+
+def auth_header(key, secret):
+    """Return the headers that authenticate requests with an API key."""
+    date = datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S GMT")
+    token = jwt.encode({"iss": key}, secret, algorithm="HS256")
+    return {"date": date, "Authorization": "Bearer %s" % (token.decode("utf-8"))}
+
+
+def build_query_object(
+    database,
+    sql,
+    hostname=None,
+    assets_tag=None,
+    from_timestamp=None,
+    to_timestamp=None,
+):
+    """Return the queryJobs request body that runs *sql* on *database*."""
+    query_object = {"type": database, "query": sql}
+    if database == "global":
+        return query_object
+    query_object["filters"] = {}
+    if database == "realtime":
+        query_object["filters"]["live"] = "true"
+    if hostname:
+        query_object["filters"]["hostName"] = hostname
+    if assets_tag:
+        query_object["filters"]["assetTags"] = assets_tag
+    if database == "timemachine":
+        query_object["filters"]["to"] = to_timestamp
+        query_object["filters"]["from"] = from_timestamp
+    return query_object
+
+
+def column_description(columns, realtime=False):
+    """Return the DB-API description of a query job's result *columns*.
+
+    Realtime results start with the name of the host of each row.
+    """
+    names = (["hostName"] if realtime else []) + list(columns)
+    return tuple((name, None, None, None, None, None, None) for name in names)
+
+
+def job_error_message(status):
+    """Return the error message of the failed query job *status*."""
+    _logger.debug(status["error"])
+    brief_messg = None
+    detail_messg = None
+    if "brief" in status["error"]["message"]:
+        brief_messg = status["error"]["message"]["brief"]
+    if "detail" in status["error"]["message"]:
+        detail_messg = status["error"]["message"]["detail"]
+    if not brief_messg and detail_messg:
+        return str(detail_messg)
+    elif not detail_messg and brief_messg:
+        return str(brief_messg)
+    return str(brief_messg) + "\n" + str(detail_messg)
+
+
 class connection(object):
     def __init__(
         self,
@@ -74,6 +214,32 @@ class connection(object):
         database=None,
         hostname=None,
         verify_ssl=True,
+        session=None,
+        pool_size=10,
+        poll_initial_interval=0.05,
+        poll_max_interval=20.0,
+        poll_backoff_factor=1.5,
+        poll_jitter=0.2,
+        result_page_size=10000,
+        schema_cache=None,
+        result_cache=None,
+        time_shards=1,
+        shard_concurrency=4,
+        time_bucket=0,
+        host_concurrency=16,
+        host_timeout=60.0,
+        progress=None,
+        active_jobs=None,
+        query_timeout=0,
+        http_timeout=None,
+        cleaner=None,
+        fetch_retries=3,
+        journal=None,
+        max_retries=3,
+        retry_initial_interval=0.5,
+        breaker=None,
+        hedger=None,
+        cancelled=None,
         **kwargs
     ):
 
@@ -103,6 +269,7 @@ class connection(object):
         self._result_set = tuple()
         self._description = tuple()
         self._error = None
+        self._warnings = []
         self._rowcount = -1
         self._status = True
         self._arraysize = -1
@@ -115,57 +282,239 @@ class connection(object):
         self.to_timestamp = None
         self.assets_tag = None
 
+        # A session handed in by the caller is shared with other connections
+        # and must outlive this one, so only close sessions we created.
+        self._owns_session = session is None
+        self.session = session or create_session(pool_size, verify_ssl)
+        self.schema_cache = schema_cache or SchemaCache()
+        # shared ResultCache of the session, None disables result caching
+        self.result_cache = result_cache
+        # time to live of cached results, None for the database's default
+        self.cache_ttl = None
+        self._cache_key = None
+        # did the result of the last query come from the result cache?
+        self.from_cache = False
+
+        # query job status polling schedule
+        self.poll_initial_interval = poll_initial_interval
+        self.poll_max_interval = poll_max_interval
+        self.poll_backoff_factor = poll_backoff_factor
+        self.poll_jitter = poll_jitter
+        # number of rows fetched per results request, 0 fetches all at once
+        self.result_page_size = result_page_size
+        # times a failed results request is retried before giving up; the
+        # job is then kept so that its result can be downloaded again
+        self.fetch_retries = fetch_retries
+        self._refetch = None
+        # URL of the query job whose result is read lazily; it is deleted
+        # once the result has been read, or dropped with release_result()
+        self._pending_job = None
+        # timemachine queries are split into this many sub-windows, at most
+        # shard_concurrency of them running at a time
+        self.time_shards = time_shards
+        self.shard_concurrency = shard_concurrency
+        # with the result cache, timemachine queries are instead split at
+        # multiples of time_bucket seconds and past buckets are reused
+        self.time_bucket = time_bucket
+        # realtime queries run on every host of hostnames, host_concurrency
+        # at a time, giving each host_timeout seconds to answer
+        self.hostnames = None
+        self.host_concurrency = host_concurrency
+        self.host_timeout = host_timeout
+        # Seconds a query may take before its job is cancelled (0 for no
+        # limit), and seconds to wait for any single HTTP response.
+        self.query_timeout = query_timeout
+        self.http_timeout = http_timeout
+        # time.time() by which the current query must have finished
+        self.deadline = None
+        # progress(responded, hosts, rows, done) makes realtime queries show
+        # rows while hosts are still responding
+        self.progress = progress
+        self.progressive = False
+        # URLs of the query jobs of this connection and its clones that
+        # have not been deleted yet, so that they can be cancelled
+        self.active_jobs = active_jobs if active_jobs is not None else set()
+        # JobCleaner that deletes finished jobs in the background, None
+        # deletes them right away
+        self.cleaner = cleaner
+        # JobJournal recording the jobs submitted, so that their results
+        # can be collected by a later session with \attach
+        self.journal = journal
+        self._query_object = None
+
+        # Requests failing with RETRY_STATUSES or a lost connection are
+        # retried max_retries times with backoff; retries counts them for
+        # the current query. The CircuitBreaker is shared by all connections
+        # of a session.
+        self.max_retries = max_retries
+        self.retry_initial_interval = retry_initial_interval
+        self.retries = 0
+        self.breaker = breaker or CircuitBreaker()
+        # Hedger duplicating slow status and results GETs, None sends every
+        # request once
+        self.hedger = hedger
+        # Set when the queries of the session are cancelled: waits between
+        # polls and retries end at once, freeing the thread for the next
+        # query. Shared by the connections of a session.
+        self.cancelled = cancelled or threading.Event()
+
         # create a header for session.
-        self.header = {}
-        utcnow = datetime.utcnow()
-        date = utcnow.strftime("%a, %d %b %Y %H:%M:%S GMT")
-        authVar = jwt.encode({"iss": self.key}, self.secret, algorithm="HS256")
-        authorization = "Bearer %s" % (authVar.decode("utf-8"))
-        self.header["date"] = date
-        self.header["Authorization"] = authorization
+        self.header = auth_header(self.key, self.secret)
 
-    def run_query(self, sql):
+    def run_query(self, sql, query_object=None):
 
         # prepare the query object and execute the sql
-        query_object = {}
+        if query_object is None:
+            query_object = self.query_object(sql)
         final_url = self.query_job_url
-        if self.database == "realtime":
-            query_object["type"] = "realtime"
-            query_object["query"] = sql
-            query_object["filters"] = {}
-            query_object["filters"]["live"] = "true"
-            if self.hostname:
-                query_object["filters"]["hostName"] = self.hostname
-            if self.assets_tag:
-                query_object["filters"]["assetTags"] = self.assets_tag
+        _logger.debug(final_url)
+        response = self._request("POST", final_url, json=query_object)
+        self._query_object = query_object
 
-        if self.database == "global":
-            query_object["query"] = sql
-            query_object["type"] = "global"
+        return response
 
+    def query_object(self, sql):
+        """Return the queryJobs request body that runs *sql*."""
         if self.database == "timemachine":
-            query_object["type"] = "timemachine"
-            query_object["query"] = sql
-            query_object["filters"] = {}
-            if not self.from_timestamp:
-                previous_day = datetime.now() - timedelta(days=1)
-                self.from_timestamp = previous_day.isoformat() + "Z"
-            if not self.to_timestamp:
-                self.to_timestamp = datetime.now().isoformat() + "Z"
-            if self.hostname:
-                query_object["filters"]["hostName"] = self.hostname
-            if self.assets_tag:
-                query_object["filters"]["assetTags"] = self.assets_tag
-
-            query_object["filters"]["to"] = self.to_timestamp
-            query_object["filters"]["from"] = self.from_timestamp
+            self.default_time_window()
+        return build_query_object(
+            self.database,
+            sql,
+            hostname=self.hostname,
+            assets_tag=self.assets_tag,
+            from_timestamp=self.from_timestamp,
+            to_timestamp=self.to_timestamp,
+        )
 
-        _logger.debug(final_url)
-        response = requests.post(
-            final_url, headers=self.header, json=query_object, verify=self.verify_ssl
-        )  # type: url response
+    def default_time_window(self):
+        """Query the last day unless a time window was set. The window is
+        fixed by the first timemachine query of the connection."""
+        if not self.from_timestamp:
+            previous_day = datetime.now() - timedelta(days=1)
+            self.from_timestamp = previous_day.isoformat() + "Z"
+        if not self.to_timestamp:
+            self.to_timestamp = datetime.now().isoformat() + "Z"
+
+    def clone(self):
+        """Return a connection with the same database, filters and time
+        window that shares this one's session and caches, to run another
+        query while this one is busy."""
+        if self.database == "timemachine":
+            self.default_time_window()
+        conn = copy.copy(self)
+        conn._owns_session = False
+        conn._result_set = tuple()
+        conn._description = tuple()
+        conn._error = None
+        conn._warnings = []
+        conn.progressive = False
+        conn._rowcount = -1
+        conn._arraysize = -1
+        conn._json_result = {}
+        conn._cache_key = None
+        conn.from_cache = False
+        conn._refetch = None
+        conn._pending_job = None
+        conn.retries = 0
+        conn.query_id = None
+        conn.query_status = None
+        conn.query_id_url = None
+        return conn
+
+    def _request(self, method, url, headers=None, bounded=True, **kwargs):
+        """Send a request to the Uptycs API over the pooled session.
+
+        Requests give up after http_timeout seconds. Once the deadline of
+        the current query passes, its job is cancelled and QueryTimeoutError
+        raised instead of sending or waiting for more; requests that are not
+        *bounded* by it (cancelling and deleting jobs, downloading schemas)
+        are sent regardless. Overloaded, unreachable or slow upstreams are
+        retried with backoff, honoring Retry-After, and the circuit breaker
+        stops sending requests while the API keeps failing.
+        """
+        if headers:
+            headers = dict(self.header, **headers)
+        backoff = None
+        attempts = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    "The Uptycs API keeps failing, not sending requests for "
+                    "%d seconds." % self.breaker.reset_timeout
+                )
+            timeout = self.http_timeout
+            # does the request have to give up when the deadline passes?
+            deadline_bound = self.deadline is not None and bounded
+            if deadline_bound:
+                remaining = self.time_left()
+                if not timeout or remaining < timeout:
+                    timeout = remaining
+            if timeout:
+                kwargs["timeout"] = timeout
+            hint = None
+            try:
+                response = self._send(method, url, headers or self.header, kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                self.breaker.failure()
+                if (
+                    deadline_bound
+                    and isinstance(e, requests.exceptions.Timeout)
+                    and time.time() >= self.deadline
+                ):
+                    # the request was cut short by the deadline of the query
+                    self.expire()
+                if method not in IDEMPOTENT_METHODS or attempts >= self.max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.success()
+                    return response
+                self.breaker.failure()
+                retryable = (
+                    method in IDEMPOTENT_METHODS
+                    or response.status_code in REJECTED_STATUSES
+                )
+                if not retryable or attempts >= self.max_retries:
+                    return response
+                hint = retry_after(response)
+                response.close()
+
+            attempts += 1
+            self.retries += 1
+            if backoff is None:
+                backoff = Backoff(
+                    initial=self.retry_initial_interval,
+                    maximum=self.poll_max_interval,
+                    factor=2.0,
+                    jitter=self.poll_jitter,
+                )
+            delay = backoff.next_delay(hint=hint)
+            _logger.debug("Retrying %s %s in %.2fs.", method, url, delay)
+            if self.deadline is not None and bounded:
+                delay = min(delay, max(self.deadline - time.time(), 0))
+            self.pause(delay)
+
+    def _send(self, method, url, headers, kwargs):
+        """Send one request; the status and results GETs of query jobs are
+        hedged when a Hedger is set, each against the latencies of its own
+        kind."""
+
+        def send():
+            return self.session.request(
+                method, url, headers=headers, verify=self.verify_ssl, **kwargs
+            )
 
-        return response
+        if (
+            self.hedger is not None
+            and method == "GET"
+            and url.startswith(self.query_job_url + "/")
+        ):
+            kind = "results" if url.endswith("/results") else "status"
+            return self.hedger.run(send, kind)
+        return send()
 
     @property
     def current_database(self):
@@ -177,6 +526,11 @@ class connection(object):
             return None
         return self._description
 
+    @property
+    def warnings(self):
+        """Problems with the last query that did not make it fail."""
+        return self._warnings
+
     @property
     def rowcount(self):
         return self._rowcount
@@ -186,10 +540,7 @@ class connection(object):
         return self._status
 
     def wrap_text(self, text):
-        wrapped_text = "\n".join(
-            line.strip() for line in re.findall(r".{1,70}(?:\s+|$)", text)
-        )
-        return wrapped_text.encode("ascii", "ignore")
+        return wrap_text(text)
 
     def hostname_in_resultset(self, asset_id):
         for info in self._json_result["summaries"]:
@@ -197,9 +548,20 @@ class connection(object):
                 return info["asset"]["hostName"]
         return asset_id
 
-    def execute(self, sql, arg=None, **kwargs):
+    def execute(self, sql, arg=None, use_cache=True, deadline=None, **kwargs):
+        self.release_result()
+        # no job of this query yet for the deadline to cancel
+        self.query_id_url = None
+        # the deadline of the query; shards and hosts of a query share it
+        if deadline is None and self.query_timeout:
+            deadline = time.time() + self.query_timeout
+        self.deadline = deadline
+        self.retries = 0
+        self.from_cache = False
         self._result_set = tuple()
         self._description = tuple()
+        self._warnings = []
+        self.progressive = False
         self._rowcount = -1
         self._arraysize = -1
         self._json_result = {}
@@ -210,8 +572,10 @@ class connection(object):
             self.list_databases()
             return self._result_set
 
-        if sql_string.startswith("kill "):
-            self.cancel_query(self.query_id)
+        if sql_string == "kill" or sql_string.startswith("kill "):
+            # "kill <query job id>", or the last query job of the connection
+            words = sql.split()
+            self.cancel_query(words[1] if len(words) > 1 else self.query_id)
             return self._result_set
 
         if sql_string.startswith(
@@ -239,6 +603,13 @@ class connection(object):
             return self._result_set
 
         # handling set commands
+        if sql_string.startswith("set hostnames =", 0, len("set hostnames =")):
+            self.set_hostnames(sql.split("=", 1)[1].strip().rstrip(";").strip())
+            self._result_set = tuple()
+            self._description = tuple()
+            self._rowcount = -1
+            return self._result_set
+
         if sql_string.startswith("set hostname =", 0, len("set hostname =")):
             if len(sql_string_array) == 4:
                 asset_name = sql_string_array[3]
@@ -280,6 +651,27 @@ class connection(object):
                 self._rowcount = -1
                 return self._result_set
 
+        if sql_string.startswith("set query_timeout =", 0, len("set query_timeout =")):
+            if len(sql_string_array) == 4:
+                try:
+                    self.query_timeout = max(float(sql_string_array[3]), 0)
+                except ValueError:
+                    raise OperationalError(
+                        "query_timeout must be a number of seconds."
+                    )
+            self._result_set = tuple()
+            self._description = tuple()
+            self._rowcount = -1
+            return self._result_set
+
+        if sql_string.startswith("set time_shards =", 0, len("set time_shards =")):
+            if len(sql_string_array) == 4 and sql_string_array[3].isdigit():
+                self.time_shards = max(int(sql_string_array[3]), 1)
+            self._result_set = tuple()
+            self._description = tuple()
+            self._rowcount = -1
+            return self._result_set
+
         if sql_string.startswith("set assets_tag =", 0, len("set assets_tag =")):
             if len(sql_string_array) == 4:
                 tag = sql_string_array[3]
@@ -294,6 +686,13 @@ class connection(object):
                 return self._result_set
 
         # handling unset commands
+        if sql_string.startswith("unset hostnames", 0, len("unset hostnames")):
+            self.hostnames = None
+            self._result_set = tuple()
+            self._description = tuple()
+            self._rowcount = -1
+            return self._result_set
+
         if sql_string.startswith("unset hostname", 0, len("unset hostname")):
             self.hostname = None
             self._result_set = tuple()
@@ -324,8 +723,23 @@ class connection(object):
             self._rowcount = -1
             return self._result_set
 
+        if sql_string.startswith("unset query_timeout", 0, len("unset query_timeout")):
+            self.query_timeout = 0
+            self._result_set = tuple()
+            self._description = tuple()
+            self._rowcount = -1
+            return self._result_set
+
+        if sql_string.startswith("unset time_shards", 0, len("unset time_shards")):
+            self.time_shards = 1
+            self._result_set = tuple()
+            self._description = tuple()
+            self._rowcount = -1
+            return self._result_set
+
         if sql_string.startswith("unset all", 0, len("unset all")):
             self.hostname = None
+            self.hostnames = None
             self.to_timestamp = None
             self.from_timestamp = None
             self.assets_tag = None
@@ -347,89 +761,565 @@ class connection(object):
             if len(sql_string_array) == 2:
                 rows = [
                     ("hostname", self.hostname),
+                    ("hostnames", self.hostnames_parameter()),
                     ("to_timestamp", self.to_timestamp),
                     ("from_timestamp", self.from_timestamp),
                     ("assets_tag", self.assets_tag),
+                    ("time_shards", self.time_shards),
+                    ("query_timeout", self.query_timeout),
                 ]
             elif len(sql_string_array) > 2:
                 if sql_string_array[2] == "hostname":
                     rows = [("hostname", self.hostname)]
+                if sql_string_array[2] == "hostnames":
+                    rows = [("hostnames", self.hostnames_parameter())]
                 if sql_string_array[2] == "to_timestamp":
                     rows = [("to_timestamp", self.to_timestamp)]
                 if sql_string_array[2] == "from_timestamp":
                     rows = [("from_timestamp", self.from_timestamp)]
                 if sql_string_array[2] == "assets_tag":
                     rows = [("assets_tag", self.assets_tag)]
+                if sql_string_array[2] == "time_shards":
+                    rows = [("time_shards", self.time_shards)]
+                if sql_string_array[2] == "query_timeout":
+                    rows = [("query_timeout", self.query_timeout)]
                 if sql_string_array[2] == "all":
                     rows = [
                         ("hostname", self.hostname),
+                        ("hostnames", self.hostnames_parameter()),
                         ("to_timestamp", self.to_timestamp),
                         ("from_timestamp", self.from_timestamp),
                         ("assets_tag", self.assets_tag),
+                        ("time_shards", self.time_shards),
+                        ("query_timeout", self.query_timeout),
                     ]
             self._result_set = rows
             self._arraysize = len(rows)
             self._rowcount = len(self._result_set)
             return self._result_set
 
-        response = self.run_query(sql)
+        if self.database == "realtime" and self.hostnames:
+            self.execute_fanout(sql, use_cache)
+            return self._result_set
+
+        if self.database == "timemachine" and (
+            self.time_shards > 1 or self.bucketed()
+        ):
+            if self.execute_sharded(sql, use_cache):
+                return self._result_set
+
+        query_object = self.query_object(sql)
+        self._cache_key = None
+        if self.result_cache is not None and self.result_cache.enabled(self.database):
+            self._cache_key = self.result_cache.key(query_object)
+            cached = (
+                self.result_cache.get(self.database, self._cache_key, self.cache_ttl)
+                if use_cache
+                else None
+            )
+            if cached is not None:
+                _logger.debug("Using cached result for %r.", sql)
+                self.from_cache = True
+                self._description = cached.description
+                self._pages = iter([cached.result])
+                self._result_set = self.iter_results(self._pages)
+                self._rowcount = self._arraysize = len(cached.result)
+                return self._result_set
+
+        response = self.run_query(sql, query_object)
 
         self.response_to_tuple(response)
 
         return self._result_set
 
-    # function to get the status of query_id and response
-    def query_id_status(self):
-
-        self.query_id_url = self.query_job_url + "/" + self.query_id
-        response = requests.get(
-            url=self.query_id_url, headers=self.header, verify=self.verify_ssl
-        )
-        if response.status_code == requests.codes.ok:
-            json_content = json.loads(response.content.decode("utf-8"))
+    def set_hostnames(self, value):
+        """Set the hosts realtime queries run on from a parenthesized list
+        of names, or from the path of a file with one name per line."""
+        if value.startswith("(") and value.endswith(")"):
+            names = value[1:-1].split(",")
+        else:
+            path = os.path.expanduser(value.strip("'\""))
+            try:
+                with open(path) as f:
+                    names = [line for line in f if not line.lstrip().startswith("#")]
+            except IOError as e:
+                raise OperationalError(str(e))
+        names = [name.strip().strip("'\"") for name in names]
+        self.hostnames = [name for name in names if name] or None
+
+    def hostnames_parameter(self):
+        if not self.hostnames:
+            return None
+        return "%d hosts: %s" % (len(self.hostnames), ", ".join(self.hostnames))
+
+    def execute_sharded(self, sql, use_cache=True):
+        """Run the timemachine query *sql* as concurrent query jobs over
+        time_shards consecutive sub-windows of the time window and combine
+        their results. Without *use_cache* no shard is taken from the
+        result cache.
+
+        Return False, without running anything, if the query cannot be
+        split safely and has to run as a single job.
+        """
+        shard_plan = sharding.plan(sql)
+        self.default_time_window()
+        bucketed = self.bucketed()
+        if not shard_plan:
+            windows = None
+        elif bucketed:
+            windows = sharding.bucket_windows(
+                self.from_timestamp, self.to_timestamp, self.time_bucket
+            )
         else:
-            raise OperationalError("ERROR: failed to get query status")
-        while json_content["status"] not in ["FINISHED", "ERROR", "CANCELLED"]:
-            response = requests.get(
-                url=self.query_id_url, headers=self.header, verify=self.verify_ssl
+            windows = sharding.split_window(
+                self.from_timestamp, self.to_timestamp, self.time_shards
             )
+        if not windows:
+            _logger.debug("Query cannot be sharded, running a single job.")
+            return False
+
+        # the "Z" timestamps of the buckets are UTC
+        now = datetime.utcnow()
+        shards = []
+        for from_timestamp, to_timestamp in windows:
+            shard = self.clone()
+            shard.time_shards = 1
+            shard.time_bucket = 0
+            shard.from_timestamp = from_timestamp
+            shard.to_timestamp = to_timestamp
+            if bucketed:
+                if sharding.parse_timestamp(to_timestamp) <= now:
+                    # the data of a bucket that has ended does not change
+                    shard.cache_ttl = self.result_cache.bucket_ttl
+                else:
+                    # still open, always run it again
+                    shard.result_cache = None
+            shards.append(shard)
+        _logger.debug("Running %d shards of %r.", len(shards), sql)
+        with ThreadPoolExecutor(max_workers=self.shard_concurrency) as pool:
+            results = list(
+                pool.map(lambda shard: shard.run_shard(sql, use_cache), shards)
+            )
+        self.retries += sum(shard.retries for shard in shards)
+        self.from_cache = all(shard.from_cache for shard in shards)
+
+        self.combine_results(results, shard_plan.merges)
+        return True
+
+    def combine_results(self, results, merges=None):
+        """Make the (description, rows) *results* of several query jobs the
+        result of this connection: their rows one after another, or with
+        *merges*, their aggregate rows merged into one."""
+        for description, _ in results:
+            if description:
+                self._description = description
+                break
+        parts = [rows for _, rows in results if len(rows)]
+        if merges is None:
+            self._pages = iter(parts)
+            self._result_set = self.iter_results(self._pages)
+            self._rowcount = sum(len(rows) for rows in parts)
+        elif self._description:
+            rows = [part[0] for part in parts]
+            self._result_set = [sharding.merge_aggregates(merges, rows)]
+            self._rowcount = 1
+        self._arraysize = self._rowcount
+
+    def execute_fanout(self, sql, use_cache=True):
+        """Run the realtime query *sql* as one query job per host of
+        hostnames, at most host_concurrency at a time, and concatenate
+        their results.
+
+        A host whose job fails or does not finish within host_timeout
+        seconds is left out of the result and reported in warnings.
+        """
+        hosts = []
+        for hostname in self.hostnames:
+            host = self.clone()
+            host.hostname = hostname
+            host.hostnames = None
+            host.progress = None
+            hosts.append(host)
+        _logger.debug("Running %r on %d hosts.", sql, len(hosts))
+        with ThreadPoolExecutor(max_workers=self.host_concurrency) as pool:
+            results = list(
+                pool.map(lambda host: host.run_host(sql, use_cache), hosts)
+            )
+        self.retries += sum(host.retries for host in hosts)
+
+        failures = [
+            (host.hostname, result[2])
+            for host, result in zip(hosts, results)
+            if result[2]
+        ]
+        if len(failures) == len(hosts):
+            raise OperationalError("%s: %s" % failures[0])
+        for hostname, error in failures:
+            self._warnings.append("%s: %s" % (hostname, error))
+        self.combine_results([result[:2] for result in results if not result[2]])
+
+    def run_host(self, sql, use_cache=True):
+        """Run *sql* on this host's connection within host_timeout seconds.
+
+        Return its description, rows and the error it failed with, if any.
+        """
+        if self.host_timeout:
+            host_deadline = time.time() + self.host_timeout
+            self.deadline = min(self.deadline or host_deadline, host_deadline)
+        try:
+            return self.run_shard(sql, use_cache) + (None,)
+        except OperationalError as e:
+            return None, (), str(e)
+
+    def bucketed(self):
+        """Are timemachine queries split at time_bucket boundaries so that
+        the results of past buckets are reused from the result cache?"""
+        return (
+            self.time_bucket > 0
+            and self.result_cache is not None
+            and self.result_cache.enabled(self.database)
+        )
+
+    def run_shard(self, sql, use_cache=True):
+        """Run *sql* on this shard, within the deadline of the query it is
+        part of, and return its description and rows."""
+        self.execute(sql, use_cache=use_cache, deadline=self.deadline)
+        return self.description, self.fetchall()
+
+    def poll_backoff(self):
+        """Return a fresh polling schedule for one query job."""
+        return Backoff(
+            initial=self.poll_initial_interval,
+            maximum=self.poll_max_interval,
+            factor=self.poll_backoff_factor,
+            jitter=self.poll_jitter,
+        )
 
+    # function to get the status of query_id and response
+    def query_id_status(self, until_columns=False):
+        """Poll the status of the current query job until it is done, or
+        with *until_columns* until its result columns are known."""
+        self.query_id_url = self.query_job_url + "/" + self.query_id
+        backoff = self.poll_backoff()
+        while True:
+            response = self._request("GET", self.query_id_url)
             if response.status_code == requests.codes.ok:
-                json_content = json.loads(response.content.decode("utf-8"))
+                json_content = jsonbackend.loads(response.content)
             else:
                 raise OperationalError("ERROR: failed to get query status")
+            if json_content["status"] in JOB_DONE:
+                break
+            if until_columns and json_content.get("columns"):
+                break
+            # Back off between polls; a Retry-After header from the server
+            # tells us roughly how long the job still needs.
+            delay = backoff.next_delay(hint=retry_after(response))
+            if self.deadline is not None:
+                delay = min(delay, self.time_left())
+            self.pause(delay)
+
+        return json_content
+
+    def pause(self, delay):
+        """Wait *delay* seconds before the next request, or raise
+        OperationalError as soon as the queries are cancelled."""
+        if self.cancelled.wait(delay):
+            raise OperationalError("Query cancelled.")
+
+    def time_left(self):
+        """Return the seconds left until the deadline of the current query.
+
+        Once it has passed the query job is cancelled on the server and
+        QueryTimeoutError is raised.
+        """
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            self.expire()
+        return remaining
+
+    def expire(self):
+        """Cancel the job of the current query, whose deadline has passed,
+        and raise QueryTimeoutError."""
+        self.deadline = None
+        if self.query_id_url in self.active_jobs:
+            self.cancel_query(self.query_id)
+        raise QueryTimeoutError("Query timed out.")
+
+    def iter_result_pages(self, columns, offset=0):
+        """Yield the result of the current query job, from row *offset* on,
+        as one ResultSet per results page, and delete the job once all pages
+        have been read.
+
+        Only one page is held in memory at a time, so rows can be shown
+        while the rest of the result set is still being downloaded. A page
+        whose download fails is fetched again, from the same offset, up to
+        fetch_retries times. After that ResultFetchError is raised and the
+        job is kept for :meth:`refetch`.
+        """
+        query_id_url = self.query_id_url
+        query_result_url = query_id_url + "/results"
+        page_size = self.result_page_size
+        # interning state shared by all pages of this result
+        pools = None
+        keep_job = False
+        try:
+            while True:
+                page = self.fetch_result_page(query_result_url, columns, offset, pools)
+                pools = page.pools
+                yield page
+
+                count = len(page)
+                offset += count
+                if not page_size or count < page_size:
+                    break
+        except ResultFetchError:
+            keep_job = True
+            self._pending_job = None
+            self._refetch = (query_id_url, columns)
+            raise
+        finally:
+            if not keep_job and self._pending_job == query_id_url:
+                self.delete_query(query_id_url)
+
+    def fetch_result_page(self, url, columns, offset, pools=None):
+        """Download the results page starting at row *offset*, retrying
+        transport failures with backoff, and return it as a ResultSet."""
+        params = None
+        if self.result_page_size:
+            params = {"limit": self.result_page_size, "offset": offset}
+        backoff = self.poll_backoff()
+        attempts = 0
+        while True:
+            if self.deadline is not None:
+                self.time_left()
+            hint = None
+            try:
+                response = self._request(
+                    "GET", url, params=params, stream=ijson is not None
+                )
+                if response.status_code == requests.codes.ok:
+                    page = ResultSet(
+                        columns, hostname=self.database == "realtime", pools=pools
+                    )
+                    with closing(response):
+                        page.extend(self.result_items(response, first_page=not offset))
+                    return page
+                response.close()
+                if response.status_code < 500 and response.status_code != 429:
+                    raise OperationalError("ERROR: failed to get query results")
+                error = "ERROR: failed to get query results"
+                hint = retry_after(response)
+            except FETCH_ERRORS as e:
+                error = "ERROR: lost the connection while getting query results"
+                _logger.debug("Results page at offset %d failed: %r", offset, e)
+            attempts += 1
+            if attempts > self.fetch_retries:
+                raise ResultFetchError(
+                    "%s (query job %s is kept)" % (error, self.query_id),
+                    self,
+                    offset,
+                )
+            self.pause(backoff.next_delay(hint=hint))
 
-        query_result_url = self.query_id_url + "/results"
-        result_response = requests.get(
-            url=query_result_url, headers=self.header, verify=self.verify_ssl
-        )
-        self.delete_query()
+    def attach(self, query_id):
+        """Fetch the result of the query job *query_id*, submitted earlier
+        and possibly by another session, once it has finished.
 
-        return json_content, json.loads(result_response.content.decode("utf-8"))
+        No query_timeout applies: the job is not ours to cancel, and Ctrl-C
+        stops waiting for it."""
+        self.release_result()
+        self.from_cache = False
+        self.deadline = None
+        self._result_set = tuple()
+        self._description = tuple()
+        self._warnings = []
+        self.progressive = False
+        self._rowcount = -1
+        self._arraysize = -1
+        self._json_result = {}
+        self.query_id = query_id
+        # not an active job: Ctrl-C stops waiting for it but leaves it to
+        # be attached to again
+        self.query_id_url = self.query_job_url + "/" + query_id
+        status = self.query_id_status()
+        if status["status"] != "FINISHED":
+            self.delete_query()
+            if status["status"] == "ERROR":
+                raise OperationalError(self.job_error(status))
+            raise OperationalError("Query job %s was cancelled." % query_id)
+        columns = [col["name"] for col in status.get("columns") or ()]
+        if not columns:
+            self.delete_query()
+            return self._result_set
+        self._description = column_description(
+            columns, realtime=self.database == "realtime"
+        )
+        rowcount = status.get("rowCount")
+        if rowcount == 0:
+            self.delete_query()
+            self._rowcount = self._arraysize = 0
+            return self._result_set
+        self._pending_job = self.query_id_url
+        self._pages = self.iter_result_pages(columns)
+        self._result_set = self.iter_results(self._pages)
+        self._rowcount = self._arraysize = -1 if rowcount is None else rowcount
+        return self._result_set
 
-    def delete_query(self):
-        # cleanup the query from Uptycs after capturing the data
-        delete_query = requests.delete(
-            url=self.query_id_url, headers=self.header, verify=self.verify_ssl
+    def refetch(self, offset=0):
+        """Download the result of the query job whose download failed again,
+        from row *offset* on."""
+        if self._refetch is None:
+            raise OperationalError("No query result to fetch again.")
+        self.release_result()
+        self.query_id_url, columns = self._refetch
+        self._refetch = None
+        self.query_id = self.query_id_url.rsplit("/", 1)[-1]
+        self._pending_job = self.query_id_url
+        self._pages = self.iter_result_pages(columns, offset)
+        self._result_set = self.iter_results(self._pages)
+
+    def iter_progressive_pages(self, columns):
+        """Yield the rows of the running realtime job as they arrive, as one
+        ResultSet per batch, and report the hosts that have responded
+        through the progress callback.
+
+        Ctrl-C cancels the job and ends the result with the rows that have
+        arrived. The job is deleted once it is done or cancelled.
+        """
+        query_id_url = self.query_id_url
+        query_result_url = query_id_url + "/results"
+        page_size = self.result_page_size or 10000
+        backoff = self.poll_backoff()
+        offset = 0
+        pools = None
+        status = {}
+        try:
+            while True:
+                response = self._request("GET", query_id_url)
+                if response.status_code != requests.codes.ok:
+                    raise OperationalError("ERROR: failed to get query status")
+                status = jsonbackend.loads(response.content)
+                if status["status"] == "ERROR":
+                    raise OperationalError(self.job_error(status))
+                done = status["status"] in JOB_DONE
+
+                # rows are appended as hosts respond, fetch the new ones
+                while True:
+                    params = {"limit": page_size, "offset": offset}
+                    page_response = self._request(
+                        "GET", query_result_url, params=params
+                    )
+                    if page_response.status_code != requests.codes.ok:
+                        raise OperationalError("ERROR: failed to get query results")
+                    page = ResultSet(columns, hostname=True, pools=pools)
+                    pools = page.pools
+                    count = page.extend(
+                        self.result_items(page_response, first_page=True, stream=False)
+                    )
+                    offset += count
+                    self.report_progress(offset, done and count < page_size)
+                    if count:
+                        yield page
+                    if count < page_size:
+                        break
+                if done:
+                    break
+                delay = backoff.next_delay(hint=retry_after(response))
+                if self.deadline is not None:
+                    delay = min(delay, self.time_left())
+                time.sleep(delay)
+        except KeyboardInterrupt:
+            _logger.debug("Realtime query stopped after %d rows.", offset)
+            self._request(
+                "PUT", query_id_url, bounded=False, json={"status": "CANCELLED"}
+            )
+            self.report_progress(offset, True)
+        finally:
+            if self._pending_job == query_id_url:
+                self.delete_query(query_id_url)
+
+    def report_progress(self, rows, done):
+        """Tell the progress callback how many hosts of the running realtime
+        job have responded and how many rows have arrived."""
+        summaries = self._json_result.get("summaries") or []
+        responded = sum(
+            1 for summary in summaries if summary.get("status") not in JOB_PENDING
         )
+        self.progress(responded, len(summaries), rows, done)
+
+    def iter_results(self, pages):
+        """Yield row tuples from an iterator of ResultSet *pages*."""
+        for page in pages:
+            for row in page:
+                yield row
+
+    def result_items(self, response, first_page=False, stream=True):
+        """Yield the items of a results response.
+
+        With ijson installed the body is read in chunks and every item is
+        yielded as soon as it has been decoded, so memory use is bounded by
+        the size of a single row. Otherwise, or without *stream*, the whole
+        body is decoded at once with the configured JSON backend and the rest
+        of the first page's response (summaries, ...) is kept.
+        """
+        if ijson is not None and stream:
+            response.raw.decode_content = True
+            for item in ijson.items(response.raw, "items.item", use_float=True):
+                yield item
+            return
+
+        json_result = jsonbackend.loads(response.content)
+        items = json_result.pop("items", None) or []
+        if first_page:
+            self._json_result = json_result
+        for item in items:
+            yield item
+
+    def job_error(self, status):
+        """Return the error message of the failed query job *status*."""
+        return job_error_message(status)
+
+    def delete_query(self, query_id_url=None):
+        # cleanup the query from Uptycs after capturing the data
+        query_id_url = query_id_url or self.query_id_url
+        if query_id_url == self._pending_job:
+            self._pending_job = None
+        self.active_jobs.discard(query_id_url)
+        if self.journal is not None:
+            self.journal.delete(query_id_url.rsplit("/", 1)[-1])
+        if self.cleaner is not None:
+            self.cleaner.delete(query_id_url)
+            return
+        delete_query = self._request("DELETE", query_id_url, bounded=False)
         if delete_query.status_code != requests.codes.ok:
             _logger.info("failed to delete query")
 
-    def cancel_query(self, query_id):
+    def release_result(self):
+        """Drop the result of the last query if it has not been read to the
+        end and delete its query job, cancelling it if it is still running."""
+        query_id_url = self._pending_job
+        if query_id_url is None:
+            return
+        if self.progressive:
+            self.cancel_query(query_id_url.rsplit("/", 1)[-1])
+        else:
+            self.delete_query(query_id_url)
 
+    def cancel_query(self, query_id):
+        """Cancel and delete the query job *query_id*."""
+        if not query_id:
+            return
+        query_id_url = self.query_job_url + "/" + str(query_id)
         cancel_json = {"status": "CANCELLED"}
-        _logger.debug("URL: %s ", self.query_id_url)
-        query_status = requests.put(
-            url=self.query_id_url,
-            json=cancel_json,
-            headers=self.header,
-            verify=self.verify_ssl,
+        _logger.debug("URL: %s ", query_id_url)
+        query_status = self._request(
+            "PUT", query_id_url, bounded=False, json=cancel_json
         )
         if query_status.status_code != requests.codes.ok:
             _logger.info("failed to cancel the query")
-            self.delete_query()
+            self.delete_query(query_id_url)
         else:
-            self.delete_query()
+            self.delete_query(query_id_url)
             self._description = tuple()
             self._result_set = tuple()
             self._arraysize = -1
@@ -443,24 +1333,17 @@ class connection(object):
 
             if self.database in ["realtime", "global", "timemachine"]:
 
-                _json_response = json.loads(response.content.decode("utf-8"))
+                _json_response = jsonbackend.loads(response.content)
                 self.query_id = _json_response["id"]
-                (query_response_json, json_result) = self.query_id_status()
+                self.query_id_url = self.query_job_url + "/" + self.query_id
+                self.active_jobs.add(self.query_id_url)
+                if self.journal is not None:
+                    self.journal.record(self.query_id, self._query_object)
+                progressive = self.database == "realtime" and self.progress is not None
+                query_response_json = self.query_id_status(until_columns=progressive)
 
                 if query_response_json["status"] == "ERROR":
-                    _logger.debug(query_response_json["error"])
-                    brief_messg = None
-                    detail_messg = None
-                    if "brief" in query_response_json["error"]["message"]:
-                        brief_messg = query_response_json["error"]["message"]["brief"]
-                    if "detail" in query_response_json["error"]["message"]:
-                        detail_messg = query_response_json["error"]["message"]["detail"]
-                    if not brief_messg and detail_messg:
-                        self._error = str(detail_messg)
-                    elif not detail_messg and brief_messg:
-                        self._error = str(brief_messg)
-                    else:
-                        self._error = str(brief_messg) + "\n" + str(detail_messg)
+                    self._error = self.job_error(query_response_json)
 
                     # reset all the property elements for tuples
                     self._result_set = tuple()
@@ -469,6 +1352,7 @@ class connection(object):
                     self._json_result = {}
                     self._arraysize = -1
 
+                    self.delete_query()
                     raise OperationalError(self._error)
 
                 if (
@@ -477,49 +1361,50 @@ class connection(object):
                     and len(query_response_json["columns"]) != 0
                 ):
 
-                    columns = []
-                    description_arr = []
-                    if self.database == "realtime":
-                        description_arr.append(
-                            tuple(("hostName", None, None, None, None, None, None))
-                        )
-                    for col in query_response_json["columns"]:
-                        columns.append(col["name"])
-                        description_arr.append(
-                            tuple((col["name"], None, None, None, None, None, None))
-                        )
-
-                    self._description = tuple(description_arr)
+                    columns = [col["name"] for col in query_response_json["columns"]]
+                    self._description = column_description(
+                        columns, realtime=self.database == "realtime"
+                    )
 
-                    if "items" in json_result and len(json_result["items"]) != 0:
-                        rows = []
-
-                        if self.database == "realtime":
-                            for item in json_result["items"]:
-                                row = []
-                                row.append(item["asset"]["hostName"])
-                                for col in columns:
-                                    if col in item["rowData"]:
-                                        row.append(item["rowData"][col])
-                                    else:
-                                        row.append(None)
-                                rows.append(tuple(row))
-                        else:
-                            for item in json_result["items"]:
-                                row = []
-                                for col in columns:
-                                    if col in item["rowData"]:
-                                        row.append(item["rowData"][col])
-                                    else:
-                                        row.append(None)
-                                rows.append(tuple(row))
-
-                        self._json_result = json_result
-                        self._result_set = rows
-                        self._arraysize = len(rows)
-                        self._rowcount = len(self._result_set)
+                    if query_response_json["status"] not in JOB_DONE:
+                        # The job is still running: show the rows of the
+                        # hosts that have responded while waiting for the
+                        # others.
+                        self.progressive = True
+                        self._pending_job = self.query_id_url
+                        self._pages = self.iter_progressive_pages(columns)
+                        self._result_set = self.iter_results(self._pages)
+                        return
+
+                    rowcount = query_response_json.get("rowCount")
+                    if rowcount == 0:
+                        # nothing to download
+                        self.delete_query()
+                        if self._cache_key is not None:
+                            empty = ResultSet(
+                                columns, hostname=self.database == "realtime"
+                            )
+                            self.result_cache.put(
+                                self._cache_key, self._description, empty
+                            )
+                        self._rowcount = self._arraysize = 0
+                        return
+
+                    # Rows are downloaded lazily; the job reports how many
+                    # there are so callers can size the result up front.
+                    self._pending_job = self.query_id_url
+                    self._pages = self.iter_result_pages(columns)
+                    if self._cache_key is not None:
+                        self._pages = self.result_cache.collect(
+                            self._cache_key, self._description, self._pages
+                        )
+                    self._result_set = self.iter_results(self._pages)
+                    self._rowcount = -1 if rowcount is None else rowcount
+                    self._arraysize = self._rowcount
+                else:
+                    self.delete_query()
             else:
-                json_result = json.loads(response.content.decode("utf-8"))
+                json_result = jsonbackend.loads(response.content)
                 rows = []
 
                 if "columns" in json_result and len(json_result["columns"]) != 0:
@@ -572,7 +1457,22 @@ class connection(object):
 
             raise OperationalError(response)
 
-    def get_tables(self):
+    def schema(self):
+        """Return the cached Schema of the current database."""
+        return self.schema_cache.get(self.database, self.fetch_schema)
+
+    def revalidate_schema(self):
+        """Check the cached schema of the current database against the
+        server. Return True if it changed."""
+        return self.schema_cache.revalidate(self.database, self.fetch_schema)
+
+    def fetch_schema(self, validators=None):
+        """Download the schema document of the current database.
+
+        Returns ``(content, validators)``. With the *validators* of a cached
+        copy the request is conditional and *content* is None when the
+        document has not been modified.
+        """
         if self.database == "global":
             final_url = self.global_schema_url
 
@@ -582,74 +1482,54 @@ class connection(object):
         if self.database == "timemachine":
             final_url = self.timemachine_schema_url
 
-        response = requests.get(
-            final_url, headers=self.header, verify=self.verify_ssl
-        )  # type: url response
+        headers = {}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        response = self._request("GET", final_url, headers=headers, bounded=False)
+        if response.status_code == requests.codes.not_modified:
+            return None, validators
         if response.status_code in [requests.codes.ok, requests.codes.bad]:
-            json_result = json.loads(response.content.decode("utf-8"))
-        else:
-            raise OperationalError(response)
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            return response.content, validators
+        raise OperationalError(response)
+
+    def get_tables(self):
+        schema = self.schema()
 
         description_arr = [("tableName", None, None, None, None, None, None)]
         self._description = tuple(description_arr)
-        rows = []
-        for items in json_result["tables"]:
-            rows.append(tuple((items["name"],)))
-        self._result_set = rows
-        self._arraysize = len(rows)
+        self._result_set = schema.table_rows
+        self._arraysize = len(self._result_set)
         self._rowcount = len(self._result_set)
         return self._result_set
 
     def get_tables_description(self, table_like=None):
-        if self.database == "global":
-            final_url = self.global_schema_url
-            description_arr = [
-                ("name", None, None, None, None, None, None),
-                ("description", None, None, None, None, None, None),
-            ]
-            self._description = tuple(description_arr)
+        schema = self.schema()
 
-        if self.database == "realtime":
-            description_arr = [
-                ("name", None, None, None, None, None, None),
-                ("description", None, None, None, None, None, None),
-            ]
-            self._description = tuple(description_arr)
-            final_url = self.realtime_schema_url
-
-        if self.database == "timemachine":
-            description_arr = [
-                ("name", None, None, None, None, None, None),
-                ("description", None, None, None, None, None, None),
-            ]
-            self._description = tuple(description_arr)
-            final_url = self.timemachine_schema_url
+        description_arr = [
+            ("name", None, None, None, None, None, None),
+            ("description", None, None, None, None, None, None),
+        ]
+        self._description = tuple(description_arr)
 
-        response = requests.get(
-            final_url, headers=self.header, verify=self.verify_ssl
-        )  # type: url response
-        if response.status_code in [requests.codes.ok, requests.codes.bad]:
-            json_result = json.loads(response.content.decode("utf-8"))
+        if table_like:
+            rows = [row for name, row in schema.tables.items() if table_like in name]
         else:
-            raise OperationalError(response)
-
-        rows = []
-        for items in json_result["tables"]:
-            if table_like:
-                if table_like in items["name"]:
-                    rows.append(
-                        tuple((items["name"], self.wrap_text(items["description"])))
-                    )
-            else:
-                rows.append(
-                    tuple((items["name"], self.wrap_text(items["description"])))
-                )
+            rows = list(schema.tables.values())
         self._result_set = rows
         self._arraysize = len(rows)
         self._rowcount = len(self._result_set)
         return self._result_set
 
     def get_columns(self, table_like=None):
+        schema = self.schema()
 
         description_arr = [
             ("tableName", None, None, None, None, None, None),
@@ -657,30 +1537,12 @@ class connection(object):
         ]
         self._description = tuple(description_arr)
 
-        if self.database == "global":
-            final_url = self.global_schema_url
-        if self.database == "realtime":
-            final_url = self.realtime_schema_url
-        if self.database == "timemachine":
-            final_url = self.timemachine_schema_url
-
-        response = requests.get(final_url, headers=self.header, verify=self.verify_ssl)
-
-        if response.status_code in [requests.codes.ok, requests.codes.bad]:
-            json_result = json.loads(response.content.decode("utf-8"))
+        if table_like:
+            rows = [
+                (table_like, col[0]) for col in schema.columns.get(table_like, ())
+            ]
         else:
-            raise OperationalError(response)
-
-        rows = []
-
-        for items in json_result["tables"]:
-            if table_like:
-                if table_like == items["name"]:
-                    for col in items["columns"]:
-                        rows.append(tuple((items["name"], col["name"])))
-            else:
-                for col in items["columns"]:
-                    rows.append(tuple((items["name"], col["name"])))
+            rows = schema.column_rows
         self._result_set = rows
         self._arraysize = len(rows)
         self._rowcount = len(self._result_set)
@@ -691,53 +1553,16 @@ class connection(object):
         if not table_like:
             raise OperationalError("ERROR: DESCRIBE requires a table name")
 
-        if self.database == "global":
-            final_url = self.global_schema_url
-            description_arr = [
-                ("name", None, None, None, None, None, None),
-                ("type", None, None, None, None, None, None),
-                ("description", None, None, None, None, None, None),
-            ]
-            self._description = tuple(description_arr)
-
-        if self.database == "realtime":
-            final_url = self.realtime_schema_url
-            description_arr = [
-                ("name", None, None, None, None, None, None),
-                ("type", None, None, None, None, None, None),
-                ("description", None, None, None, None, None, None),
-            ]
-            self._description = tuple(description_arr)
-
-        if self.database == "timemachine":
-            final_url = self.timemachine_schema_url
-            description_arr = [
-                ("name", None, None, None, None, None, None),
-                ("type", None, None, None, None, None, None),
-                ("description", None, None, None, None, None, None),
-            ]
-            self._description = tuple(description_arr)
-
-        response = requests.get(
-            final_url, headers=self.header, verify=self.verify_ssl
-        )  # type: url
+        schema = self.schema()
 
-        if response.status_code in [requests.codes.ok, requests.codes.bad]:
-            json_result = json.loads(response.content.decode("utf-8"))
-        else:
-            raise OperationalError(response)
+        description_arr = [
+            ("name", None, None, None, None, None, None),
+            ("type", None, None, None, None, None, None),
+            ("description", None, None, None, None, None, None),
+        ]
+        self._description = tuple(description_arr)
 
-        rows = []
-
-        for items in json_result["tables"]:
-            if table_like:
-                if table_like == items["name"]:
-                    for col in items["columns"]:
-                        if "description" in col:
-                            col_description = self.wrap_text(col["description"])
-                        else:
-                            col_description = None
-                        rows.append(tuple((col["name"], col["type"], col_description)))
+        rows = list(schema.columns.get(table_like, ()))
         self._result_set = rows
         self._arraysize = len(rows)
         self._rowcount = len(self._result_set)
@@ -764,33 +1589,70 @@ class connection(object):
     def __len__(self):
         if self._result_set is None:
             return 0
+        if not isinstance(self._result_set, (list, tuple)):
+            # streamed results only know the row count the job reported
+            return max(self._rowcount, 0)
         return len(self._result_set)
 
+    def __bool__(self):
+        if self._result_set is not None and not isinstance(
+            self._result_set, (list, tuple)
+        ):
+            # rows still to be read, even while their number is not known
+            # (a realtime query whose hosts are responding)
+            return self._rowcount != 0
+        return len(self) > 0
+
     # overloading list function for this class
     def __list__(self):
         return self._result_set
 
     def __iter__(self):
         self.num = 0
+        self._rows = iter(self._result_set)
         return self
 
     def __next__(self):
-        if self.num >= self._rowcount:
-            raise StopIteration
-        result = self._result_set[self.num]
+        result = next(self._rows)
         self.num += 1
         return result
 
     def next(self):
-        if self.num >= self._rowcount:
-            raise StopIteration
-        result = self._result_set[self.num]
-        self.num += 1
-        return result
+        return self.__next__()
+
+    def pages(self):
+        """Return an iterator over the rows that have not been read yet as
+        one ResultSet per results page, or per batch of rows of a running
+        realtime query."""
+        if isinstance(self._result_set, (list, tuple)):
+            return iter([self._result_set] if self._result_set else [])
+        return self._pages
 
     def fetchall(self):
 
         result_set = self._result_set
+        if not isinstance(result_set, (list, tuple)):
+            # Gather the pages that have not been read yet into a single
+            # columnar ResultSet rather than a list of row tuples. It is a
+            # new one: the pages may be held by the result cache.
+            result_set = None
+            resumed = False
+            while True:
+                try:
+                    for page in self._pages:
+                        if result_set is None:
+                            result_set = ResultSet(
+                                page.names, page.hostname, page.pools
+                            )
+                        result_set.concat(page)
+                    break
+                except ResultFetchError as e:
+                    if resumed or e.cursor is not self:
+                        raise
+                    # download the rest once more, after the rows gathered
+                    resumed = True
+                    self.refetch(e.offset)
+            result_set = result_set or tuple()
         self._result_set = tuple()
         self._rowcount = -1
         self._arraysize = -1
@@ -804,10 +1666,12 @@ class connection(object):
         raise NotSupportedError
 
     def close(self):
+        self.release_result()
         self._result_set = tuple()
         self._description = tuple()
         self._rowcount = -1
         self._status = False
         self._arraysize = -1
         self._json_result = {}
-        pass
+        if self._owns_session:
+            self.session.close()